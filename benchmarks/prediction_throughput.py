@@ -0,0 +1,193 @@
+"""Throughput benchmark of the U-Net prediction pipeline on synthetic volumes.
+
+Runs `ArrayPredictor` on a random volume with a randomly initialized `UNet3D` for each requested
+precision, number of prediction processes and number of data loading workers and reports wall
+time, throughput and the speedup over the first setting of each precision. For reduced
+precisions, the maximum and mean absolute deviation from the fp32 prediction is reported as well.
+
+With several processes, the torch threads (`--threads`, by default all cores) are divided among
+them, so the process scaling of a node can be measured at a fixed core count, e.g. on a 64 core
+node:
+
+    python benchmarks/prediction_throughput.py --shape 128 512 512 --threads 64 --processes 1 2 4 8 16
+
+Example:
+    python benchmarks/prediction_throughput.py --shape 64 256 256 --workers 0 2 4
+    python benchmarks/prediction_throughput.py --precisions fp32 bf16 fp16-accumulate
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from plantseg.functionals.prediction.utils.array_dataset import ArrayDataset
+from plantseg.functionals.prediction.utils.array_predictor import ArrayPredictor
+from plantseg.functionals.prediction.utils.precision import PRECISIONS
+from plantseg.functionals.prediction.utils.slice_builder import SliceBuilder
+from plantseg.functionals.prediction.utils.utils import get_stride_shape
+from plantseg.training.augs import get_test_augmentations
+from plantseg.training.model import UNet3D
+
+
+def synthetic_volume(shape: tuple[int, int, int], seed: int = 0) -> np.ndarray:
+    """A uint16 volume, converted to float32 patch by patch by the dataset."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 4096, size=shape, dtype="uint16")
+
+
+def build_model(f_maps: int) -> torch.nn.Module:
+    torch.manual_seed(0)
+    model = UNet3D(
+        in_channels=1,
+        out_channels=1,
+        f_maps=f_maps,
+        layer_order="gcr",
+        num_groups=8,
+        final_sigmoid=True,
+    )
+    return model.eval()
+
+
+def run_prediction(
+    model: torch.nn.Module,
+    raw: np.ndarray,
+    args: argparse.Namespace,
+    num_workers: int,
+    precision: str = "fp32",
+    num_processes: int = 1,
+) -> tuple[float, int, np.ndarray]:
+    """Predict `raw` once and return the wall time, the number of patches and the prediction."""
+    patch, halo = tuple(args.patch), tuple(args.halo)
+    slice_builder = SliceBuilder(
+        raw,
+        label_dataset=None,
+        patch_shape=patch,
+        stride_shape=get_stride_shape(patch, args.stride_ratio),
+    )
+    dataset = ArrayDataset(
+        raw,
+        slice_builder,
+        get_test_augmentations(raw),
+        halo_shape=halo,
+        verbose_logging=False,
+    )
+    predictor = ArrayPredictor(
+        model=model,
+        in_channels=1,
+        out_channels=1,
+        device=args.device,
+        patch=patch,
+        patch_halo=halo,
+        single_batch_mode=False,
+        headless=False,
+        disable_tqdm=True,
+        num_workers=num_workers,
+        prefetch_factor=args.prefetch_factor,
+        precision=precision,
+        num_processes=num_processes,
+    )
+    start = time.perf_counter()
+    prediction = predictor(dataset)
+    return time.perf_counter() - start, len(dataset), prediction
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description="U-Net prediction throughput benchmark"
+    )
+    parser.add_argument("--shape", type=int, nargs=3, default=[64, 256, 256])
+    parser.add_argument("--patch", type=int, nargs=3, default=[32, 128, 128])
+    parser.add_argument("--halo", type=int, nargs=3, default=[8, 16, 16])
+    parser.add_argument("--stride-ratio", type=float, default=0.75)
+    parser.add_argument("--f-maps", type=int, default=16)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[0, 2, 4],
+        help="Numbers of data loading workers to compare",
+    )
+    parser.add_argument("--prefetch-factor", type=int, default=2)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="Numbers of CPU prediction processes to compare, sharing the torch threads",
+    )
+    parser.add_argument(
+        "--precisions",
+        type=str,
+        nargs="+",
+        default=["fp32"],
+        choices=PRECISIONS,
+        help="Precisions to compare, deviations are reported against fp32",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=None, help="torch intra-op threads"
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=2, help="Runs per setting, the best is kept"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    raw = synthetic_volume(tuple(args.shape))
+    model = build_model(args.f_maps)
+    n_voxels = int(np.prod(args.shape))
+
+    print(
+        f"volume {tuple(args.shape)}, patch {tuple(args.patch)}, halo {tuple(args.halo)}, "
+        f"device {args.device}, torch threads {torch.get_num_threads()}"
+    )
+    print(
+        f"{'precision':>16} {'procs':>6} {'workers':>8} {'seconds':>9} {'patches/s':>10} "
+        f"{'Mvoxel/s':>9} {'speedup':>8} {'max |err|':>10} {'mean |err|':>10}"
+    )
+
+    # data loading workers are not used within prediction processes
+    settings = [
+        (num_processes, num_workers)
+        for num_processes in args.processes
+        for num_workers in (args.workers if num_processes == 1 else [0])
+    ]
+    reference = None
+    for precision in ["fp32"] + [p for p in args.precisions if p != "fp32"]:
+        precision_reference, baseline = None, None
+        for num_processes, num_workers in settings:
+            timings = []
+            for _ in range(args.repeats):
+                elapsed, n_patches, prediction = run_prediction(
+                    model, raw, args, num_workers, precision, num_processes
+                )
+                timings.append(elapsed)
+
+            if precision_reference is None:
+                precision_reference = prediction
+            assert np.allclose(prediction, precision_reference, atol=1e-5), (
+                "Prediction changed with the number of workers or processes"
+            )
+            if reference is None:
+                reference = prediction
+            error = np.abs(prediction - reference)
+
+            best = min(timings)
+            if baseline is None:
+                baseline = best
+            print(
+                f"{precision:>16} {num_processes:>6} {num_workers:>8} {best:>9.2f} "
+                f"{n_patches / best:>10.2f} {n_voxels / best / 1e6:>9.2f} {baseline / best:>8.2f} "
+                f"{error.max():>10.2e} {error.mean():>10.2e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -33,12 +33,18 @@ PATH_RAW2SEG_TEMPLATE = PATH_RESOURCES / FILE_RAW2SEG_TEMPLATE
 # Files in user home
 DIR_PLANTSEG_MODELS = ".plantseg_models"
 DIR_CONFIGS = "configs"
+DIR_COMPILED_MODELS = "compiled"
+DIR_PREDICTION_CACHE = "prediction_cache"
 FILE_MODEL_ZOO_CUSTOM = "custom_zoo.yaml"
+FILE_AUTOTUNE = "autotune.json"
 
 PATH_HOME = Path(getenv("PLANTSEG_HOME", str(Path.home())))
 
 PATH_PLANTSEG_MODELS = PATH_HOME / DIR_PLANTSEG_MODELS
 PATH_CONFIGS = PATH_PLANTSEG_MODELS / DIR_CONFIGS
+PATH_COMPILED_MODELS = PATH_PLANTSEG_MODELS / DIR_COMPILED_MODELS
+PATH_AUTOTUNE = PATH_PLANTSEG_MODELS / FILE_AUTOTUNE
+PATH_PREDICTION_CACHE = PATH_PLANTSEG_MODELS / DIR_PREDICTION_CACHE
 PATH_MODEL_ZOO_CUSTOM = PATH_PLANTSEG_MODELS / FILE_MODEL_ZOO_CUSTOM
 
 PATH_CONFIGS.mkdir(parents=True, exist_ok=True)
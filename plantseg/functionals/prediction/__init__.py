@@ -1,7 +1,14 @@
-from plantseg.functionals.prediction.prediction import biio_prediction, unet_prediction
+from plantseg.functionals.prediction.prediction import (
+    biio_prediction,
+    unet_prediction,
+    unet_prediction_batch,
+    unet_prediction_ensemble,
+)
 
 # Use __all__ to let type checkers know what is part of the public API.
 __all__ = [
     "unet_prediction",
+    "unet_prediction_batch",
+    "unet_prediction_ensemble",
     "biio_prediction",
 ]
@@ -1,6 +1,7 @@
 import logging
+from collections import defaultdict
 from pathlib import Path
-from typing import assert_never
+from typing import Sequence, assert_never
 
 import numpy as np
 import torch
@@ -11,33 +12,115 @@ from bioimageio.core.tensor import Tensor
 from bioimageio.spec import load_model_description
 from bioimageio.spec.model import v0_4, v0_5
 from bioimageio.spec.model.v0_5 import TensorId
+from scipy.ndimage import binary_dilation
 
-from plantseg.core.zoo import model_zoo
 from plantseg.functionals.dataprocessing.dataprocessing import (
     ImageLayout,
     fix_layout_to_CZYX,
     fix_layout_to_ZYX,
+    image_rescale,
 )
 from plantseg.functionals.prediction.utils.array_dataset import ArrayDataset
 from plantseg.functionals.prediction.utils.array_predictor import ArrayPredictor
+from plantseg.functionals.prediction.utils.autotune import autotune_prediction
+from plantseg.functionals.prediction.utils.backends import Backend
+from plantseg.functionals.prediction.utils.biio_tiling import (
+    biio_predict_tiled,
+    spatial_axis_sizes,
+)
+from plantseg.functionals.prediction.utils.blending import BlendingMode, OutputDtype
+from plantseg.functionals.prediction.utils.ensemble_predictor import EnsemblePredictor
+from plantseg.functionals.prediction.utils.lazy_predictor import LazyPredictor
+from plantseg.functionals.prediction.utils.model_cache import CachedModel, load_model
+from plantseg.functionals.prediction.utils.precision import Precision
+from plantseg.functionals.prediction.utils.prediction_cache import (
+    PredictionCache,
+    prediction_cache_key,
+)
 from plantseg.functionals.prediction.utils.size_finder import (
+    _is_2d_model,
+    available_memory_bytes,
     find_a_max_patch_shape,
+    find_batch_size,
+    find_batch_size_by_memory,
     find_patch_and_halo_shapes,
+    find_slice_patch_and_halo_shapes,
+)
+from plantseg.functionals.prediction.utils.slice_builder import (
+    ForegroundSliceBuilder,
+    MaskSliceBuilder,
+    SliceBuilder,
+)
+from plantseg.functionals.prediction.utils.utils import (
+    TILING_POLICIES,
+    TilingPolicy,
+    count_input_voxels,
+    find_exact_tiling_patch_shape,
+    get_stride_shape,
+    halo_covers_receptive_field,
 )
-from plantseg.functionals.prediction.utils.slice_builder import SliceBuilder
-from plantseg.functionals.prediction.utils.utils import get_stride_shape
 from plantseg.training.augs import get_test_augmentations
 
 logger = logging.getLogger(__name__)
 
+# activation memory of the z-slices a 2D model predicts per forward pass on CPU
+CPU_SLICE_BATCH_BYTES = 64 * 1024**2
+
 
 def biio_prediction(
     raw: np.ndarray,
     input_layout: ImageLayout,
     model_id: str,
+    block_shape: tuple[int, int, int] | None = None,
+    halo_shape: tuple[int, int, int] | None = None,
+    stride_ratio: float = 0.75,
+    blending: BlendingMode = "uniform",
+    device: str | None = None,
+    disable_tqdm: bool = False,
 ) -> dict[str, np.ndarray]:
+    """Predict `raw` with a BioImage.IO model.
+
+    The input is predicted in overlapping blocks (see `biio_tiling`) if the RDF states the valid input
+    sizes of the model, otherwise as a whole by `bioimageio.core`.
+
+    Args:
+        raw (np.ndarray): Raw input data.
+        input_layout (ImageLayout): The layout of the input data.
+        model_id (str): The BioImage.IO model ID, e.g. 'philosophical-panda', or a path or URL to its RDF.
+        block_shape (tuple[int, int, int] | None): Block shape, halo included, ZYX. Defaults to None,
+            i.e. the largest valid block fitting in the available memory.
+        halo_shape (tuple[int, int, int] | None): Halo of the blocks, ZYX. Defaults to None, i.e. from the RDF.
+        stride_ratio (float): Stride between blocks as a fraction of the block shape without halo.
+        blending (BlendingMode): Weighting of overlapping blocks, see `PatchAccumulator`.
+        device (str | None): The computation device. Defaults to None, i.e. 'cuda' if available.
+        disable_tqdm (bool): If True, disables the tqdm progress bar.
+
+    Returns:
+        dict[str, np.ndarray]: CZYX prediction of each model output.
+    """
     assert isinstance(input_layout, str)
     model = load_model_description(model_id, perform_io_checks=False)
+
+    axis_sizes = spatial_axis_sizes(model)
+    if axis_sizes is not None and len(model.inputs) == 1:
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        return biio_predict_tiled(
+            model,
+            raw,
+            input_layout,
+            axis_sizes,
+            block_shape=block_shape,
+            halo_shape=halo_shape,
+            stride_ratio=stride_ratio,
+            blending=blending,
+            device=device,
+            disable_tqdm=disable_tqdm,
+        )
+    logger.warning(
+        "The valid input sizes of the model are not given in its RDF, predicting the input as a whole."
+    )
+
     if isinstance(model, v0_4.ModelDescr):
         input_ids = [input_tensor.name for input_tensor in model.inputs]
     elif isinstance(model, v0_5.ModelDescr):
@@ -155,6 +238,185 @@ def biio_prediction(
     return named_pmaps  # list of CZYX arrays
 
 
+def _model_halo(cached_model: CachedModel) -> tuple[int, int, int]:
+    try:
+        logger.info("Computing theoretical minimum halo from model.")
+        return cached_model.halo
+    except Exception:
+        logger.warning(
+            "Could not compute halo from model. Using 0 halo size, you may experience edge artifacts."
+        )
+        return (0, 0, 0)
+
+
+def _auto_patch_and_halo_shapes(
+    model,
+    raw_shape: tuple[int, int, int],
+    maximum_patch_shape: tuple[int, int, int],
+    patch_halo: tuple[int, int, int],
+) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+    if _is_2d_model(model):
+        return find_slice_patch_and_halo_shapes(
+            raw_shape, maximum_patch_shape, patch_halo
+        )
+    return find_patch_and_halo_shapes(
+        raw_shape, maximum_patch_shape, patch_halo, both_sides=False
+    )
+
+
+def _slices_per_pass(
+    model,
+    in_channels: int,
+    patch: tuple[int, int, int],
+    patch_halo: tuple[int, int, int],
+    device: str,
+    precision: Precision,
+) -> int:
+    """Number of (1, Y, X) patches a 2D model can predict in one forward pass.
+
+    On CPU, batching only saves per-call overhead, while activations outgrowing the cache slow
+    the convolutions down, so the batch is limited to `CPU_SLICE_BATCH_BYTES` of activations.
+    """
+    if device == "cpu":
+        input_shape = tuple(p + 2 * h for p, h in zip(patch, patch_halo))
+        return find_batch_size_by_memory(
+            model,
+            in_channels,
+            input_shape,
+            min(available_memory_bytes(device) // 2, CPU_SLICE_BATCH_BYTES),
+            bytes_per_element=4 if precision == "fp32" else 2,
+        )
+    return find_batch_size(model, in_channels, patch, patch_halo, device)
+
+
+def _slab_depth(n_z: int, n_slices: int) -> int:
+    """Depth of z-slabs of at most `n_slices` slices covering `n_z` slices in as few, even slabs as possible."""
+    n_slabs = -(-n_z // max(n_slices, 1))
+    return -(-n_z // n_slabs)
+
+
+def _overlap_free_tiling(
+    cached_model: CachedModel,
+    volume_shape: tuple[int, int, int],
+    patch: tuple[int, int, int],
+    patch_halo: tuple[int, int, int],
+    stride_ratio: float,
+    resize_patch: bool,
+    is_2d_model: bool,
+) -> tuple[tuple[int, int, int], float]:
+    """Patch shape and stride ratio of the `'auto'` tiling policy, see `unet_prediction`."""
+    try:
+        model_halo = cached_model.halo
+    except Exception:
+        logger.warning(
+            "Could not compute the receptive field of the model, tiling with overlap."
+        )
+        return patch, stride_ratio
+    if not halo_covers_receptive_field(volume_shape, patch, patch_halo, model_halo):
+        logger.info(
+            f"Halo {patch_halo} does not cover the receptive field halo {model_halo}, tiling with overlap."
+        )
+        return patch, stride_ratio
+
+    exact_patch = (
+        find_exact_tiling_patch_shape(volume_shape, patch) if resize_patch else patch
+    )
+    stride = get_stride_shape(patch, stride_ratio)
+    if is_2d_model:
+        stride[0] = patch[0]
+    overlapping = count_input_voxels(volume_shape, patch, patch_halo, stride)
+    exact = count_input_voxels(volume_shape, exact_patch, patch_halo, exact_patch)
+    logger.info(
+        f"Halo {patch_halo} covers the receptive field halo {model_halo}: tiling without overlap "
+        f"in patches of shape {exact_patch}, {1 - exact / overlapping:.0%} less compute than "
+        f"with stride ratio {stride_ratio}."
+    )
+    return exact_patch, 1.0
+
+
+def _fix_prediction_layout(
+    raw, input_layout: ImageLayout, in_channels: int
+) -> tuple[np.ndarray, bool]:
+    """`raw` in CZYX layout for multi-channel models, ZYX otherwise, and whether it is CZYX."""
+    if int(in_channels) > 1:  # if multi-channel input
+        return fix_layout_to_CZYX(raw, input_layout), True
+    return fix_layout_to_ZYX(raw, input_layout), False
+
+
+def _coarse_to_fine_estimate(
+    coarse_pmaps: np.ndarray, volume_shape: tuple[int, int, int], threshold: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Upsampled background estimate and boundary region mask of the prediction of a downsampled volume.
+
+    The mask is on the coarse grid and dilated by one coarse voxel, so patches next to boundary signal
+    are predicted at full resolution as well.
+    """
+    factor = (1,) + tuple(s / c for s, c in zip(volume_shape, coarse_pmaps.shape[1:]))
+    background = image_rescale(coarse_pmaps, factor, order=1).astype("float32")
+    mask = binary_dilation(coarse_pmaps.max(axis=0) > threshold)
+    return background, mask
+
+
+def _prediction_dataset(
+    raw,
+    input_layout: ImageLayout,
+    in_channels: int,
+    patch: tuple[int, int, int],
+    patch_halo: tuple[int, int, int],
+    stride_ratio: float,
+    skip_background: bool = False,
+    stats_subsampling: int = 1,
+    is_2d_model: bool = False,
+    region_mask: np.ndarray | None = None,
+) -> ArrayDataset:
+    """Dataset of the halo-padded, normalized patches of `raw` in ZYX or CZYX layout.
+
+    For 2D models, patches are stacks of z-slices predicted independently, so they do not overlap in z.
+    If `region_mask` is given, only the patches overlapping it are kept. It is a ZYX mask of a
+    downsampled copy of `raw` and takes precedence over `skip_background`.
+    """
+    raw, multichannel_input = _fix_prediction_layout(raw, input_layout, in_channels)
+
+    stride = get_stride_shape(patch, stride_ratio)
+    if is_2d_model:
+        stride[0] = patch[0]
+    if region_mask is not None:
+        slice_builder = MaskSliceBuilder(
+            raw,
+            label_dataset=None,
+            patch_shape=patch,
+            stride_shape=stride,
+            mask=region_mask,
+            downsampling=tuple(
+                s / m for s, m in zip(raw.shape[-3:], region_mask.shape)
+            ),
+            halo_shape=patch_halo,
+        )
+    elif skip_background:
+        slice_builder = ForegroundSliceBuilder(
+            raw,
+            label_dataset=None,
+            patch_shape=patch,
+            stride_shape=stride,
+            halo_shape=patch_halo,
+        )
+    else:
+        slice_builder = SliceBuilder(
+            raw, label_dataset=None, patch_shape=patch, stride_shape=stride
+        )
+    # global normalization statistics are streamed slab by slab over the original dtype,
+    # patches are converted to float32 one at a time by the dataset
+    augs = get_test_augmentations(raw, subsampling=stats_subsampling)
+    return ArrayDataset(
+        raw,
+        slice_builder,
+        augs,
+        halo_shape=patch_halo,
+        multichannel=multichannel_input,
+        verbose_logging=False,
+    )
+
+
 def unet_prediction(
     raw: np.ndarray,
     input_layout: ImageLayout,
@@ -169,16 +431,52 @@ def unet_prediction(
     config_path: Path | None = None,
     model_weights_path: Path | None = None,
     tracker=None,
+    output_path: Path | None = None,
+    output_key: str = "predictions",
+    stride_ratio: float = 0.75,
+    blending: BlendingMode = "uniform",
+    num_workers: int = 0,
+    prefetch_factor: int = 2,
+    precision: Precision = "fp32",
+    backend: Backend = "eager",
+    autotune: bool = False,
+    skip_background: bool = False,
+    background_value: float = 0.0,
+    stats_subsampling: int = 1,
+    num_processes: int = 1,
+    use_cache: bool = False,
+    cache_dir: Path | None = None,
+    cache_max_gb: float = 20.0,
+    pyramid: bool = False,
+    pyramid_downsampling: tuple[int, int, int] = (2, 4, 4),
+    pyramid_threshold: float = 0.3,
+    output_channels: Sequence[int] | None = None,
+    output_dtype: OutputDtype = "float32",
+    tiling: TilingPolicy = "overlap",
 ) -> np.ndarray:
     """Generate prediction from raw data using a specified 3D U-Net model.
 
     This function handles both single and multi-channel outputs from the model,
     returning appropriately shaped arrays based on the output channel configuration.
 
+    If `output_path` is given, the prediction runs out-of-core: `raw` may be any array-like volume
+    (e.g. a `h5py.Dataset` or `zarr.Array` in ZYX or CZYX layout), patches are read on demand and
+    the prediction is streamed into a chunked Zarr/HDF5 dataset, so memory usage does not depend
+    on the size of the volume.
+
+    2D models applied to a ZYX stack predict slabs of z-slices, which are folded into the batch
+    dimension of a single forward pass. If `patch` is None, whole XY planes are used when they fit
+    in memory, the XY halo is only added along tiled axes, and the slab depth is the number of
+    slices fitting in one forward pass.
+
     For Bioimage.IO Model Zoo models, weights are downloaded and loaded into `UNet3D` or `UNet2D`
     in `plantseg.training.model`, i.e. `bioimageio.core` is not used. `biio_prediction()` uses
     `bioimageio.core` for loading and running models.
 
+    With `pyramid=True`, a copy of `raw` downsampled by `pyramid_downsampling` is predicted first. Only the
+    patches overlapping its boundary signal (probability above `pyramid_threshold`) are then predicted at
+    full resolution, the rest of the volume keeps the upsampled coarse prediction.
+
     Args:
         raw (np.ndarray): Raw input data.
         Input_layout (ImageLayout): The layout of the input data.
@@ -192,97 +490,541 @@ def unet_prediction(
         disable_tqdm (bool, optional): If True, disables the tqdm progress bar. Defaults to False.
         config_path (Path | None, optional): Path to the model configuration file. Defaults to None.
         model_weights_path (Path | None, optional): Path to the model weights file. Defaults to None.
+        output_path (Path | None, optional): Zarr or HDF5 file to stream the prediction into. Defaults to None.
+        output_key (str, optional): Dataset key in `output_path`. Defaults to "predictions".
+        stride_ratio (float, optional): Stride between patches as a fraction of the patch shape. Defaults to 0.75.
+        blending (BlendingMode, optional): Weighting of overlapping patches. 'uniform' averages them,
+            'gaussian' and 'cosine' down-weight patch borders to suppress seams. Defaults to 'uniform'.
+        num_workers (int, optional): Number of worker processes preparing patches during prediction. Defaults to 0.
+        prefetch_factor (int, optional): Number of batches prepared ahead by each worker. Defaults to 2.
+        precision (Precision, optional): Precision of the forward pass. 'bf16' and 'fp16-accumulate' run the
+            model under autocast with channels-last convolutions, trading a small deviation from the
+            'fp32' output for speed. Defaults to 'fp32'.
+        backend (Backend, optional): Inference backend. 'torchscript' and 'onnx' export the model once and
+            cache it under `~/.plantseg_models/compiled`, 'compile' uses `torch.compile`. Falls back to
+            'eager' if the export fails. Defaults to 'eager'.
+        autotune (bool, optional): If True and `patch` is None, time a few patch shapes, batch sizes and thread
+            counts fitting in memory and use the fastest, overriding `single_batch_mode`. The result is stored in
+            `~/.plantseg_models/autotune.json` per model architecture, device and host. Defaults to False.
+        skip_background (bool, optional): If True, threshold a subsampled copy of `raw` and skip the patches
+            without foreground in them or their halo, so runtime scales with the tissue volume. Defaults to False.
+        background_value (float, optional): Prediction of the skipped patches. Defaults to 0.
+        stats_subsampling (int, optional): Stride along each axis used to estimate the global normalization
+            statistics, e.g. 4 reads 1/64 of a 3D volume. Defaults to 1, i.e. every voxel.
+        num_processes (int, optional): Number of CPU processes, each predicting a shard of the patches with
+            its own model copy into a shared-memory output. Not supported with `output_path`. Defaults to 1.
+        use_cache (bool, optional): If True, load the prediction from an on-disk cache keyed by a hash of `raw`,
+            the model weights and the prediction parameters, or store it there after predicting. Not supported
+            with `output_path`. Defaults to False.
+        cache_dir (Path | None, optional): Directory of the prediction cache. Defaults to None, i.e.
+            `~/.plantseg_models/prediction_cache`.
+        cache_max_gb (float, optional): Size of the prediction cache on disk, least-recently used predictions
+            are evicted beyond it. Defaults to 20.
+        pyramid (bool, optional): If True, predict coarse-to-fine, see above. Takes precedence over
+            `skip_background` and is not supported with `output_path`. Defaults to False.
+        pyramid_downsampling (tuple[int, int, int], optional): Downsampling factors of the coarse copy, ZYX. The
+            z factor is ignored for 2D models. Defaults to (2, 4, 4).
+        pyramid_threshold (float, optional): Coarse probability above which a region is predicted at full
+            resolution. Defaults to 0.3.
+        output_channels (Sequence[int] | None, optional): Indices of the output channels to return, the others
+            are never accumulated. Defaults to None, i.e. all channels.
+        output_dtype (OutputDtype, optional): Dtype of the prediction, 'float32', 'float16' or 'uint8'. 'uint8'
+            maps probabilities in [0, 1] to 0-255 while blending, so the prediction takes a quarter of the
+            memory. Defaults to 'float32'.
+        tiling (TilingPolicy, optional): 'overlap' tiles with `stride_ratio`. 'auto' tiles without overlap if the
+            halo covers the receptive field of the model along every tiled axis, and then, if `patch` is None,
+            shrinks the patch to split the volume evenly. Defaults to 'overlap'.
 
     Returns:
         np.ndarray: The predicted boundaries as a 3D (Z, Y, X) or 4D (C, Z, Y, X) array, normalized between 0 and 1.
+            If `output_path` is given, the read-only on-disk (C, Z, Y, X) dataset is returned instead. An HDF5
+            dataset keeps its file open: close it with `pmaps.file.close()` once done.
 
     Raises:
         ValueError: If neither `model_name`, `model_id`, nor `config_path` are provided.
     """
 
-    if config_path is not None:  # Safari mode for custom models outside zoos
-        logger.info("Safari prediction: Running model from custom config path.")
-        model, model_config, model_path = model_zoo.get_model_by_config_path(
-            config_path, model_weights_path
+    # models are built, loaded and prepared for `device` once per process
+    cached_model = load_model(
+        model_name=model_name,
+        model_id=model_id,
+        config_path=config_path,
+        model_weights_path=model_weights_path,
+        model_update=model_update,
+        device=device,
+        precision=precision,
+    )
+    model, model_config = cached_model.model, cached_model.model_config
+
+    if patch_halo is None:
+        patch_halo = _model_halo(cached_model)
+
+    is_2d_model = _is_2d_model(model)
+    tuned, batch_size = None, None
+    auto_patch = patch is None
+    if patch is None:
+        if autotune:
+            tuned = autotune_prediction(
+                model, model_config["in_channels"], patch_halo, device, precision
+            )
+            maximum_patch_shape = tuned.input_shape
+            batch_size = tuned.batch_size
+        else:
+            maximum_patch_shape = find_a_max_patch_shape(
+                model, model_config["in_channels"], device
+            )
+        raw_shape = raw.shape if input_layout == "ZYX" else (1,) + raw.shape
+        assert len(raw_shape) == 3
+        patch, patch_halo = _auto_patch_and_halo_shapes(
+            model, raw_shape, maximum_patch_shape, patch_halo
+        )
+        if is_2d_model and raw_shape[0] > 1:
+            # stack as many z-slices per patch as fit in one forward pass
+            n_slices = batch_size or _slices_per_pass(
+                model, model_config["in_channels"], patch, patch_halo, device, precision
+            )
+            patch = (_slab_depth(raw_shape[0], n_slices),) + patch[1:]
+            batch_size = 1
+
+    if tiling == "auto":
+        volume_shape = _fix_prediction_layout(
+            raw, input_layout, model_config["in_channels"]
+        )[0].shape[-3:]
+        patch, stride_ratio = _overlap_free_tiling(
+            cached_model,
+            volume_shape,
+            patch,
+            patch_halo,
+            stride_ratio,
+            resize_patch=auto_patch,
+            is_2d_model=is_2d_model,
+        )
+    elif tiling != "overlap":
+        raise ValueError(
+            f"Unknown tiling policy {tiling}, select one of {TILING_POLICIES}"
+        )
+
+    logger.info(
+        f"For raw in shape {raw.shape}: set patch shape {patch}, set halo shape {patch_halo}"
+    )
+
+    cache, cache_key = None, None
+    if use_cache and output_path is not None:
+        logger.warning("The prediction cache is not used with `output_path`.")
+    elif use_cache:
+        cache = PredictionCache(cache_dir, max_bytes=int(cache_max_gb * 1024**3))
+        cache_key = prediction_cache_key(
+            raw,
+            model,
+            input_layout=input_layout,
+            patch=patch,
+            patch_halo=patch_halo,
+            stride_ratio=stride_ratio,
+            blending=blending,
+            precision=precision,
+            backend=backend,
+            skip_background=skip_background,
+            background_value=background_value,
+            stats_subsampling=stats_subsampling,
+            pyramid=pyramid,
+            pyramid_downsampling=pyramid_downsampling,
+            pyramid_threshold=pyramid_threshold,
+            output_channels=output_channels,
+            output_dtype=output_dtype,
+        )
+        pmaps = cache.get(cache_key)
+        if pmaps is not None:
+            logger.info(f"Loaded prediction {cache_key} from {cache.cache_dir}")
+            return pmaps
+
+    region_mask = None
+    if pyramid and output_path is not None:
+        logger.warning("Coarse-to-fine prediction is not supported with `output_path`.")
+    elif pyramid:
+        raw_fixed, multichannel_input = _fix_prediction_layout(
+            raw, input_layout, model_config["in_channels"]
+        )
+        volume_shape = raw_fixed.shape[-3:]
+        if is_2d_model:
+            pyramid_downsampling = (1,) + tuple(pyramid_downsampling[1:])
+        # patches must be at least 64 voxels in Y and X, see `SliceBuilder`
+        factor = (1,) * (raw_fixed.ndim - 3) + tuple(
+            1 / max(min(d, s // m), 1)
+            for d, s, m in zip(pyramid_downsampling, volume_shape, (1, 64, 64))
+        )
+        coarse_raw = image_rescale(np.asarray(raw_fixed), factor, order=1)
+        logger.info(f"Predicting a coarse copy of shape {coarse_raw.shape}")
+        coarse_pmaps = unet_prediction(
+            coarse_raw,
+            "CZYX" if multichannel_input else "ZYX",
+            model_name,
+            model_id,
+            device=device,
+            disable_tqdm=disable_tqdm,
+            config_path=config_path,
+            model_weights_path=model_weights_path,
+            stride_ratio=stride_ratio,
+            blending=blending,
+            precision=precision,
+            backend=backend,
+            autotune=autotune,
+            stats_subsampling=stats_subsampling,
+            output_channels=output_channels,
+            tiling=tiling,
         )
-    elif model_id is not None:  # BioImage.IO zoo mode
-        logger.info("BioImage.IO prediction: Running model from BioImage.IO model zoo.")
-        model, model_config, model_path = model_zoo.get_model_by_id(model_id)
-    elif model_name is not None:  # PlantSeg zoo mode
-        logger.info("Zoo prediction: Running model from PlantSeg official zoo.")
-        model, model_config, model_path = model_zoo.get_model_by_name(
-            model_name, model_update=model_update
+        background_value, region_mask = _coarse_to_fine_estimate(
+            coarse_pmaps, volume_shape, pyramid_threshold
         )
+        logger.info(
+            f"Boundary signal in {region_mask.mean():.1%} of the coarse prediction"
+        )
+
+    predictor_kwargs = {
+        "model": model,
+        "in_channels": model_config["in_channels"],
+        "out_channels": model_config["out_channels"],
+        "device": device,
+        "patch": patch,
+        "patch_halo": patch_halo,
+        "single_batch_mode": single_batch_mode,
+        "headless": False,
+        "verbose_logging": False,
+        "disable_tqdm": disable_tqdm,
+        "tracker": tracker,
+        "blending": blending,
+        "num_workers": num_workers,
+        "prefetch_factor": prefetch_factor,
+        "precision": precision,
+        "backend": backend,
+        "batch_size": batch_size,
+        "num_threads": tuned.num_threads if tuned is not None else None,
+        "background_value": background_value,
+        "output_channels": output_channels,
+        "output_dtype": output_dtype,
+    }
+    if output_path is not None:
+        if num_processes > 1:
+            logger.warning(
+                "Multi-process prediction is not supported with `output_path`, using one process."
+            )
+        predictor = LazyPredictor(
+            **predictor_kwargs, output_path=output_path, output_key=output_key
+        )
+    else:
+        predictor = ArrayPredictor(**predictor_kwargs, num_processes=num_processes)
+
+    test_dataset = _prediction_dataset(
+        raw,
+        input_layout,
+        model_config["in_channels"],
+        patch,
+        patch_halo,
+        stride_ratio,
+        skip_background=skip_background,
+        stats_subsampling=stats_subsampling,
+        is_2d_model=is_2d_model,
+        region_mask=region_mask,
+    )
+
+    pmaps = predictor(test_dataset)  # pmaps either (C, Z, Y, X) or (C, Y, X)
+    if cache is not None:
+        cache.put(cache_key, pmaps)
+    return pmaps
+
+
+def unet_prediction_batch(
+    raws: Sequence[np.ndarray],
+    input_layout: ImageLayout | Sequence[ImageLayout],
+    model_name: str | None,
+    model_id: str | None,
+    patch: tuple[int, int, int] | None = None,
+    patch_halo: tuple[int, int, int] | None = None,
+    batch_size: int | None = None,
+    device: str = "cuda",
+    model_update: bool = False,
+    disable_tqdm: bool = False,
+    config_path: Path | None = None,
+    model_weights_path: Path | None = None,
+    tracker=None,
+    stride_ratio: float = 0.75,
+    blending: BlendingMode = "uniform",
+    num_workers: int = 0,
+    prefetch_factor: int = 2,
+    precision: Precision = "fp32",
+    backend: Backend = "eager",
+) -> list[np.ndarray]:
+    """Generate predictions for many images, e.g. a directory of small 2D images, in shared batches.
+
+    The model is loaded and the patch shape is determined once per input shape. Inputs of the same
+    shape and layout are predicted by one `ArrayPredictor`, whose batches mix patches of different
+    images. Each image is normalized and blended on its own, so its prediction is the same as the
+    one of `unet_prediction` with the same patch and halo.
+
+    Args:
+        raws (Sequence[np.ndarray]): Raw input images.
+        input_layout (ImageLayout | Sequence[ImageLayout]): The layout of all inputs, or one per input.
+        model_name (str | None): The name of the model to use.
+        model_id (str | None): The ID of the model from the BioImage.IO model zoo.
+        patch (tuple[int, int, int], optional): Patch size for prediction. Defaults to None, i.e. determined
+            from the input shape like in `unet_prediction`.
+        patch_halo (tuple[int, int, int] | None, optional): Halo size around patches. Defaults to None.
+        batch_size (int | None, optional): Number of patches per forward pass. Defaults to None, i.e. the
+            largest batch fitting in memory (at most 32 on CPU).
+        device (str, optional): The computation device ('cpu', 'cuda', etc.). Defaults to 'cuda'.
+        model_update (bool, optional): Whether to update the model to the latest version. Defaults to False.
+        disable_tqdm (bool, optional): If True, disables the tqdm progress bar. Defaults to False.
+        config_path (Path | None, optional): Path to the model configuration file. Defaults to None.
+        model_weights_path (Path | None, optional): Path to the model weights file. Defaults to None.
+        stride_ratio (float, optional): Stride between patches as a fraction of the patch shape. Defaults to 0.75.
+        blending (BlendingMode, optional): Weighting of overlapping patches. Defaults to 'uniform'.
+        num_workers (int, optional): Number of worker processes preparing patches. Defaults to 0.
+        prefetch_factor (int, optional): Number of batches prepared ahead by each worker. Defaults to 2.
+        precision (Precision, optional): Precision of the forward pass. Defaults to 'fp32'.
+        backend (Backend, optional): Inference backend. Defaults to 'eager'.
+
+    Returns:
+        list[np.ndarray]: The (C, Z, Y, X) prediction of each input, in order.
+    """
+    if isinstance(input_layout, str):
+        input_layouts = [input_layout] * len(raws)
     else:
+        input_layouts = list(input_layout)
+    if len(input_layouts) != len(raws):
         raise ValueError(
-            "Either `model_name` or `model_id` or `model_path` must be provided."
+            f"Got {len(input_layouts)} input layouts for {len(raws)} inputs."
         )
-    state = torch.load(model_path, map_location="cpu", weights_only=True)
 
-    if "model_state_dict" in state:  # Model weights format may vary between versions
-        state = state["model_state_dict"]
-    model.load_state_dict(state)
+    cached_model = load_model(
+        model_name=model_name,
+        model_id=model_id,
+        config_path=config_path,
+        model_weights_path=model_weights_path,
+        model_update=model_update,
+        device=device,
+        precision=precision,
+    )
+    model, model_config = cached_model.model, cached_model.model_config
+    in_channels = model_config["in_channels"]
 
     if patch_halo is None:
-        try:
-            logger.info("Computing theoretical minimum halo from model.")
-            patch_halo = model_zoo.compute_3D_halo_for_pytorch3dunet(model)
-        except Exception:
-            logger.warning(
-                "Could not compute halo from model. Using 0 halo size, you may experience edge artifacts."
+        patch_halo = _model_halo(cached_model)
+    if patch is None:
+        maximum_patch_shape = find_a_max_patch_shape(model, in_channels, device)
+
+    # inputs of the same shape and layout get the same patches and share batches
+    groups = defaultdict(list)
+    for i, (raw, layout) in enumerate(zip(raws, input_layouts)):
+        groups[(raw.shape, layout)].append(i)
+
+    pmaps = [None] * len(raws)
+    for (shape, layout), indices in groups.items():
+        group_patch, group_halo = patch, patch_halo
+        if patch is None:
+            raw_shape = shape if layout == "ZYX" else (1,) + shape
+            assert len(raw_shape) == 3
+            group_patch, group_halo = _auto_patch_and_halo_shapes(
+                model, raw_shape, maximum_patch_shape, patch_halo
+            )
+
+        group_batch_size = batch_size
+        if group_batch_size is None and device == "cpu":
+            input_shape = tuple(p + 2 * h for p, h in zip(group_patch, group_halo))
+            group_batch_size = find_batch_size_by_memory(
+                model,
+                in_channels,
+                input_shape,
+                available_memory_bytes(device) // 2,
+                bytes_per_element=4 if precision == "fp32" else 2,
+            )
+
+        logger.info(
+            f"Predicting {len(indices)} images in shape {shape}: patch shape {group_patch}, "
+            f"halo shape {group_halo}"
+        )
+        predictor = ArrayPredictor(
+            model=model,
+            in_channels=in_channels,
+            out_channels=model_config["out_channels"],
+            device=device,
+            patch=group_patch,
+            patch_halo=group_halo,
+            single_batch_mode=False,
+            headless=False,
+            verbose_logging=False,
+            disable_tqdm=disable_tqdm,
+            tracker=tracker,
+            blending=blending,
+            num_workers=num_workers,
+            prefetch_factor=prefetch_factor,
+            precision=precision,
+            backend=backend,
+            batch_size=group_batch_size,
+        )
+        test_datasets = [
+            _prediction_dataset(
+                raws[i], layout, in_channels, group_patch, group_halo, stride_ratio
             )
-            patch_halo = (0, 0, 0)
+            for i in indices
+        ]
+        for i, pmap in zip(indices, predictor.predict_images(test_datasets)):
+            pmaps[i] = pmap
 
+    return pmaps
+
+
+def unet_prediction_ensemble(
+    raw: np.ndarray,
+    input_layout: ImageLayout,
+    model_names: Sequence[str] = (),
+    model_ids: Sequence[str] = (),
+    config_paths: Sequence[Path] = (),
+    average: bool = False,
+    patch: tuple[int, int, int] | None = None,
+    patch_halo: tuple[int, int, int] | None = None,
+    single_batch_mode: bool = True,
+    device: str = "cuda",
+    model_update: bool = False,
+    disable_tqdm: bool = False,
+    tracker=None,
+    stride_ratio: float = 0.75,
+    blending: BlendingMode = "uniform",
+    num_workers: int = 0,
+    prefetch_factor: int = 2,
+    precision: Precision = "fp32",
+    backend: Backend = "eager",
+    skip_background: bool = False,
+    background_value: float = 0.0,
+    stats_subsampling: int = 1,
+    output_channels: Sequence[int] | None = None,
+    output_dtype: OutputDtype = "float32",
+) -> np.ndarray | list[np.ndarray]:
+    """Predict `raw` with several models, e.g. boundary and nuclei models or boundary models to average.
+
+    Unlike calling `unet_prediction` once per model, the raw volume is normalized, tiled and padded
+    once, and each patch is fed through all models before the next one is read. All models share the
+    patch and halo shapes: by default the largest halo of the models and the largest patch fitting in
+    memory for all of them.
+
+    Args:
+        raw (np.ndarray): Raw input data.
+        input_layout (ImageLayout): The layout of the input data.
+        model_names (Sequence[str]): Names of models of the PlantSeg zoo.
+        model_ids (Sequence[str]): IDs of models from the BioImage.IO model zoo.
+        config_paths (Sequence[Path]): Configuration files of custom models, with their weights next to them.
+        average (bool, optional): If True, return the average of the predictions, which saves the memory
+            of the separate prediction maps. All models must have the same number of output channels.
+            Defaults to False.
+        patch (tuple[int, int, int] | None, optional): Patch size for prediction. Defaults to None.
+        patch_halo (tuple[int, int, int] | None, optional): Halo size around patches. Defaults to None.
+        single_batch_mode (bool, optional): Whether to use a single batch for prediction. Defaults to True.
+        device (str, optional): The computation device ('cpu', 'cuda', etc.). Defaults to 'cuda'.
+        model_update (bool, optional): Whether to update the zoo models to the latest version. Defaults to False.
+        disable_tqdm (bool, optional): If True, disables the tqdm progress bar. Defaults to False.
+        stride_ratio (float, optional): Stride between patches as a fraction of the patch shape. Defaults to 0.75.
+        blending (BlendingMode, optional): Weighting of overlapping patches. Defaults to 'uniform'.
+        num_workers (int, optional): Number of worker processes preparing patches. Defaults to 0.
+        prefetch_factor (int, optional): Number of batches prepared ahead by each worker. Defaults to 2.
+        precision (Precision, optional): Precision of the forward pass. Defaults to 'fp32'.
+        backend (Backend, optional): Inference backend. Defaults to 'eager'.
+        skip_background (bool, optional): If True, skip the patches without foreground. Defaults to False.
+        background_value (float, optional): Prediction of the skipped patches. Defaults to 0.
+        stats_subsampling (int, optional): Stride along each axis used to estimate the global normalization
+            statistics. Defaults to 1.
+        output_channels (Sequence[int] | None, optional): Indices of the output channels kept from each model.
+            Defaults to None, i.e. all channels.
+        output_dtype (OutputDtype, optional): Dtype of the prediction, see `unet_prediction`. Defaults to 'float32'.
+
+    Returns:
+        np.ndarray | list[np.ndarray]: The averaged (C, Z, Y, X) prediction, or the (C, Z, Y, X) prediction
+            of each model in the order of `model_names`, `model_ids` and `config_paths`.
+
+    Raises:
+        ValueError: If no model is given or the models have different numbers of input channels.
+    """
+    sources = (
+        [{"model_name": name} for name in model_names]
+        + [{"model_id": model_id} for model_id in model_ids]
+        + [{"config_path": config_path} for config_path in config_paths]
+    )
+    if not sources:
+        raise ValueError("At least one model must be provided.")
+    cached_models = [
+        load_model(
+            **source, model_update=model_update, device=device, precision=precision
+        )
+        for source in sources
+    ]
+    models = [cached_model.model for cached_model in cached_models]
+    model_configs = [cached_model.model_config for cached_model in cached_models]
+    in_channels = {model_config["in_channels"] for model_config in model_configs}
+    if len(in_channels) > 1:
+        raise ValueError(
+            f"All models of an ensemble must have the same number of input channels, got {in_channels}."
+        )
+    in_channels = in_channels.pop()
+
+    if patch_halo is None:
+        halos = [_model_halo(cached_model) for cached_model in cached_models]
+        patch_halo = tuple(int(h) for h in np.max(halos, axis=0))
+
+    batch_size = None
     if patch is None:
-        maximum_patch_shape = find_a_max_patch_shape(
-            model, model_config["in_channels"], device
+        maximum_patch_shapes = [
+            find_a_max_patch_shape(model, in_channels, device) for model in models
+        ]
+        maximum_patch_shape = tuple(
+            int(p) for p in np.min(maximum_patch_shapes, axis=0)
         )
         raw_shape = raw.shape if input_layout == "ZYX" else (1,) + raw.shape
         assert len(raw_shape) == 3
-        patch, patch_halo = find_patch_and_halo_shapes(
-            raw_shape, maximum_patch_shape, patch_halo, both_sides=False
+        patch, patch_halo = _auto_patch_and_halo_shapes(
+            models[0], raw_shape, maximum_patch_shape, patch_halo
         )
+        if _is_2d_model(models[0]) and raw_shape[0] > 1:
+            n_slices = min(
+                _slices_per_pass(
+                    model, in_channels, patch, patch_halo, device, precision
+                )
+                for model in models
+            )
+            patch = (_slab_depth(raw_shape[0], n_slices),) + patch[1:]
+            batch_size = 1
 
     logger.info(
-        f"For raw in shape {raw.shape}: set patch shape {patch}, set halo shape {patch_halo}"
+        f"Predicting with {len(models)} models: patch shape {patch}, halo shape {patch_halo}"
     )
-
-    predictor = ArrayPredictor(
-        model=model,
-        in_channels=model_config["in_channels"],
-        out_channels=model_config["out_channels"],
+    predictor = EnsemblePredictor(
+        models=models,
+        in_channels=in_channels,
+        out_channels=[model_config["out_channels"] for model_config in model_configs],
         device=device,
         patch=patch,
         patch_halo=patch_halo,
         single_batch_mode=single_batch_mode,
         headless=False,
+        average=average,
         verbose_logging=False,
         disable_tqdm=disable_tqdm,
         tracker=tracker,
+        blending=blending,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        precision=precision,
+        backend=backend,
+        batch_size=batch_size,
+        background_value=background_value,
+        output_channels=output_channels,
+        output_dtype=output_dtype,
     )
-
-    if int(model_config["in_channels"]) > 1:  # if multi-channel input
-        raw = fix_layout_to_CZYX(raw, input_layout)
-        multichannel_input = True
-    else:
-        raw = fix_layout_to_ZYX(raw, input_layout)
-        multichannel_input = False
-    raw = raw.astype("float32")
-    augs = get_test_augmentations(
-        raw
-    )  # using full raw to compute global normalization mean and std
-    stride = get_stride_shape(patch)
-    slice_builder = SliceBuilder(
-        raw, label_dataset=None, patch_shape=patch, stride_shape=stride
-    )
-    test_dataset = ArrayDataset(
+    test_dataset = _prediction_dataset(
         raw,
-        slice_builder,
-        augs,
-        halo_shape=patch_halo,
-        multichannel=multichannel_input,
-        verbose_logging=False,
+        input_layout,
+        in_channels,
+        patch,
+        patch_halo,
+        stride_ratio,
+        skip_background=skip_background,
+        stats_subsampling=stats_subsampling,
+        is_2d_model=_is_2d_model(models[0]),
     )
-
-    pmaps = predictor(test_dataset)  # pmaps either (C, Z, Y, X) or (C, Y, X)
-    return pmaps
+    return predictor(test_dataset)
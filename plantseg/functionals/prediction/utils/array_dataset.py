@@ -1,3 +1,4 @@
+import bisect
 import collections
 import logging
 from typing import Callable, Optional
@@ -87,12 +88,47 @@ def remove_padding(m, padding_shape):
     return m[(..., *(slice(p, -p or None) for p in padding_shape))]
 
 
+def read_mirror_padded_patch(
+    raw, raw_idx: tuple[slice, ...], halo_shape: tuple[int, ...]
+) -> np.ndarray:
+    """
+    Read a patch enlarged by `halo_shape` on both sides, mirror-padding only where it exceeds the volume.
+
+    The result is identical to slicing `mirror_pad(raw, halo_shape)` with the halo-shifted index,
+    but only the in-bounds region is read from `raw`. This allows `raw` to be any array-like object
+    supporting basic slicing, e.g. a `h5py.Dataset` or a `zarr.Array`.
+
+    Args:
+        raw: The full (unpadded) volume, ZYX or CZYX.
+        raw_idx (tuple[slice, ...]): Slices of the patch in `raw`, one per dimension of `raw`.
+        halo_shape (tuple[int, ...]): Halo size for each dimension of `raw`, 0 for the channel dimension.
+
+    Returns:
+        np.ndarray: The halo-padded patch.
+    """
+    read_idx, pad_width = [], []
+    for index, halo, size in zip(raw_idx, halo_shape, raw.shape):
+        start, stop = index.start - halo, index.stop + halo
+        read_idx.append(slice(max(start, 0), min(stop, size)))
+        pad_width.append((max(-start, 0), max(stop - size, 0)))
+
+    patch = raw[tuple(read_idx)]
+    if any(before or after for before, after in pad_width):
+        patch = np.pad(patch, pad_width, mode="reflect")
+    return patch
+
+
 class ArrayDataset(Dataset):
     """
     Based on pytorch-3dunet  AbstractHDF5Dataset
     https://github.com/wolny/pytorch-3dunet/blob/master/pytorch3dunet/datasets/hdf5.py
 
     Inference only implementation of torch.utils.data.Dataset
+
+    No padded copy of the volume is created: each patch is read from `raw` together with its halo
+    (see `read_mirror_padded_patch`). Interior patches are views of `raw`, only patches whose halo
+    exceeds the volume are mirror-padded. `raw` may also be an on-disk array, e.g. a `h5py.Dataset`
+    or a `zarr.Array`.
     """
 
     def __init__(
@@ -106,19 +142,22 @@ class ArrayDataset(Dataset):
     ):
         """
         Args:
-            raw (np.ndarray): raw data
+            raw (np.ndarray): raw data, ZYX or CZYX, any array-like object supporting basic slicing
             slice_builder (SliceBuilder): slice builder
             augs (Callable): data augmentation pipeline
+            halo_shape (tuple[int, int, int]): halo read around each patch, ZYX
+            multichannel (bool): if True, `raw` is CZYX; the channel dimension is never padded
             verbose_logging (bool): if True, log info messages
         """
         self.raw = raw
         self.augs = augs
         self.raw_slices = slice_builder.raw_slices
+        self.grid_slices = slice_builder.grid_slices
+        self.multichannel = multichannel
 
         if halo_shape is None:
             halo_shape = (0, 0, 0)
         self.halo_shape = halo_shape
-        self.raw_padded = mirror_pad(self.raw, self.halo_shape, multichannel)
 
         if verbose_logging:
             logger.info(f"Number of patches: {len(self.raw_slices)}")
@@ -136,11 +175,9 @@ class ArrayDataset(Dataset):
             f"raw_idx {len(raw_idx)} and halo_shape {len(halo_shape)} must have the same length."
         )
 
-        raw_idx_padded = tuple(
-            slice(index.start, index.stop + 2 * halo, None)
-            for index, halo in zip(raw_idx, halo_shape)
-        )
-        raw_patch = self.raw_padded[raw_idx_padded]
+        # convert patch by patch, the volume is kept in its original dtype
+        raw_patch = read_mirror_padded_patch(self.raw, raw_idx, halo_shape)
+        raw_patch = raw_patch.astype("float32", copy=False)
         raw_patch_transformed = self.augs(raw_patch)
 
         # discard the channel dimension in the slices: predictor requires only the spatial dimensions of the volume
@@ -152,6 +189,31 @@ class ArrayDataset(Dataset):
         return len(self.raw_slices)
 
 
+class MultiImageDataset(Dataset):
+    """
+    Patches of several `ArrayDataset`s, so that patches of different images share batches.
+
+    Patch indices carry the image as a leading slice, i.e. `(slice(i, i + 1), z, y, x)` for the
+    i-th dataset, so they are collated like the indices of a single dataset.
+    """
+
+    def __init__(self, datasets: list[ArrayDataset]):
+        self.datasets = datasets
+        self.offsets = list(np.cumsum([0] + [len(dataset) for dataset in datasets]))
+        self.halo_shape = datasets[0].halo_shape
+
+    def __getitem__(self, idx):
+        if idx >= len(self):
+            raise StopIteration
+
+        image = bisect.bisect_right(self.offsets, idx) - 1
+        patch, raw_idx = self.datasets[image][idx - self.offsets[image]]
+        return patch, (slice(image, image + 1),) + tuple(raw_idx)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+
 def default_prediction_collate(batch):
     """
     Default collate_fn to form a mini-batch of Tensor(s) for HDF5 based datasets
@@ -1,5 +1,11 @@
+import collections
+import copy
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence
 
+import h5py
 import numpy as np
 import torch
 import tqdm
@@ -8,18 +14,115 @@ from torch.utils.data import DataLoader, Dataset
 
 from plantseg.functionals.prediction.utils.array_dataset import (
     ArrayDataset,
+    MultiImageDataset,
     default_prediction_collate,
     remove_padding,
 )
+from plantseg.functionals.prediction.utils.backends import (
+    Backend,
+    check_backend,
+    load_backend,
+)
+from plantseg.functionals.prediction.utils.blending import (
+    BlendingMode,
+    LockedAccumulator,
+    OutputDtype,
+    PatchAccumulator,
+    check_output_dtype,
+    quantize,
+)
+from plantseg.functionals.prediction.utils.precision import (
+    Precision,
+    autocast,
+    check_precision,
+    prepare_input,
+    prepare_model,
+)
 from plantseg.functionals.prediction.utils.size_finder import (
     _is_2d_model,
     find_batch_size,
     will_CUDA_OOM,
 )
+from plantseg.functionals.prediction.utils.slice_builder import PatchIndex
 from plantseg.training.embeddings import embeddings_to_affinities
 
 logger = logging.getLogger(__name__)
 
+# number of locks guarding the shared output of multi-process prediction
+N_OUTPUT_LOCKS = 64
+
+
+def _accumulate_batch(
+    accumulator: PatchAccumulator, prediction: np.ndarray, indices: list
+) -> None:
+    for pred, index in zip(prediction, indices):
+        accumulator.add(pred, index)
+
+
+def _shard_slices(raw_slices, shard: np.ndarray):
+    """Patches at the positions `shard`, compact if `raw_slices` is a `PatchIndex`."""
+    if isinstance(raw_slices, PatchIndex):
+        return raw_slices.subset(shard)
+    return [raw_slices[i] for i in shard]
+
+
+class _ImageAccumulators:
+    """Route patches of a `MultiImageDataset`, indexed by (image, z, y, x) slices, to their image."""
+
+    def __init__(self, accumulators: list[PatchAccumulator]):
+        self.accumulators = accumulators
+
+    def add(self, prediction: np.ndarray, index: tuple[slice, ...]) -> None:
+        self.accumulators[index[0].start].add(prediction, index[1:])
+
+
+class _SharedProgress:
+    """Tracker stand-in adding the progress of a prediction process to a shared counter."""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.total = None
+        self._progress = 0
+
+    @property
+    def progress(self) -> int:
+        return self._progress
+
+    @progress.setter
+    def progress(self, progress: int) -> None:
+        with self.counter.get_lock():
+            self.counter.value += progress - self._progress
+        self._progress = progress
+
+
+def _predict_shard(
+    predictor: "ArrayPredictor",
+    dataset: ArrayDataset,
+    raw: torch.Tensor,
+    output: torch.Tensor,
+    locks: list,
+    counter,
+) -> None:
+    """Entry point of a prediction process: predict `dataset` into the shared `output`."""
+    dataset.raw = raw.numpy()
+    predictor.tracker = _SharedProgress(counter)
+    predictor.disable_tqdm = True
+    accumulator = LockedAccumulator(
+        PatchAccumulator(
+            output.numpy(),
+            dataset.grid_slices,
+            mode=predictor.blending,
+            background=predictor.background_value,
+            added_slices=dataset.raw_slices,
+        ),
+        locks,
+        block_shape=predictor.patch,
+    )
+    predictor.model.eval()
+    predictor.predict_loader(
+        predictor.data_loader(dataset), accumulator, _is_2d_model(predictor.model)
+    )
+
 
 class ArrayPredictor:
     """Predictor class for applying a model to a dataset and returning the results as numpy arrays.
@@ -44,16 +147,52 @@ class ArrayPredictor:
         is_embedding (bool, optional): If True, convert model output to embeddings. Defaults to False.
         verbose_logging (bool, optional): If True, enable verbose logging. Defaults to False.
         disable_tqdm (bool, optional): If True, disable tqdm progress bars. Defaults to False.
+        blending (BlendingMode, optional): Weighting of overlapping patches, 'uniform', 'gaussian' or 'cosine'.
+            Defaults to 'uniform'.
+        num_workers (int, optional): Number of worker processes preparing patches (slicing, normalization,
+            tensor conversion) while the model runs. 0 prepares them in the main process. Defaults to 0.
+        prefetch_factor (int, optional): Number of batches prepared ahead by each worker, and number of
+            finished batches allowed to wait for accumulation. Defaults to 2.
+        precision (Precision, optional): Precision of the forward pass, 'fp32', 'bf16' or 'fp16-accumulate'.
+            Reduced precision modes also use the channels-last memory format. Defaults to 'fp32'.
+        backend (Backend, optional): Inference backend, 'eager', 'torchscript', 'compile' or 'onnx'. Exported
+            models are cached under `~/.plantseg_models/compiled`. Defaults to 'eager'.
+        batch_size (int | None, optional): Batch size to use instead of determining it from `single_batch_mode`,
+            e.g. an autotuned one. Defaults to None.
+        num_threads (int | None, optional): Number of torch threads used during prediction. Defaults to None,
+            i.e. the current setting.
+        background_value (float | np.ndarray, optional): Prediction of the patches skipped by a `MaskSliceBuilder`,
+            a constant or a (C, Z, Y, X) estimate of the whole prediction. Defaults to 0.
+        num_processes (int, optional): Number of processes predicting on CPU, each with its own model copy,
+            `num_threads` threads (by default the current number of threads divided among them) and a
+            contiguous shard of the patches. Raw volume and output are kept in shared memory. Processes are
+            started with 'spawn', so scripts must guard their entry point with `if __name__ == "__main__"`.
+            Ignored on GPU. Defaults to 1.
+        output_channels (Sequence[int] | None, optional): Indices of the output channels to keep, the others are
+            never accumulated. Defaults to None, i.e. all channels.
+        output_dtype (OutputDtype, optional): Dtype of the prediction maps, 'float32', 'float16' or 'uint8', the
+            latter storing probabilities in [0, 1] as `round(255 * p)` (see `quantize`). Defaults to 'float32'.
 
     Attributes:
         batch_size (int): Calculated batch size based on device capabilities and model requirements.
         device (str): Device where the model will be run.
         model (nn.Module): Model configured for evaluation.
         out_channels (int): Number of channels expected in the output.
+        patch (tuple[int, int, int]): Patch size used for prediction.
         patch_halo (tuple[int, int, int]): Halo size around each patch.
         verbose_logging (bool): Flag to enable detailed logging.
         disable_tqdm (bool): Flag to disable tqdm progress bars during prediction.
         is_embedding (bool): Flag to determine if the output should be treated as embeddings.
+        blending (BlendingMode): Weighting of overlapping patches.
+        num_workers (int): Number of data loading worker processes.
+        prefetch_factor (int): Number of batches prepared ahead by each worker.
+        precision (Precision): Precision of the forward pass.
+        backend (Backend): Inference backend, the model is exported on the first batch.
+        num_threads (int | None): Number of torch threads used during prediction.
+        background_value (float | np.ndarray): Prediction of skipped background patches.
+        num_processes (int): Number of CPU prediction processes.
+        output_channels (list[int] | None): Indices of the accumulated output channels.
+        output_dtype (OutputDtype): Dtype of the prediction maps.
         tracker (Optional[PBar_Tracker]): Relais progress bar information from task to widget.
     """
 
@@ -71,11 +210,28 @@ class ArrayPredictor:
         verbose_logging: bool = False,
         disable_tqdm: bool = False,
         tracker=None,
+        blending: BlendingMode = "uniform",
+        num_workers: int = 0,
+        prefetch_factor: int = 2,
+        precision: Precision = "fp32",
+        backend: Backend = "eager",
+        batch_size: int | None = None,
+        num_threads: int | None = None,
+        background_value: float | np.ndarray = 0.0,
+        num_processes: int = 1,
+        output_channels: Sequence[int] | None = None,
+        output_dtype: OutputDtype = "float32",
     ):
         self.device = device
+        self.precision = check_precision(precision)
+        self.backend = check_backend(backend)
+        self._backend_models = {}
         self.tracker = tracker
+        self.num_threads = num_threads
 
-        if single_batch_mode:  # then check if OOM happens at batch size 1
+        if batch_size is not None:
+            self.batch_size = batch_size
+        elif single_batch_mode:  # then check if OOM happens at batch size 1
             self.batch_size = 1
             if device != "cpu" and will_CUDA_OOM(
                 model, in_channels, patch, patch_halo, self.batch_size, device
@@ -104,12 +260,33 @@ class ArrayPredictor:
             self.batch_size *= torch.cuda.device_count()
             self.device = "cuda"
 
-        self.model = model.to(self.device)
+        self.model = prepare_model(model.to(self.device), self.precision)
         self.out_channels = out_channels
+        self.patch = patch
         self.patch_halo = patch_halo
         self.verbose_logging = verbose_logging
         self.disable_tqdm = disable_tqdm
         self.is_embedding = is_embedding
+        self.blending = blending
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+        self.background_value = background_value
+        self.output_channels = (
+            list(output_channels) if output_channels is not None else None
+        )
+        self.output_dtype = check_output_dtype(output_dtype)
+
+        if num_processes > 1 and torch.device(self.device).type != "cpu":
+            logger.warning("Multi-process prediction is CPU only, using one process.")
+            num_processes = 1
+        self.num_processes = num_processes
+
+    def __getstate__(self):
+        # sent to prediction processes: the tracker and exported backends stay in this process
+        state = self.__dict__.copy()
+        state["tracker"] = None
+        state["_backend_models"] = {}
+        return state
 
     def __call__(self, test_dataset: Dataset) -> np.ndarray:
         assert isinstance(test_dataset, ArrayDataset), (
@@ -119,12 +296,7 @@ class ArrayPredictor:
             f"Predictor halo shape {self.patch_halo} does not match dataset halo shape {test_dataset.halo_shape}"
         )
 
-        test_loader = DataLoader(
-            test_dataset,
-            batch_size=self.batch_size,
-            pin_memory=True,
-            collate_fn=default_prediction_collate,
-        )
+        test_loader = self.data_loader(test_dataset)
 
         if self.verbose_logging:
             logger.info(f"Running prediction on {len(test_loader)} batches")
@@ -132,15 +304,7 @@ class ArrayPredictor:
         # dimensionality of the output prediction
         volume_shape = self.volume_shape(test_dataset)
         is_2d_model = _is_2d_model(self.model)
-        if self.is_embedding:
-            if is_2d_model:
-                # outputs 1-affinities in XY
-                out_channels = 2
-            else:
-                # outputs 1-affinities in XYZ
-                out_channels = 3
-        else:
-            out_channels = self.out_channels
+        out_channels = self.get_out_channels(is_2d_model)
 
         prediction_maps_shape = (out_channels,) + volume_shape
 
@@ -149,69 +313,293 @@ class ArrayPredictor:
                 f"The shape of the output prediction maps (CDHW): {prediction_maps_shape}"
             )
             logger.info(f"Using patch_halo: {self.patch_halo}")
-            # allocate prediction and normalization arrays
-            logger.info("Allocating prediction and normalization arrays...")
+            logger.info(f"Allocating prediction array, {self.blending} blending...")
 
-        # initialize the output prediction arrays
-        prediction_map = np.zeros(prediction_maps_shape, dtype="float32")
-        # initialize normalization mask in order to average out probabilities of overlapping patches
-        normalization_mask = np.zeros(prediction_maps_shape, dtype="uint8")
+        if self.num_processes > 1:
+            if isinstance(self.background_value, np.ndarray):
+                logger.warning(
+                    "Multi-process prediction requires a constant background, using one process."
+                )
+            elif isinstance(test_dataset.raw, np.ndarray):
+                return self.predict_multiprocess(test_dataset, prediction_maps_shape)
+            else:
+                logger.warning(
+                    "Multi-process prediction requires an in-memory volume, using one process."
+                )
+
+        prediction_map, accumulator = self.allocate_prediction_map(
+            test_dataset, out_channels
+        )
 
         # run prediction
         # Sets the module in evaluation mode explicitly
         # It is necessary for batchnorm/dropout layers if present as well as final Sigmoid/Softmax to be applied
         self.model.eval()
         # Run prediction on the entire input dataset
+        self.predict_loader(test_loader, accumulator, is_2d_model)
+
+        if self.verbose_logging:
+            logger.info("Prediction finished")
+
+        return prediction_map
+
+    def allocate_prediction_map(
+        self, test_dataset: ArrayDataset, out_channels: int
+    ) -> tuple[np.ndarray, PatchAccumulator]:
+        """Allocate the (C, Z, Y, X) prediction of `test_dataset` and the accumulator blending into it."""
+        # initialize the output prediction array, patches are added already normalized
+        # and skipped background patches keep the initial value
+        prediction_map = np.empty(
+            (out_channels,) + tuple(self.volume_shape(test_dataset)),
+            dtype=self.output_dtype,
+        )
+        prediction_map[...] = quantize(self.background_value, self.output_dtype)
+        accumulator = PatchAccumulator(
+            prediction_map,
+            test_dataset.grid_slices,
+            mode=self.blending,
+            background=self.background_value,
+            added_slices=test_dataset.raw_slices,
+        )
+        return prediction_map, accumulator
+
+    def predict_images(self, test_datasets: list[ArrayDataset]) -> list[np.ndarray]:
+        """Predict several volumes in shared batches, e.g. many small images of the same shape.
+
+        Each volume keeps its own normalization and blending, so its prediction is the same as when
+        it is predicted alone, but the model sees batches of patches from different volumes.
+
+        Returns:
+            list[np.ndarray]: The (C, Z, Y, X) prediction of each dataset, in order.
+        """
+        for test_dataset in test_datasets:
+            assert self.patch_halo == test_dataset.halo_shape, (
+                f"Predictor halo shape {self.patch_halo} does not match dataset halo shape {test_dataset.halo_shape}"
+            )
+
+        is_2d_model = _is_2d_model(self.model)
+        out_channels = self.get_out_channels(is_2d_model)
+        prediction_maps, accumulators = [], []
+        for test_dataset in test_datasets:
+            prediction_map, accumulator = self.allocate_prediction_map(
+                test_dataset, out_channels
+            )
+            prediction_maps.append(prediction_map)
+            accumulators.append(accumulator)
+
+        test_loader = self.data_loader(MultiImageDataset(test_datasets))
+        if self.verbose_logging:
+            logger.info(
+                f"Running prediction of {len(test_datasets)} images on {len(test_loader)} batches"
+            )
+
+        self.model.eval()
+        self.predict_loader(test_loader, _ImageAccumulators(accumulators), is_2d_model)
+        return prediction_maps
+
+    def predict_multiprocess(
+        self, test_dataset: ArrayDataset, prediction_maps_shape: tuple[int, ...]
+    ) -> np.ndarray:
+        """Predict `test_dataset` with `num_processes` CPU processes into a shared-memory output.
+
+        The patches are split into contiguous, hence spatially compact, shards. Overlapping patches
+        of neighbouring shards are added under `LockedAccumulator` locks, so the blend is the same as
+        in a single process up to floating point summation order, and quantized outputs are rounded
+        once per shard where the shards overlap.
+        """
+        ctx = torch.multiprocessing.get_context("spawn")
+        num_threads = self.num_threads or max(
+            torch.get_num_threads() // self.num_processes, 1
+        )
+        logger.info(
+            f"Predicting with {self.num_processes} processes of {num_threads} threads each"
+        )
+
+        raw = torch.from_numpy(np.ascontiguousarray(test_dataset.raw)).share_memory_()
+        output = torch.empty(
+            prediction_maps_shape, dtype=getattr(torch, self.output_dtype)
+        )
+        output = output.share_memory_().fill_(
+            quantize(self.background_value, self.output_dtype).item()
+        )
+        locks = [ctx.Lock() for _ in range(N_OUTPUT_LOCKS)]
+        counter = ctx.Value("i", 0)
+
+        shard_predictor = copy.copy(self)
+        shard_predictor.num_threads = num_threads
+        shard_predictor.num_workers = 0  # prediction processes cannot have children
+
+        processes, n_batches = [], 0
+        for shard in np.array_split(np.arange(len(test_dataset)), self.num_processes):
+            if len(shard) == 0:
+                continue
+            shard_dataset = copy.copy(test_dataset)
+            shard_dataset.raw = None  # shared separately, without pickling a copy
+            shard_dataset.raw_slices = _shard_slices(test_dataset.raw_slices, shard)
+            n_batches += -(-len(shard) // self.batch_size)
+            processes.append(
+                ctx.Process(
+                    target=_predict_shard,
+                    args=(shard_predictor, shard_dataset, raw, output, locks, counter),
+                )
+            )
+
         if self.tracker is not None:
-            self.tracker.total = len(test_loader)
-        with torch.no_grad():
-            for input_, indices in tqdm.tqdm(test_loader, disable=self.disable_tqdm):
-                if self.tracker is not None:
-                    self.tracker.progress += 1
-                input_ = input_.to(
-                    self.device
-                )  # input is padded with halo in dataset __getitem__
-                # forward pass
-                if is_2d_model:
-                    # remove the singleton z-dimension from the input
-                    input_ = torch.squeeze(input_, dim=-3)
-                    prediction = self.model(input_)
-                    # add the singleton z-dimension to the output
-                    prediction = torch.unsqueeze(prediction, dim=-3)
-                else:
-                    prediction = self.model(input_)
-
-                if self.is_embedding:
-                    if is_2d_model:
-                        offsets = [[-1, 0], [0, -1]]
-                    else:
-                        offsets = [[-1, 0, 0], [0, -1, 0], [0, 0, -1]]
-                    # convert embeddings to affinities
-                    prediction = embeddings_to_affinities(
-                        prediction, offsets, delta=0.5
-                    )
-                    # average across channels and invert (i.e. 1-affinities)
-                    prediction = 1 - prediction.mean(dim=1)
-                # removing halo from the prediction
-                prediction = remove_padding(prediction, self.patch_halo)
-                # convert to numpy array
-                prediction = prediction.cpu().numpy()
-
-                channel_slice = slice(0, out_channels)
-                # for each batch sample
-                for pred, index in zip(prediction, indices):
-                    # add channel dimension to the index
-                    index = (channel_slice,) + tuple(index)
-                    # accumulate probabilities into the output prediction array
-                    prediction_map[index] += pred
-                    # count voxel visits for normalization
-                    normalization_mask[index] += 1
+            self.tracker.total = n_batches
+        with tqdm.tqdm(total=n_batches, disable=self.disable_tqdm) as pbar:
+            for process in processes:
+                process.start()
+            try:
+                while any(process.is_alive() for process in processes):
+                    if any(process.exitcode for process in processes):
+                        break  # a process failed, stop the others
+                    time.sleep(0.1)
+                    pbar.update(counter.value - pbar.n)
+                    if self.tracker is not None:
+                        self.tracker.progress = counter.value
+            finally:
+                for process in processes:
+                    if process.is_alive():
+                        process.terminate()
+                    process.join()
+            pbar.update(counter.value - pbar.n)
+
+        failed = [rank for rank, p in enumerate(processes) if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Prediction processes {failed} failed.")
 
         if self.verbose_logging:
             logger.info("Prediction finished")
+        return output.numpy()
+
+    def data_loader(self, test_dataset: ArrayDataset | MultiImageDataset) -> DataLoader:
+        """Create the loader over halo-padded patches of `test_dataset`.
 
-        # normalize results and return
-        return prediction_map / normalization_mask
+        Patches are prepared by `num_workers` worker processes, `prefetch_factor` batches ahead, and
+        collated into pinned memory when predicting on a GPU, so that the host-to-device copy in
+        `predict_batch` is asynchronous.
+        """
+        num_workers = self.num_workers
+        datasets = getattr(test_dataset, "datasets", [test_dataset])
+        if num_workers > 0 and any(
+            isinstance(dataset.raw, h5py.Dataset) for dataset in datasets
+        ):
+            logger.warning(
+                "HDF5 datasets cannot be read from worker processes, loading patches in the main process."
+            )
+            num_workers = 0
+
+        return DataLoader(
+            test_dataset,
+            batch_size=self.batch_size,
+            num_workers=num_workers,
+            prefetch_factor=self.prefetch_factor if num_workers > 0 else None,
+            pin_memory=self.device != "cpu",
+            collate_fn=default_prediction_collate,
+        )
+
+    def predict_loader(
+        self,
+        test_loader: DataLoader,
+        accumulator: PatchAccumulator,
+        is_2d_model: bool,
+    ) -> None:
+        """Predict all batches of `test_loader` and blend them into `accumulator`.
+
+        The scatter-add of finished batches runs in a single background thread, so the next forward
+        pass does not wait for it. At most `prefetch_factor` batches are pending at any time, which
+        bounds the extra host memory; a single thread keeps the accumulation order deterministic.
+        """
+        if self.tracker is not None:
+            self.tracker.total = len(test_loader)
+
+        default_threads = torch.get_num_threads()
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+
+        try:
+            pending = collections.deque()
+            with ThreadPoolExecutor(max_workers=1) as executor, torch.no_grad():
+                for input_, indices in tqdm.tqdm(
+                    test_loader, disable=self.disable_tqdm
+                ):
+                    if self.tracker is not None:
+                        self.tracker.progress += 1
+                    prediction = self.predict_batch(input_, is_2d_model)
+                    pending.append(
+                        executor.submit(
+                            _accumulate_batch, accumulator, prediction, indices
+                        )
+                    )
+                    while len(pending) > self.prefetch_factor:
+                        pending.popleft().result()  # re-raises errors from the thread
+
+                while pending:
+                    pending.popleft().result()
+        finally:
+            torch.set_num_threads(default_threads)
+
+    def get_out_channels(self, is_2d_model: bool) -> int:
+        """Number of channels of the accumulated prediction maps."""
+        if self.is_embedding:
+            # outputs 1-affinities in XY for 2D models and in XYZ for 3D models
+            return 2 if is_2d_model else 3
+        if self.output_channels is not None:
+            return len(self.output_channels)
+        return self.out_channels
+
+    def forward(self, input_: torch.Tensor) -> torch.Tensor:
+        """Model forward pass in the configured precision, always returning float32."""
+        input_ = prepare_input(input_, self.model, self.precision)
+        model = self._backend_models.get(input_.shape[1:])
+        if model is None:
+            model = load_backend(
+                self.model, self.backend, input_, self.device, self.precision
+            )
+            self._backend_models[input_.shape[1:]] = model
+        with autocast(self.device, self.precision):
+            prediction = model(input_)
+        return prediction.float()
+
+    def predict_batch(self, input_: torch.Tensor, is_2d_model: bool) -> np.ndarray:
+        """Run the forward pass on a batch of halo-padded patches.
+
+        Args:
+            input_ (torch.Tensor): Batch of patches in NCZYX layout, padded with the halo.
+            is_2d_model (bool): If True, the z-slices of the patches are predicted as a batch of 2D images.
+
+        Returns:
+            np.ndarray: Predictions for the batch in NCZYX layout with the halo removed.
+        """
+        # input is padded with halo in dataset __getitem__, and pinned if on GPU
+        input_ = input_.to(self.device, non_blocking=True)
+        # forward pass
+        if is_2d_model:
+            # predict every z-slice of the patches independently: fold z into the batch dimension
+            n, c, z, y, x = input_.shape
+            input_ = input_.transpose(1, 2).reshape(n * z, c, y, x)
+            prediction = self.forward(input_)
+            # restore the z-dimension of the output
+            prediction = prediction.reshape((n, z) + prediction.shape[1:])
+            prediction = prediction.transpose(1, 2)
+        else:
+            prediction = self.forward(input_)
+
+        if self.is_embedding:
+            if is_2d_model:
+                offsets = [[-1, 0], [0, -1]]
+            else:
+                offsets = [[-1, 0, 0], [0, -1, 0], [0, 0, -1]]
+            # convert embeddings to affinities
+            prediction = embeddings_to_affinities(prediction, offsets, delta=0.5)
+            # average across channels and invert (i.e. 1-affinities)
+            prediction = 1 - prediction.mean(dim=1)
+        if self.output_channels is not None and not self.is_embedding:
+            prediction = prediction[:, self.output_channels]
+        # removing halo from the prediction
+        prediction = remove_padding(prediction, self.patch_halo)
+        # convert to numpy array
+        return prediction.cpu().numpy()
 
     @staticmethod
     def volume_shape(dataset: Dataset) -> tuple[int, int, int]:
@@ -0,0 +1,217 @@
+"""Timing autotuner for the prediction patch shape, batch size and thread count.
+
+The activation memory model in `size_finder` narrows the candidates to the ones fitting a memory
+budget, a few short forward passes measure their throughput, and the fastest configuration is
+persisted in `PATH_AUTOTUNE` per (model architecture, device, host, precision), so later runs
+reuse it without timing anything.
+"""
+
+import hashlib
+import json
+import logging
+import socket
+import time
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import torch
+from torch import nn
+
+from plantseg import PATH_AUTOTUNE
+from plantseg.functionals.prediction.utils.precision import (
+    Precision,
+    autocast,
+    prepare_input,
+)
+from plantseg.functionals.prediction.utils.size_finder import (
+    _is_2d_model,
+    available_memory_bytes,
+    estimate_activation_bytes,
+    find_max_shape_by_memory,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZES = (1, 2, 4, 8)
+
+
+@dataclass
+class TunedPrediction:
+    """Fastest prediction configuration found for a model on a device.
+
+    Attributes:
+        input_shape (tuple[int, int, int]): Network input shape (patch plus halo), ZYX.
+        batch_size (int): Number of patches per forward pass.
+        num_threads (int): Number of torch intra-op threads.
+        voxels_per_second (float): Measured throughput in output voxels (halo excluded).
+    """
+
+    input_shape: tuple[int, int, int]
+    batch_size: int
+    num_threads: int
+    voxels_per_second: float
+
+
+def tuning_key(
+    model: nn.Module, in_channels: int, device: str, precision: Precision
+) -> str:
+    """Key of a model architecture on a device of this host; weights do not affect timings."""
+    if isinstance(model, nn.DataParallel):
+        model = model.module
+    architecture = hashlib.sha1(f"{in_channels}:{model!r}".encode()).hexdigest()[:16]
+    return f"{architecture}|{torch.device(device)}|{socket.gethostname()}|{precision}"
+
+
+def _load_tunings() -> dict:
+    if not PATH_AUTOTUNE.exists():
+        return {}
+    try:
+        with PATH_AUTOTUNE.open() as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        logger.warning(f"Ignoring corrupted autotuning cache {PATH_AUTOTUNE}")
+        return {}
+
+
+def _save_tuning(key: str, tuned: TunedPrediction) -> None:
+    tunings = _load_tunings()
+    tunings[key] = asdict(tuned)
+    PATH_AUTOTUNE.parent.mkdir(parents=True, exist_ok=True)
+    with PATH_AUTOTUNE.open("w") as f:
+        json.dump(tunings, f, indent=2)
+
+
+def candidate_input_shapes(
+    max_shape: tuple[int, int, int], n_candidates: int = 4
+) -> list[tuple[int, int, int]]:
+    """Isotropic shapes from `max_shape` down to half its side, in steps of 16 voxels."""
+    side = max_shape[-1]
+    sides = np.linspace(side, max(side // 2, 32), n_candidates)
+    sides = sorted({max(int(s) // 16 * 16, 32) for s in sides}, reverse=True)
+    if max_shape[0] == 1:
+        return [(1, s, s) for s in sides]
+    return [(s, s, s) for s in sides]
+
+
+def _time_forward(
+    model: nn.Module,
+    input_: torch.Tensor,
+    device: str,
+    precision: Precision,
+) -> float:
+    """Seconds of one forward pass, after a warm-up pass."""
+    input_ = prepare_input(input_.to(device), model, precision)
+    with torch.no_grad(), autocast(device, precision):
+        model(input_)
+        if torch.device(device).type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        model(input_)
+        if torch.device(device).type == "cuda":
+            torch.cuda.synchronize(device)
+    return time.perf_counter() - start
+
+
+def autotune_prediction(
+    model: nn.Module,
+    in_channels: int,
+    patch_halo: tuple[int, int, int],
+    device: str,
+    precision: Precision = "fp32",
+    memory_budget: int | None = None,
+    time_budget: float = 30.0,
+    force: bool = False,
+) -> TunedPrediction:
+    """Find the input shape, batch size and thread count maximizing prediction throughput.
+
+    Candidates whose estimated activation memory exceeds `memory_budget` are never run. The
+    remaining ones are timed, largest first, until `time_budget` seconds are spent; the first
+    candidate is always timed. Throughput counts only the voxels left after removing the halo,
+    so larger patches are rewarded for their smaller halo overhead.
+
+    Args:
+        model (nn.Module): Model in evaluation mode, already on `device` and prepared for `precision`.
+        in_channels (int): Number of input channels.
+        patch_halo (tuple[int, int, int]): Halo removed from each side of the patch prediction.
+        device (str): Device to tune for.
+        precision (Precision): Precision of the forward pass.
+        memory_budget (int | None): Bytes available to activations. Defaults to half the free
+            memory of `device`.
+        time_budget (float): Seconds available to timing.
+        force (bool): If True, ignore a persisted result and tune again.
+
+    Returns:
+        TunedPrediction: The fastest configuration, also persisted for later runs.
+    """
+    key = tuning_key(model, in_channels, device, precision)
+    if not force:
+        tuned = _load_tunings().get(key)
+        if tuned is not None:
+            tuned = TunedPrediction(**tuned)
+            tuned.input_shape = tuple(tuned.input_shape)
+            logger.info(f"Using persisted autotuning result {tuned}")
+            return tuned
+
+    if memory_budget is None:
+        memory_budget = available_memory_bytes(device) // 2
+    bytes_per_element = 4 if precision == "fp32" else 2
+    max_shape = find_max_shape_by_memory(
+        model, in_channels, memory_budget, bytes_per_element=bytes_per_element
+    )
+
+    thread_counts = [torch.get_num_threads()]
+    if torch.device(device).type == "cpu" and thread_counts[0] > 1:
+        thread_counts.append(thread_counts[0] // 2)
+
+    is_2d = _is_2d_model(model)
+    default_threads = torch.get_num_threads()
+    best = None
+    start = time.perf_counter()
+    try:
+        for input_shape in candidate_input_shapes(max_shape):
+            output_voxels = np.prod(
+                [max(s - 2 * h, 1) for s, h in zip(input_shape, patch_halo)]
+            )
+            for batch_size in BATCH_SIZES:
+                estimate = estimate_activation_bytes(
+                    model, in_channels, input_shape, batch_size, bytes_per_element
+                )
+                if estimate > memory_budget:
+                    break
+                spatial_shape = input_shape[1:] if is_2d else input_shape
+                input_ = torch.randn((batch_size, in_channels) + spatial_shape)
+                for num_threads in thread_counts:
+                    if best is not None and time.perf_counter() - start > time_budget:
+                        raise TimeoutError
+                    torch.set_num_threads(num_threads)
+                    try:
+                        seconds = _time_forward(model, input_, device, precision)
+                    except RuntimeError as e:
+                        if "out of memory" not in str(e):
+                            raise
+                        logger.info(
+                            f"Autotuning: {input_shape} x {batch_size} is out of memory"
+                        )
+                        torch.cuda.empty_cache()
+                        break
+                    voxels_per_second = float(batch_size * output_voxels / seconds)
+                    logger.info(
+                        f"Autotuning: input {input_shape}, batch {batch_size}, "
+                        f"{num_threads} threads: {voxels_per_second:.3g} voxels/s"
+                    )
+                    if best is None or voxels_per_second > best.voxels_per_second:
+                        best = TunedPrediction(
+                            input_shape, batch_size, num_threads, voxels_per_second
+                        )
+    except TimeoutError:
+        logger.info(f"Autotuning time budget of {time_budget}s reached.")
+    finally:
+        torch.set_num_threads(default_threads)
+
+    if best is None:
+        raise RuntimeError(
+            f"No patch shape fits the memory budget of {memory_budget / 2**30:.2f} GiB."
+        )
+    logger.info(f"Autotuning result: {best}")
+    _save_tuning(key, best)
+    return best
@@ -0,0 +1,183 @@
+"""Compiled and exported inference backends for U-Net models.
+
+A backend turns an eager `nn.Module` into a callable mapping an NC(Z)YX batch to the model output:
+
+- `eager`: the module itself.
+- `torchscript`: the module traced with `torch.jit.trace` and frozen.
+- `compile`: the module optimized with `torch.compile`.
+- `onnx`: the module exported to ONNX and run with ONNX Runtime (requires `onnxruntime`).
+
+TorchScript and ONNX artifacts are cached under `PATH_COMPILED_MODELS`, keyed by a fingerprint of
+the model weights, the input shape, the device and the precision, so a model is exported once and
+reloaded by later predictions. If a backend is unavailable or the export fails, the eager module is
+used and a warning is logged.
+"""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Literal
+
+import numpy as np
+import torch
+from torch import nn
+
+from plantseg import PATH_COMPILED_MODELS
+from plantseg.functionals.prediction.utils.precision import Precision, autocast
+
+try:
+    import onnxruntime  # type: ignore[import]
+
+    ONNXRUNTIME_INSTALLED = True
+except ImportError:
+    ONNXRUNTIME_INSTALLED = False
+
+logger = logging.getLogger(__name__)
+
+Backend = Literal["eager", "torchscript", "compile", "onnx"]
+BACKENDS = ("eager", "torchscript", "compile", "onnx")
+
+ModelCallable = Callable[[torch.Tensor], torch.Tensor]
+
+
+def check_backend(backend: str) -> Backend:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, select one of {BACKENDS}")
+    return backend
+
+
+def model_fingerprint(model: nn.Module) -> str:
+    """Hash of the model class and weights, independent of where the weights were loaded from."""
+    sha = hashlib.sha1(type(model).__name__.encode())
+    for name, tensor in sorted(model.state_dict().items()):
+        sha.update(name.encode())
+        sha.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return sha.hexdigest()[:16]
+
+
+def artifact_path(
+    model: nn.Module,
+    backend: Backend,
+    input_shape: tuple[int, ...],
+    device: str,
+    precision: Precision,
+) -> Path:
+    """Cache path of the exported `model` for inputs of `input_shape` (batch dimension excluded)."""
+    suffix = {"torchscript": ".pt", "onnx": ".onnx"}[backend]
+    shape = "x".join(str(s) for s in input_shape[1:])
+    device_type = torch.device(device).type
+    name = f"{model_fingerprint(model)}_{shape}_{device_type}_{precision}{suffix}"
+    return PATH_COMPILED_MODELS / backend / name
+
+
+def _export_torchscript(
+    model: nn.Module, example: torch.Tensor, device: str, precision: Precision
+) -> ModelCallable:
+    path = artifact_path(model, "torchscript", tuple(example.shape), device, precision)
+    if path.exists():
+        logger.info(f"Loading TorchScript model from {path}")
+        return torch.jit.load(path, map_location=device)
+
+    with torch.no_grad(), autocast(device, precision):
+        traced = torch.jit.trace(model, example, check_trace=False)
+    traced = torch.jit.freeze(traced)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.jit.save(traced, path)
+    logger.info(f"Saved TorchScript model to {path}")
+    return traced
+
+
+def _export_compile(
+    model: nn.Module, example: torch.Tensor, device: str, precision: Precision
+) -> ModelCallable:
+    # keep the inductor kernel cache next to the other compiled artifacts
+    os.environ.setdefault(
+        "TORCHINDUCTOR_CACHE_DIR", str(PATH_COMPILED_MODELS / "inductor")
+    )
+    compiled = torch.compile(model, dynamic=False)
+    with torch.no_grad(), autocast(device, precision):
+        compiled(example)  # compile now, so that failures trigger the eager fallback
+    return compiled
+
+
+class OnnxRuntimeModel:
+    """Run an ONNX model with ONNX Runtime on torch tensors."""
+
+    def __init__(self, path: Path, device: str):
+        providers = ["CPUExecutionProvider"]
+        if torch.device(device).type == "cuda":
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = onnxruntime.InferenceSession(str(path), providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.device = device
+
+    def __call__(self, input_: torch.Tensor) -> torch.Tensor:
+        array = np.ascontiguousarray(input_.detach().cpu().numpy(), dtype="float32")
+        (output,) = self.session.run(None, {self.input_name: array})
+        return torch.from_numpy(output).to(self.device)
+
+
+def _export_onnx(
+    model: nn.Module, example: torch.Tensor, device: str, precision: Precision
+) -> ModelCallable:
+    if not ONNXRUNTIME_INSTALLED:
+        raise RuntimeError("onnxruntime is not installed")
+    if precision != "fp32":
+        raise RuntimeError("ONNX export supports fp32 only")
+
+    path = artifact_path(model, "onnx", tuple(example.shape), device, precision)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (example.contiguous(),),
+                str(path),
+                input_names=["input"],
+                output_names=["output"],
+                dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+                dynamo=False,
+            )
+        logger.info(f"Saved ONNX model to {path}")
+    return OnnxRuntimeModel(path, device)
+
+
+_EXPORTERS = {
+    "torchscript": _export_torchscript,
+    "compile": _export_compile,
+    "onnx": _export_onnx,
+}
+
+
+def load_backend(
+    model: nn.Module,
+    backend: Backend,
+    example: torch.Tensor,
+    device: str,
+    precision: Precision = "fp32",
+) -> ModelCallable:
+    """Convert `model` to the inference `backend`, falling back to eager execution on failure.
+
+    Args:
+        model (nn.Module): Eager model in evaluation mode, already on `device`.
+        backend (Backend): One of 'eager', 'torchscript', 'compile' or 'onnx'.
+        example (torch.Tensor): Example batch with the shape of the prediction patches.
+        device (str): Device the model runs on.
+        precision (Precision): Precision the backend is optimized for.
+
+    Returns:
+        ModelCallable: Callable mapping a batch to the model output.
+    """
+    check_backend(backend)
+    if backend == "eager":
+        return model
+    if isinstance(model, nn.DataParallel):
+        logger.warning(f"Backend {backend} does not support DataParallel, using eager.")
+        return model
+
+    try:
+        return _EXPORTERS[backend](model, example, device, precision)
+    except Exception as e:
+        logger.warning(f"Could not use backend {backend}, using eager instead: {e}")
+        return model
@@ -0,0 +1,331 @@
+"""Tiled inference of BioImage.IO models.
+
+`bioimageio.core.predict` either runs a whole sample at once or tiles it with a block size parameter
+chosen by the caller. Here the block shape and halo are derived from the model description (RDF) and
+the available memory instead:
+
+1. The sample is preprocessed once as a whole, so sample-wise statistics (e.g. for
+   `zero_mean_unit_variance`) are those of the full volume, not of each block.
+2. Halo-padded blocks are streamed through the model and blended into the output with the
+   `PatchAccumulator` used by `ArrayPredictor`, so overlapping blocks are weighted the same way.
+3. Postprocessing is applied to the blended output.
+
+2D models applied to a ZYX stack predict the z-slices as the batch of the model.
+"""
+
+import inspect
+import logging
+from typing import Callable
+
+import numpy as np
+import tqdm
+from bioimageio.core import create_prediction_pipeline
+from bioimageio.core._prediction_pipeline import PredictionPipeline
+from bioimageio.core.axis import AxisId
+from bioimageio.core.sample import Sample
+from bioimageio.core.tensor import Tensor
+from bioimageio.spec.model import v0_4, v0_5
+
+from plantseg.functionals.prediction.utils.array_dataset import (
+    read_mirror_padded_patch,
+)
+from plantseg.functionals.prediction.utils.blending import (
+    BlendingMode,
+    PatchAccumulator,
+)
+from plantseg.functionals.prediction.utils.size_finder import available_memory_bytes
+from plantseg.functionals.prediction.utils.slice_builder import PatchIndex
+from plantseg.functionals.prediction.utils.utils import get_stride_shape
+
+logger = logging.getLogger(__name__)
+
+# assumed peak activation memory per voxel of a block, the architecture of a BioImage.IO model is unknown
+BIIO_BYTES_PER_VOXEL = 1024
+
+SPATIAL_AXES = ("z", "y", "x")
+AXIS_IDS = {"b": "batch", "c": "channel"}
+
+# bioimageio.core >= 0.9 pads inputs and crops outputs by the RDF halo itself, blocks here already
+# contain their halo and outputs are cropped by `predict_tiled`
+_NO_HALO_HANDLING = (
+    {"skip_input_padding": True, "skip_output_cropping": True}
+    if "skip_input_padding"
+    in inspect.signature(PredictionPipeline.predict_sample_without_blocking).parameters
+    else {}
+)
+
+AxisSizes = tuple[tuple[int, int], tuple[int, int], tuple[int, int]]
+
+
+def _axis_ids(axes) -> list[AxisId]:
+    if isinstance(axes, str):  # <=0.4 models, e.g. "bczyx"
+        return [AxisId(AXIS_IDS.get(a, a)) for a in axes]
+    return [AxisId(a.id) for a in axes]
+
+
+def model_input_axes(model: v0_4.ModelDescr | v0_5.ModelDescr) -> list[AxisId]:
+    return _axis_ids(model.inputs[0].axes)
+
+
+def model_output_axes(model: v0_4.ModelDescr | v0_5.ModelDescr) -> list[list[AxisId]]:
+    return [_axis_ids(output.axes) for output in model.outputs]
+
+
+def spatial_axis_sizes(model: v0_4.ModelDescr | v0_5.ModelDescr) -> AxisSizes | None:
+    """Valid input sizes `min + n * step` of the ZYX axes of the first model input.
+
+    A 2D model gets (1, 0) for z, i.e. one slice per block. Returns None if the sizes are not given
+    explicitly in the description, e.g. if they reference another tensor.
+    """
+    tensor = model.inputs[0]
+    sizes = {}
+    if isinstance(tensor.axes, str):
+        if isinstance(tensor.shape, v0_4.ParameterizedInputShape):
+            shape = zip(tensor.shape.min, tensor.shape.step)
+        else:
+            shape = ((s, 0) for s in tensor.shape)
+        for axis, (minimum, step) in zip(tensor.axes, shape):
+            sizes[axis] = (int(minimum), int(step))
+    else:
+        for axis in tensor.axes:
+            if axis.id not in SPATIAL_AXES:
+                continue
+            if isinstance(axis.size, int):
+                sizes[axis.id] = (axis.size, 0)
+            elif isinstance(axis.size, v0_5.ParameterizedSize):
+                sizes[axis.id] = (axis.size.min, axis.size.step)
+            else:
+                return None
+
+    if "y" not in sizes or "x" not in sizes:
+        return None
+    return sizes.get("z", (1, 0)), sizes["y"], sizes["x"]
+
+
+def model_halo(model: v0_4.ModelDescr | v0_5.ModelDescr) -> tuple[int, int, int]:
+    """Largest halo of the ZYX axes over all model outputs, 0 if not given."""
+    halo = dict.fromkeys(SPATIAL_AXES, 0)
+    for output in model.outputs:
+        if isinstance(output.axes, str):
+            for axis, h in zip(output.axes, output.halo or []):
+                if axis in halo:
+                    halo[axis] = max(halo[axis], int(h))
+        else:
+            for axis in output.axes:
+                if axis.id in halo:
+                    halo[axis.id] = max(halo[axis.id], int(getattr(axis, "halo", 0)))
+    return halo["z"], halo["y"], halo["x"]
+
+
+def find_block_shape(
+    volume_shape: tuple[int, int, int],
+    axis_sizes: AxisSizes,
+    halo_shape: tuple[int, int, int],
+    max_voxels: int,
+) -> tuple[int, int, int]:
+    """Largest valid block shape (ZYX, halo included) with at most `max_voxels` voxels.
+
+    Starting from the minimal valid shape, the smallest axis is grown by one step at a time, so the
+    block stays as isotropic as possible. An axis stops growing once a single block covers the volume
+    along it.
+
+    Args:
+        volume_shape (tuple[int, int, int]): Shape of the volume, ZYX.
+        axis_sizes (AxisSizes): (min, step) of the valid sizes of each axis, step 0 for a fixed size.
+        halo_shape (tuple[int, int, int]): Halo on each side of a block, ZYX.
+        max_voxels (int): Maximum number of voxels of a block.
+
+    Returns:
+        tuple[int, int, int]: Block shape, ZYX.
+    """
+    block = [minimum for minimum, _ in axis_sizes]
+    covering = [s + 2 * h for s, h in zip(volume_shape, halo_shape)]
+    while True:
+        growable = [
+            axis
+            for axis in range(3)
+            if axis_sizes[axis][1] > 0 and block[axis] < covering[axis]
+        ]
+        for axis in sorted(growable, key=lambda a: block[a]):
+            grown = list(block)
+            grown[axis] += axis_sizes[axis][1]
+            if np.prod(grown) <= max_voxels:
+                block = grown
+                break
+        else:
+            return tuple(block)
+
+
+def predict_tiled(
+    raw: np.ndarray,
+    predict_block: Callable[[np.ndarray], dict[str, np.ndarray]],
+    block_shape: tuple[int, int, int],
+    halo_shape: tuple[int, int, int],
+    stride_ratio: float = 0.75,
+    blending: BlendingMode = "uniform",
+    disable_tqdm: bool = False,
+) -> dict[str, np.ndarray]:
+    """Predict a CZYX volume block by block and blend the outputs.
+
+    Args:
+        raw (np.ndarray): Preprocessed CZYX volume.
+        predict_block (Callable): Maps a CZYX block of `block_shape` to named CZYX outputs, either of the
+            same spatial shape or cropped symmetrically by the model.
+        block_shape (tuple[int, int, int]): Shape of the blocks, halo included, ZYX.
+        halo_shape (tuple[int, int, int]): Halo on each side of a block, cropped from the outputs, ZYX.
+        stride_ratio (float): Stride between blocks as a fraction of the block shape without halo.
+        blending (BlendingMode): Weighting of overlapping blocks, see `PatchAccumulator`.
+        disable_tqdm (bool): If True, disables the tqdm progress bar.
+
+    Returns:
+        dict[str, np.ndarray]: Named CZYX outputs of the spatial shape of `raw`.
+    """
+    patch = tuple(b - 2 * h for b, h in zip(block_shape, halo_shape))
+    if min(patch) < 1:
+        raise ValueError(
+            f"Block shape {block_shape} is too small for the halo {halo_shape}."
+        )
+
+    # volumes smaller than a block are mirror-padded to one block and cropped again
+    volume_shape = raw.shape[1:]
+    pad_width = [(0, 0)] + [(0, max(p - s, 0)) for p, s in zip(patch, volume_shape)]
+    if any(after for _, after in pad_width):
+        raw = np.pad(raw, pad_width, mode="reflect")
+
+    stride = get_stride_shape(patch, stride_ratio)
+    raw_slices = PatchIndex.from_grid(raw.shape[1:], patch, stride)
+    logger.info(
+        f"Predicting {len(raw_slices)} blocks of shape {block_shape} with halo {halo_shape}"
+    )
+
+    outputs, accumulators = {}, {}
+    for raw_idx in tqdm.tqdm(raw_slices, disable=disable_tqdm):
+        block = read_mirror_padded_patch(
+            raw, (slice(0, raw.shape[0]),) + raw_idx, (0,) + tuple(halo_shape)
+        )
+        for name, prediction in predict_block(block).items():
+            crop = []
+            for in_size, out_size, halo in zip(
+                block.shape[1:], prediction.shape[1:], halo_shape
+            ):
+                border = halo - (in_size - out_size) // 2
+                if (in_size - out_size) % 2 or border < 0:
+                    raise ValueError(
+                        f"Output {name} of shape {prediction.shape} cannot be aligned with "
+                        f"the input block of shape {block.shape}."
+                    )
+                crop.append(slice(border, out_size - border))
+            prediction = prediction[(slice(None), *crop)]
+
+            if name not in outputs:
+                outputs[name] = np.zeros(
+                    (prediction.shape[0],) + raw.shape[1:], dtype="float32"
+                )
+                accumulators[name] = PatchAccumulator(
+                    outputs[name], raw_slices, mode=blending
+                )
+            accumulators[name].add(prediction, raw_idx)
+
+    crop = (slice(None),) + tuple(slice(0, s) for s in volume_shape)
+    return {name: output[crop] for name, output in outputs.items()}
+
+
+def biio_predict_tiled(
+    model: v0_4.ModelDescr | v0_5.ModelDescr,
+    raw: np.ndarray,
+    input_layout: str,
+    axis_sizes: AxisSizes,
+    block_shape: tuple[int, int, int] | None = None,
+    halo_shape: tuple[int, int, int] | None = None,
+    stride_ratio: float = 0.75,
+    blending: BlendingMode = "uniform",
+    device: str = "cpu",
+    disable_tqdm: bool = False,
+) -> dict[str, np.ndarray]:
+    """Tiled prediction of `raw` by a BioImage.IO model, see the module docstring.
+
+    Args:
+        model: The model description.
+        raw (np.ndarray): Raw input data.
+        input_layout (str): The layout of `raw`, e.g. 'ZYX' or 'CZYX'.
+        axis_sizes (AxisSizes): Valid ZYX input sizes, see `spatial_axis_sizes`.
+        block_shape (tuple[int, int, int] | None): Block shape, halo included, ZYX. Defaults to None, i.e. the
+            largest valid block fitting in half of the available memory, see `find_block_shape`.
+        halo_shape (tuple[int, int, int] | None): Halo of the blocks, ZYX. Defaults to None, i.e. from the RDF.
+        stride_ratio (float): Stride between blocks as a fraction of the block shape without halo.
+        blending (BlendingMode): Weighting of overlapping blocks.
+        device (str): The computation device.
+        disable_tqdm (bool): If True, disables the tqdm progress bar.
+
+    Returns:
+        dict[str, np.ndarray]: CZYX prediction of each model output.
+    """
+    input_axes = model_input_axes(model)
+    stack_axis = AxisId("z") if AxisId("z") in input_axes else AxisId("batch")
+    czyx = [AxisId("channel"), stack_axis, AxisId("y"), AxisId("x")]
+
+    dims = [AxisId("channel") if a == "C" else AxisId(a.lower()) for a in input_layout]
+    dims = [stack_axis if d == AxisId("z") else d for d in dims]
+
+    pipeline = create_prediction_pipeline(model, devices=[device])
+    try:
+        input_id = pipeline.input_ids[0]
+        sample = Sample(
+            members={input_id: Tensor(array=raw, dims=dims).transpose(input_axes)},
+            stat={},
+            id="raw",
+        )
+        pipeline.apply_preprocessing(sample)
+        preprocessed = sample.members[input_id].transpose(czyx).data.to_numpy()
+
+        if halo_shape is None:
+            halo_shape = model_halo(model)
+        if stack_axis == AxisId("batch"):
+            halo_shape = (0,) + tuple(halo_shape[1:])
+        if block_shape is None:
+            max_voxels = available_memory_bytes(device) // 2 // BIIO_BYTES_PER_VOXEL
+            block_shape = find_block_shape(
+                preprocessed.shape[1:], axis_sizes, halo_shape, max_voxels
+            )
+
+        def predict_block(block: np.ndarray) -> dict[str, np.ndarray]:
+            block_sample = Sample(
+                members={
+                    input_id: Tensor(array=block, dims=czyx).transpose(input_axes)
+                },
+                stat=sample.stat,
+                id="block",
+            )
+            output = pipeline.predict_sample_without_blocking(
+                block_sample,
+                skip_preprocessing=True,
+                skip_postprocessing=True,
+                **_NO_HALO_HANDLING,
+            )
+            return {
+                member: tensor.transpose(czyx).data.to_numpy()
+                for member, tensor in output.members.items()
+            }
+
+        outputs = predict_tiled(
+            preprocessed,
+            predict_block,
+            block_shape,
+            halo_shape,
+            stride_ratio=stride_ratio,
+            blending=blending,
+            disable_tqdm=disable_tqdm,
+        )
+
+        # postprocess the blended outputs together with the preprocessed input they may refer to
+        for member, output_axes in zip(pipeline.output_ids, model_output_axes(model)):
+            sample.members[member] = Tensor(array=outputs[member], dims=czyx).transpose(
+                output_axes
+            )
+        pipeline.apply_postprocessing(sample)
+        return {
+            f"{member}": sample.members[member].transpose(czyx).data.to_numpy()
+            for member in pipeline.output_ids
+        }
+    finally:
+        pipeline.unload()
@@ -0,0 +1,267 @@
+import itertools
+from typing import Literal, Sequence
+
+import numpy as np
+
+BlendingMode = Literal["uniform", "gaussian", "cosine"]
+BLENDING_MODES = ("uniform", "gaussian", "cosine")
+
+OutputDtype = Literal["float32", "float16", "uint8"]
+OUTPUT_DTYPES = ("float32", "float16", "uint8")
+
+
+def check_output_dtype(output_dtype: str) -> OutputDtype:
+    if output_dtype not in OUTPUT_DTYPES:
+        raise ValueError(
+            f"Unknown output dtype {output_dtype}, select one of {OUTPUT_DTYPES}"
+        )
+    return output_dtype
+
+
+def quantize(values, dtype) -> np.ndarray:
+    """Store probabilities in `dtype`: unsigned integers map [0, 1] to their full range, floats are cast."""
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        scale = np.iinfo(dtype).max
+        return np.clip(np.rint(np.asarray(values) * scale), 0, scale).astype(dtype)
+    return np.asarray(values, dtype=dtype)
+
+
+def dequantize(values) -> np.ndarray:
+    """Probabilities of `values` stored by `quantize`, as float32."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype("float32") / np.iinfo(values.dtype).max
+    return values.astype("float32", copy=False)
+
+
+def get_blending_window(
+    size: int, mode: BlendingMode = "uniform", min_weight: float = 1e-3
+) -> np.ndarray:
+    """Create a 1D weight window for blending overlapping patches.
+
+    Args:
+        size (int): Length of the patch along the axis.
+        mode (BlendingMode): 'uniform' (plain averaging), 'gaussian' (sigma = size / 8)
+            or 'cosine' (Hann window sampled at voxel centres).
+        min_weight (float): Lower bound for the weights, so that voxels at the volume border
+            covered by a single patch edge still get a well-conditioned normalization.
+
+    Returns:
+        np.ndarray: float64 window of shape (size,) with maximum 1.
+    """
+    if mode == "uniform" or size == 1:
+        return np.ones(size, dtype="float64")
+
+    centres = np.arange(size, dtype="float64") + 0.5
+    if mode == "gaussian":
+        sigma = size / 8
+        window = np.exp(-0.5 * ((centres - size / 2) / sigma) ** 2)
+    elif mode == "cosine":
+        window = np.sin(np.pi * centres / size) ** 2
+    else:
+        raise ValueError(
+            f"Unknown blending mode {mode}, select one of {BLENDING_MODES}"
+        )
+
+    window /= window.max()
+    return np.maximum(window, min_weight)
+
+
+def _axis_intervals(
+    raw_slices: Sequence[tuple[slice, ...]],
+) -> list[list[tuple[int, int]]]:
+    """Unique (start, stop) intervals per spatial axis of a grid of patch slices."""
+    if hasattr(
+        raw_slices, "axis_intervals"
+    ):  # `PatchIndex`, without building every slice
+        return raw_slices.axis_intervals()
+    intervals = [set() for _ in range(3)]
+    for raw_idx in raw_slices:
+        spatial_idx = raw_idx[-3:]
+        for axis, index in enumerate(spatial_idx):
+            intervals[axis].add((index.start, index.stop))
+    return [sorted(axis_intervals) for axis_intervals in intervals]
+
+
+class PatchAccumulator:
+    """Blend overlapping patch predictions into an output array without a normalization mask.
+
+    Each patch is weighted by a separable window `w_z * w_y * w_x`. Patches built by `SliceBuilder`
+    form a Cartesian grid, so the sum of the windows covering a voxel factorizes into three 1D
+    profiles computed from the slice layout alone. Every patch is divided by these profiles before
+    it is added, so `output` holds the final, normalized prediction once all patches are added,
+    and no per-voxel counter (or second full-size array) is needed.
+
+    Patches of the grid may be skipped, e.g. empty background ones: `output` is initialized to
+    `background` and each added patch contributes `prediction - background`, which is exactly
+    the blend of the predicted patches with skipped patches predicting `background` everywhere.
+    The background is either a constant or a (C, Z, Y, X) estimate, e.g. an upsampled coarse prediction.
+
+    `output` may be float16 or a `quantize`d unsigned integer array. The volume is then divided into the
+    cells delimited by the patch borders, each covered by a fixed set of patches. Contributions to a cell
+    are summed in a float32 buffer until its last patch of `added_slices` is added, and the cell is
+    rounded into `output` once, so only cells in the overlap of patches in flight are held in float32.
+
+    Args:
+        output: (C, Z, Y, X) output initialized to `background`, a numpy array or any array-like
+            supporting slicing assignment, e.g. a `zarr.Array` or `h5py.Dataset`.
+        raw_slices (Sequence[tuple[slice, ...]]): All patch slices of the grid, ZYX or CZYX.
+        mode (BlendingMode): Blending window, see `get_blending_window`.
+        background (float | np.ndarray): Value of the skipped patches and initial value of `output`.
+        added_slices (Sequence[tuple[slice, ...]] | None): Patches that will be added, if only some of the
+            grid, e.g. without skipped background patches or the shard of one process. Only used for
+            non-float32 outputs. Defaults to None, i.e. `raw_slices`.
+    """
+
+    def __init__(
+        self,
+        output,
+        raw_slices: Sequence[tuple[slice, ...]],
+        mode: BlendingMode = "uniform",
+        background: float | np.ndarray = 0.0,
+        added_slices: Sequence[tuple[slice, ...]] | None = None,
+    ):
+        if mode not in BLENDING_MODES:
+            raise ValueError(
+                f"Unknown blending mode {mode}, select one of {BLENDING_MODES}"
+            )
+        self.output = output
+        self.mode = mode
+        self.background = background
+
+        volume_shape = output.shape[1:]
+        self._windows = []
+        self._normalizations = []
+        for size, intervals in zip(volume_shape, _axis_intervals(raw_slices)):
+            patch_sizes = {stop - start for start, stop in intervals}
+            assert len(patch_sizes) == 1, "All patches must have the same shape"
+            window = get_blending_window(patch_sizes.pop(), mode)
+
+            normalization = np.zeros(size, dtype="float64")
+            for start, stop in intervals:
+                normalization[start:stop] += window
+            assert np.all(normalization > 0), "Patches do not cover the whole volume"
+
+            self._windows.append(window)
+            self._normalizations.append(normalization)
+
+        self._quantized = np.dtype(output.dtype) != np.float32
+        if self._quantized:
+            self._init_cells(raw_slices if added_slices is None else added_slices)
+
+    def _init_cells(self, added_slices: Sequence[tuple[slice, ...]]) -> None:
+        """Cells between the patch borders, and the number of patches still to be added to each."""
+        self._cuts = [
+            np.unique([bound for interval in intervals for bound in interval])
+            for intervals in _axis_intervals(added_slices)
+        ]
+        self._remaining = np.zeros(
+            tuple(max(len(cuts) - 1, 0) for cuts in self._cuts), dtype="int32"
+        )
+        for raw_idx in added_slices:
+            self._remaining[self._cell_ranges(raw_idx[-3:])] += 1
+        self._pending: dict[tuple[int, int, int], np.ndarray] = {}
+
+    def _cell_ranges(self, index: tuple[slice, slice, slice]) -> tuple[slice, ...]:
+        return tuple(
+            slice(
+                np.searchsorted(cuts, axis_index.start),
+                np.searchsorted(cuts, axis_index.stop),
+            )
+            for cuts, axis_index in zip(self._cuts, index)
+        )
+
+    def patch_weights(self, index: tuple[slice, slice, slice]) -> np.ndarray:
+        """Normalized blending weights of the patch at spatial `index`, shape (Z, Y, X)."""
+        w_z, w_y, w_x = (
+            window / normalization[axis_index]
+            for window, normalization, axis_index in zip(
+                self._windows, self._normalizations, index
+            )
+        )
+        return (w_z[:, None, None] * w_y[None, :, None] * w_x[None, None, :]).astype(
+            "float32"
+        )
+
+    def add(self, prediction: np.ndarray, index: tuple[slice, slice, slice]) -> None:
+        """Add a (C, Z, Y, X) patch prediction located at spatial `index`."""
+        index = (slice(0, prediction.shape[0]),) + tuple(index)
+        if isinstance(self.background, np.ndarray):
+            prediction = prediction - self.background[index]
+        elif self.background:
+            prediction = prediction - self.background
+        contribution = prediction * self.patch_weights(index[1:])
+        if not self._quantized:
+            self.output[index] = self.output[index] + contribution
+            return
+
+        spatial_index = index[1:]
+        cell_ranges = self._cell_ranges(spatial_index)
+        for cell in itertools.product(*(range(r.start, r.stop) for r in cell_ranges)):
+            cell_index = tuple(
+                slice(cuts[c], cuts[c + 1]) for cuts, c in zip(self._cuts, cell)
+            )
+            local_index = (slice(None),) + tuple(
+                slice(c.start - p.start, c.stop - p.start)
+                for c, p in zip(cell_index, spatial_index)
+            )
+            blended = contribution[local_index]
+            if cell in self._pending:
+                blended = self._pending.pop(cell) + blended
+            self._remaining[cell] -= 1
+            if self._remaining[cell] > 0:
+                self._pending[cell] = blended
+                continue
+            # last patch of the cell: round the blend into the output once
+            output_index = index[:1] + cell_index
+            current = dequantize(self.output[output_index])
+            self.output[output_index] = quantize(current + blended, self.output.dtype)
+
+
+class LockedAccumulator:
+    """`PatchAccumulator` shared by several processes writing into the same output.
+
+    The output is divided into blocks of `block_shape` and each block is guarded by one of
+    `locks` (lock striping, so the number of locks does not grow with the volume). Adding a patch
+    holds the locks of all blocks it touches, acquired in a fixed order to avoid deadlocks, so
+    the read-modify-write of overlapping patches from different processes never interleaves.
+
+    Args:
+        accumulator (PatchAccumulator): Accumulator over the shared output.
+        locks (Sequence): Process-shared locks, e.g. created by `multiprocessing.Lock`.
+        block_shape (tuple[int, int, int]): Shape of the output blocks, ZYX.
+    """
+
+    def __init__(
+        self,
+        accumulator: PatchAccumulator,
+        locks: Sequence,
+        block_shape: tuple[int, int, int],
+    ):
+        self.accumulator = accumulator
+        self.locks = locks
+        self.block_shape = block_shape
+
+    def _lock_ids(self, index: tuple[slice, slice, slice]) -> list[int]:
+        block_ranges = (
+            range(axis_index.start // size, (axis_index.stop - 1) // size + 1)
+            for axis_index, size in zip(index, self.block_shape)
+        )
+        return sorted(
+            {
+                hash(block) % len(self.locks)
+                for block in itertools.product(*block_ranges)
+            }
+        )
+
+    def add(self, prediction: np.ndarray, index: tuple[slice, slice, slice]) -> None:
+        """Add a (C, Z, Y, X) patch prediction located at spatial `index`."""
+        lock_ids = self._lock_ids(index)
+        for lock_id in lock_ids:
+            self.locks[lock_id].acquire()
+        try:
+            self.accumulator.add(prediction, index)
+        finally:
+            for lock_id in reversed(lock_ids):
+                self.locks[lock_id].release()
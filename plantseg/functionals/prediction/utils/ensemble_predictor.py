@@ -0,0 +1,138 @@
+import logging
+from typing import Sequence
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import Dataset
+
+from plantseg.functionals.prediction.utils.array_predictor import ArrayPredictor
+from plantseg.functionals.prediction.utils.size_finder import _is_2d_model
+
+logger = logging.getLogger(__name__)
+
+
+class EnsemblePredictor(ArrayPredictor):
+    """Predictor applying several models to the same patches in a single pass over a dataset.
+
+    Each patch is read, normalized and padded once, and its batch is moved to the device once, then
+    fed through every model. The outputs are either stacked along the channel axis and blended
+    together, or averaged before blending, in which case only one prediction map is allocated.
+
+    Args:
+        models (Sequence[nn.Module]): Models sharing the number of input channels, all 2D or all 3D.
+        in_channels (int): Number of input channels of the models.
+        out_channels (Sequence[int]): Number of output channels of each model.
+        device (str): Device to use for prediction.
+        patch (tuple[int, int, int]): Patch size used for prediction.
+        patch_halo (tuple[int, int, int]): Halo size around each patch, the same for all models.
+        single_batch_mode (bool): Whether to use a batch size of 1.
+        headless (bool): Whether the predictor runs in headless mode.
+        average (bool, optional): If True, average the outputs of the models, which must have the same
+            number of output channels. Defaults to False.
+        **kwargs: Further options of `ArrayPredictor`, applied to every model, e.g. `output_channels` selects
+            the same channels of each model. Multi-process prediction is not supported.
+
+    Attributes:
+        predictors (list[ArrayPredictor]): One predictor per model, used for its forward pass only.
+        average (bool): Whether the outputs of the models are averaged.
+        model_channels (list[int]): Number of channels of the prediction of each model.
+    """
+
+    def __init__(
+        self,
+        models: Sequence[nn.Module],
+        in_channels: int,
+        out_channels: Sequence[int],
+        device: str,
+        patch: tuple[int, int, int],
+        patch_halo: tuple[int, int, int],
+        single_batch_mode: bool,
+        headless: bool,
+        average: bool = False,
+        **kwargs,
+    ):
+        if len(models) == 0:
+            raise ValueError("An ensemble needs at least one model.")
+        if len({_is_2d_model(model) for model in models}) > 1:
+            raise ValueError("2D and 3D models cannot be combined in an ensemble.")
+        if kwargs.pop("num_processes", 1) > 1:
+            logger.warning(
+                "Multi-process prediction is not supported by ensembles, using one process."
+            )
+
+        self.predictors = [
+            ArrayPredictor(
+                model=model,
+                in_channels=in_channels,
+                out_channels=channels,
+                device=device,
+                patch=patch,
+                patch_halo=patch_halo,
+                single_batch_mode=single_batch_mode,
+                headless=headless,
+                **kwargs,
+            )
+            for model, channels in zip(models, out_channels)
+        ]
+        is_2d_model = _is_2d_model(models[0])
+        self.model_channels = [
+            predictor.get_out_channels(is_2d_model) for predictor in self.predictors
+        ]
+        if average and len(set(self.model_channels)) > 1:
+            raise ValueError(
+                f"Cannot average models with different numbers of output channels {self.model_channels}."
+            )
+        self.average = average
+
+        # the forward passes run in `predictors`, batches must fit in memory for all of them
+        kwargs.pop("is_embedding", None)
+        kwargs.pop("output_channels", None)
+        kwargs["batch_size"] = min(
+            predictor.batch_size for predictor in self.predictors
+        )
+        super().__init__(
+            model=models[0],
+            in_channels=in_channels,
+            out_channels=self.model_channels[0]
+            if average
+            else sum(self.model_channels),
+            device=device,
+            patch=patch,
+            patch_halo=patch_halo,
+            single_batch_mode=single_batch_mode,
+            headless=False,
+            **kwargs,
+        )
+        self.model = self.predictors[0].model
+        self.device = self.predictors[0].device
+
+    def __call__(self, test_dataset: Dataset) -> np.ndarray | list[np.ndarray]:
+        """Predict `test_dataset` with all models.
+
+        Returns:
+            np.ndarray | list[np.ndarray]: The averaged (C, Z, Y, X) prediction, or the (C, Z, Y, X) prediction
+                of each model, as views of a single array.
+        """
+        for predictor in self.predictors:
+            predictor.model.eval()
+        prediction_map = super().__call__(test_dataset)
+        if self.average:
+            return prediction_map
+        return np.split(prediction_map, np.cumsum(self.model_channels)[:-1])
+
+    def predict_batch(self, input_: torch.Tensor, is_2d_model: bool) -> np.ndarray:
+        """Run the forward pass of every model on a batch of halo-padded patches.
+
+        Returns:
+            np.ndarray: Predictions for the batch in NCZYX layout with the halo removed, the channels of
+                all models stacked or averaged.
+        """
+        input_ = input_.to(self.device, non_blocking=True)
+        predictions = [
+            predictor.predict_batch(input_, is_2d_model)
+            for predictor in self.predictors
+        ]
+        if self.average:
+            return np.mean(predictions, axis=0, dtype="float32")
+        return np.concatenate(predictions, axis=1)
@@ -0,0 +1,238 @@
+import logging
+from pathlib import Path
+from typing import Sequence
+
+import h5py
+import zarr
+from torch import nn
+from torch.utils.data import Dataset
+
+from plantseg.functionals.prediction.utils.array_dataset import ArrayDataset
+from plantseg.functionals.prediction.utils.array_predictor import ArrayPredictor
+from plantseg.functionals.prediction.utils.backends import Backend
+from plantseg.functionals.prediction.utils.blending import (
+    BlendingMode,
+    OutputDtype,
+    PatchAccumulator,
+    quantize,
+)
+from plantseg.functionals.prediction.utils.precision import Precision
+from plantseg.functionals.prediction.utils.size_finder import _is_2d_model
+from plantseg.io.h5 import H5_EXTENSIONS
+from plantseg.io.zarr import IS_ZARR_V3, ZARR_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+
+def _create_chunked_dataset(
+    container,
+    key: str,
+    shape: tuple[int, ...],
+    chunks: tuple[int, ...],
+    dtype: str,
+    fill_value: float = 0,
+):
+    """Create an empty, chunked dataset in an open Zarr group or HDF5 file, replacing any existing one.
+
+    Chunks that are never written are not stored and read as `fill_value`.
+    """
+    if isinstance(container, h5py.File):
+        if key in container:
+            del container[key]
+        return container.create_dataset(
+            key, shape=shape, chunks=chunks, dtype=dtype, fillvalue=fill_value
+        )
+
+    if IS_ZARR_V3:
+        return container.create_array(
+            name=key,
+            shape=shape,
+            chunks=chunks,
+            dtype=dtype,
+            fill_value=fill_value,
+            overwrite=True,
+        )
+    return container.create_dataset(
+        key,
+        shape=shape,
+        chunks=chunks,
+        dtype=dtype,
+        fill_value=fill_value,
+        overwrite=True,
+    )
+
+
+class LazyPredictor(ArrayPredictor):
+    """Predictor class for applying a model to a dataset that does not fit in memory.
+
+    Instead of accumulating the probability maps in numpy arrays, this predictor writes them
+    patch by patch into a chunked on-disk dataset (Zarr or HDF5). Overlapping patches are blended
+    with pre-normalized weights (see `PatchAccumulator`), so no normalization mask and no second
+    pass over the output are needed. Together with `ArrayDataset`, which reads the raw patches
+    on demand, peak memory depends on the patch and batch size only, not on the size of the volume.
+
+    Based on pytorch-3dunet LazyPredictor:
+    https://github.com/wolny/pytorch-3dunet/blob/master/pytorch3dunet/unet3d/predictor.py
+
+    Args:
+        model (nn.Module): A trained model used for prediction.
+        in_channels (int): Number of input channels to the model.
+        out_channels (int): Number of output channels from the model.
+        device (str): Device to use for prediction.
+        patch (tuple[int, int, int]): Patch size used for prediction.
+        patch_halo (tuple[int, int, int]): Mirror padding around the patch.
+        single_batch_mode (bool): If True, the batch size will be set to 1.
+        headless (bool): If True, use DataParallel if multiple GPUs are available.
+        output_path (Path): Zarr or HDF5 file the prediction is written to.
+        output_key (str, optional): Key of the prediction dataset in `output_path`. Defaults to "predictions".
+        is_embedding (bool, optional): If True, convert model output to embeddings. Defaults to False.
+        verbose_logging (bool, optional): If True, enable verbose logging. Defaults to False.
+        disable_tqdm (bool, optional): If True, disable tqdm progress bars. Defaults to False.
+        blending (BlendingMode, optional): Weighting of overlapping patches, 'uniform', 'gaussian' or 'cosine'.
+            Defaults to 'uniform'.
+        num_workers (int, optional): Number of worker processes preparing patches. HDF5 inputs are always
+            read in the main process. Defaults to 0.
+        prefetch_factor (int, optional): Number of batches prepared ahead by each worker. Defaults to 2.
+        precision (Precision, optional): Precision of the forward pass, 'fp32', 'bf16' or 'fp16-accumulate'.
+            Defaults to 'fp32'.
+        backend (Backend, optional): Inference backend, 'eager', 'torchscript', 'compile' or 'onnx'.
+            Defaults to 'eager'.
+        batch_size (int | None, optional): Batch size overriding `single_batch_mode`. Defaults to None.
+        num_threads (int | None, optional): Number of torch threads used during prediction. Defaults to None.
+        background_value (float, optional): Prediction of skipped background patches, also the fill value
+            of the output dataset, so skipped regions are never written. Defaults to 0.
+        output_channels (Sequence[int] | None, optional): Indices of the output channels to keep. Defaults to None.
+        output_dtype (OutputDtype, optional): Dtype of the output dataset, see `ArrayPredictor`. Defaults to 'float32'.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        in_channels: int,
+        out_channels: int,
+        device: str,
+        patch: tuple[int, int, int],
+        patch_halo: tuple[int, int, int],
+        single_batch_mode: bool,
+        headless: bool,
+        output_path: Path,
+        output_key: str = "predictions",
+        is_embedding: bool = False,
+        verbose_logging: bool = False,
+        disable_tqdm: bool = False,
+        tracker=None,
+        blending: BlendingMode = "uniform",
+        num_workers: int = 0,
+        prefetch_factor: int = 2,
+        precision: Precision = "fp32",
+        backend: Backend = "eager",
+        batch_size: int | None = None,
+        num_threads: int | None = None,
+        background_value: float = 0.0,
+        output_channels: Sequence[int] | None = None,
+        output_dtype: OutputDtype = "float32",
+    ):
+        super().__init__(
+            model=model,
+            in_channels=in_channels,
+            out_channels=out_channels,
+            device=device,
+            patch=patch,
+            patch_halo=patch_halo,
+            single_batch_mode=single_batch_mode,
+            headless=headless,
+            is_embedding=is_embedding,
+            verbose_logging=verbose_logging,
+            disable_tqdm=disable_tqdm,
+            tracker=tracker,
+            blending=blending,
+            num_workers=num_workers,
+            prefetch_factor=prefetch_factor,
+            precision=precision,
+            backend=backend,
+            batch_size=batch_size,
+            num_threads=num_threads,
+            background_value=background_value,
+            output_channels=output_channels,
+            output_dtype=output_dtype,
+        )
+        output_path = Path(output_path)
+        suffix = output_path.suffix.lower()
+        if suffix not in ZARR_EXTENSIONS and suffix not in H5_EXTENSIONS:
+            raise ValueError(
+                f"Output file must be a Zarr or HDF5 file, got '{output_path}'. "
+                f"Supported extensions: {ZARR_EXTENSIONS + H5_EXTENSIONS}"
+            )
+        self.output_path = output_path
+        self.output_key = output_key
+
+    @property
+    def _is_zarr_output(self) -> bool:
+        return self.output_path.suffix.lower() in ZARR_EXTENSIONS
+
+    def _open_output(self, mode: str):
+        if self._is_zarr_output:
+            return zarr.open_group(str(self.output_path), mode=mode)
+        return h5py.File(self.output_path, mode)
+
+    def __call__(self, test_dataset: Dataset):
+        """Predict `test_dataset` into `output_path`.
+
+        Returns:
+            zarr.Array | h5py.Dataset: The read-only on-disk prediction maps in CZYX layout. The file of an
+                HDF5 dataset stays open until the caller closes it with `dataset.file.close()`.
+        """
+        assert isinstance(test_dataset, ArrayDataset), (
+            "Dataset must be an instance of ArrayDataset"
+        )
+        assert self.patch_halo == test_dataset.halo_shape, (
+            f"Predictor halo shape {self.patch_halo} does not match dataset halo shape {test_dataset.halo_shape}"
+        )
+
+        test_loader = self.data_loader(test_dataset)
+
+        volume_shape = self.volume_shape(test_dataset)
+        is_2d_model = _is_2d_model(self.model)
+        out_channels = self.get_out_channels(is_2d_model)
+
+        prediction_maps_shape = (out_channels,) + tuple(volume_shape)
+        chunks = (1,) + tuple(min(p, s) for p, s in zip(self.patch, volume_shape))
+
+        if self.verbose_logging:
+            logger.info(
+                f"Writing prediction maps of shape (CDHW) {prediction_maps_shape} "
+                f"to {self.output_path}:{self.output_key}"
+            )
+
+        container = self._open_output("a")
+        try:
+            prediction_map = _create_chunked_dataset(
+                container,
+                self.output_key,
+                prediction_maps_shape,
+                chunks,
+                self.output_dtype,
+                fill_value=quantize(self.background_value, self.output_dtype).item(),
+            )
+            accumulator = PatchAccumulator(
+                prediction_map,
+                test_dataset.grid_slices,
+                mode=self.blending,
+                background=self.background_value,
+                added_slices=test_dataset.raw_slices,
+            )
+
+            self.model.eval()
+            self.predict_loader(test_loader, accumulator, is_2d_model)
+        finally:
+            if isinstance(container, h5py.File):
+                container.close()
+
+        if self.verbose_logging:
+            logger.info("Prediction finished")
+
+        if self._is_zarr_output:
+            return zarr.open_array(
+                str(self.output_path), mode="r", path=self.output_key
+            )
+        return h5py.File(self.output_path, "r")[self.output_key]
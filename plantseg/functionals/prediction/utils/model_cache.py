@@ -0,0 +1,219 @@
+"""Process-wide cache of loaded U-Net models.
+
+Building a model for prediction resolves it through `model_zoo`, constructs the network, loads the
+checkpoint and computes its halo. `load_model` does this once per (model source, weights
+fingerprint, device, precision) and keeps the ready-to-use model in `model_cache`, a
+least-recently-used cache bounded by the memory of the cached parameters.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import torch
+from torch import nn
+
+from plantseg import (
+    FILE_BEST_MODEL_PYTORCH,
+    FILE_CONFIG_TRAIN_YAML,
+    PATH_PLANTSEG_MODELS,
+)
+from plantseg.core.zoo import model_zoo
+from plantseg.functionals.prediction.utils.precision import Precision, prepare_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+@dataclass
+class CachedModel:
+    """A model in evaluation mode on its device, with its configuration and halo."""
+
+    model: nn.Module
+    model_config: dict
+    n_bytes: int
+    _halo: tuple[int, int, int] | None = field(default=None, repr=False)
+
+    @property
+    def halo(self) -> tuple[int, int, int]:
+        """Theoretical minimum halo of the model, computed on first access."""
+        if self._halo is None:
+            self._halo = model_zoo.compute_3D_halo_for_pytorch3dunet(self.model)
+        return self._halo
+
+
+def model_n_bytes(model: nn.Module) -> int:
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def weights_fingerprint(*paths: Path) -> str:
+    """Hash of path, size and modification time of the files a model is loaded from."""
+    sha = hashlib.sha1()
+    for path in paths:
+        path = Path(path).resolve()
+        stat = path.stat()
+        sha.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return sha.hexdigest()[:16]
+
+
+def load_state(model_path: Path) -> dict:
+    """Load a checkpoint memory-mapped, so tensors are paged in from disk as they are copied."""
+    try:
+        state = torch.load(model_path, map_location="cpu", weights_only=True, mmap=True)
+    except RuntimeError:  # legacy (non-zip) checkpoints cannot be memory-mapped
+        state = torch.load(model_path, map_location="cpu", weights_only=True)
+
+    if "model_state_dict" in state:  # Model weights format may vary between versions
+        state = state["model_state_dict"]
+    return state
+
+
+class ModelCache:
+    """Least-recently-used cache of `CachedModel`s bounded by their total parameter memory.
+
+    Args:
+        max_bytes (int): Memory budget of the cached parameters and buffers. The most recently
+            used model is always kept, even if it alone exceeds the budget.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, CachedModel] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._entries
+
+    @property
+    def n_bytes(self) -> int:
+        return sum(entry.n_bytes for entry in self._entries.values())
+
+    def get_or_load(self, key: tuple, loader: Callable[[], CachedModel]) -> CachedModel:
+        """Return the model cached under `key`, calling `loader` on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                logger.info("Using cached model.")
+                return entry
+
+            entry = loader()
+            self._entries[key] = entry
+            while len(self._entries) > 1 and self.n_bytes > self.max_bytes:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logger.info(f"Evicted model {evicted_key[0]} from the model cache.")
+            return entry
+
+    def discard(self, source: tuple) -> None:
+        """Remove all entries of a model source, e.g. after its files were updated."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == source]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+model_cache = ModelCache()
+
+
+def _load(
+    get_model: Callable[[], tuple[nn.Module, dict, Path]],
+    device: str,
+    precision: Precision,
+) -> CachedModel:
+    model, model_config, model_path = get_model()
+    model.load_state_dict(load_state(model_path))
+    model = prepare_model(model.to(device), precision)
+    model.eval()
+    return CachedModel(
+        model=model, model_config=model_config, n_bytes=model_n_bytes(model)
+    )
+
+
+def load_model(
+    model_name: str | None = None,
+    model_id: str | None = None,
+    config_path: Path | None = None,
+    model_weights_path: Path | None = None,
+    model_update: bool = False,
+    device: str = "cpu",
+    precision: Precision = "fp32",
+) -> CachedModel:
+    """Load a model with its weights through `model_cache`.
+
+    Exactly like `unet_prediction`, `config_path` takes precedence over `model_id`, which takes
+    precedence over `model_name`. Models from a config path or the PlantSeg zoo are keyed by the
+    fingerprint of their files, so edited or updated weights are reloaded. BioImage.IO models are
+    keyed by their ID.
+
+    Args:
+        model_name (str | None): The name of a model in the PlantSeg zoo.
+        model_id (str | None): The ID of a model in the BioImage.IO model zoo.
+        config_path (Path | None): Path to the configuration of a custom model.
+        model_weights_path (Path | None): Path to the weights of a custom model.
+        model_update (bool): If True, download the zoo model again and replace cached copies.
+        device (str): Device to load the model on.
+        precision (Precision): Precision the model is prepared for.
+
+    Returns:
+        CachedModel: The cached model, shared between callers; do not modify it.
+
+    Raises:
+        ValueError: If neither `model_name`, `model_id`, nor `config_path` are provided.
+    """
+    if config_path is not None:  # Safari mode for custom models outside zoos
+        logger.info("Safari prediction: Running model from custom config path.")
+        config_path = Path(config_path)
+        weights_path = (
+            model_weights_path or config_path.parent / FILE_BEST_MODEL_PYTORCH
+        )
+        source = (
+            "config",
+            str(config_path.resolve()),
+            str(Path(weights_path).resolve()),
+        )
+        fingerprint = weights_fingerprint(config_path, weights_path)
+
+        def get_model():
+            return model_zoo.get_model_by_config_path(config_path, model_weights_path)
+
+    elif model_id is not None:  # BioImage.IO zoo mode
+        logger.info("BioImage.IO prediction: Running model from BioImage.IO model zoo.")
+        source = ("bioimageio", model_id)
+        fingerprint = None
+
+        def get_model():
+            return model_zoo.get_model_by_id(model_id)
+
+    elif model_name is not None:  # PlantSeg zoo mode
+        logger.info("Zoo prediction: Running model from PlantSeg official zoo.")
+        source = ("zoo", model_name)
+        model_zoo.check_models(model_name, update_files=model_update)
+        if model_update:
+            model_cache.discard(source)
+        model_dir = PATH_PLANTSEG_MODELS / model_name
+        fingerprint = weights_fingerprint(
+            model_dir / FILE_CONFIG_TRAIN_YAML, model_dir / FILE_BEST_MODEL_PYTORCH
+        )
+
+        def get_model():
+            return model_zoo.get_model_by_name(model_name)
+
+    else:
+        raise ValueError(
+            "Either `model_name` or `model_id` or `model_path` must be provided."
+        )
+
+    key = (source, fingerprint, str(torch.device(device)), precision)
+    return model_cache.get_or_load(key, lambda: _load(get_model, device, precision))
@@ -0,0 +1,69 @@
+import contextlib
+from typing import Literal
+
+import torch
+from torch import nn
+
+from plantseg.functionals.prediction.utils.size_finder import _is_2d_model
+
+Precision = Literal["fp32", "bf16", "fp16-accumulate"]
+PRECISIONS = ("fp32", "bf16", "fp16-accumulate")
+
+_AUTOCAST_DTYPES = {
+    "bf16": torch.bfloat16,
+    "fp16-accumulate": torch.float16,
+}
+
+
+def check_precision(precision: str) -> Precision:
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, select one of {PRECISIONS}")
+    return precision
+
+
+def _device_type(device: str) -> str:
+    """`torch.autocast` device type of a device string such as 'cuda:1' or 'cpu'."""
+    return torch.device(device).type
+
+
+def memory_format(model: nn.Module) -> torch.memory_format:
+    """Channels-last memory format matching the dimensionality of `model`."""
+    return torch.channels_last if _is_2d_model(model) else torch.channels_last_3d
+
+
+def prepare_model(model: nn.Module, precision: Precision) -> nn.Module:
+    """Convert the convolution weights of `model` to channels-last for reduced precision modes.
+
+    oneDNN on CPU and cuDNN on GPU both pick their fastest bf16/fp16 convolution kernels for
+    channels-last (NDHWC / NHWC) tensors. The weights stay in float32: the autocast context
+    returned by `autocast` casts them per operation.
+    """
+    check_precision(precision)
+    if precision == "fp32":
+        return model
+    return model.to(memory_format=memory_format(model))
+
+
+def prepare_input(
+    input_: torch.Tensor, model: nn.Module, precision: Precision
+) -> torch.Tensor:
+    """Lay out a batch in the memory format `prepare_model` gave to `model`."""
+    if precision == "fp32":
+        return input_
+    return input_.contiguous(memory_format=memory_format(model))
+
+
+def autocast(device: str, precision: Precision) -> contextlib.AbstractContextManager:
+    """Context running the forward pass in `precision`.
+
+    'bf16' computes in bfloat16, which keeps the float32 exponent range and needs no scaling.
+    'fp16-accumulate' computes in float16 while autocast keeps reductions (normalization layers,
+    softmax) in float32. In both modes the outputs are converted back to float32 by the
+    predictor before they are blended, so accumulation always happens in full precision.
+    """
+    check_precision(precision)
+    if precision == "fp32":
+        return contextlib.nullcontext()
+    return torch.autocast(
+        device_type=_device_type(device), dtype=_AUTOCAST_DTYPES[precision]
+    )
@@ -0,0 +1,126 @@
+"""Content-addressed on-disk cache of prediction results.
+
+Probability maps are stored as compressed Zarr arrays under `PATH_PREDICTION_CACHE`, named by a hash
+of the raw data, the model architecture and weights, and every parameter affecting the prediction
+(patch and halo shapes, normalization, precision, ...). Re-running a workflow on the same image with
+the same model therefore loads the prediction instead of recomputing it, whichever way the
+prediction is started. Least-recently used entries are evicted once the cache exceeds its size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+import zarr
+from torch import nn
+
+from plantseg import PATH_PREDICTION_CACHE
+from plantseg.functionals.prediction.utils.backends import model_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_MAX_BYTES = 20 * 1024**3
+CACHE_CHUNK_SIZE = 128
+
+
+def array_fingerprint(array, slab_size: int = 16) -> str:
+    """Hash of the shape, dtype and values of an array, read in slabs along its first axis."""
+    sha = hashlib.blake2b(digest_size=16)
+    sha.update(f"{tuple(array.shape)}:{np.dtype(array.dtype).str}".encode())
+    for start in range(0, array.shape[0], slab_size):
+        sha.update(np.ascontiguousarray(array[start : start + slab_size]))
+    return sha.hexdigest()
+
+
+def prediction_cache_key(raw, model: nn.Module, **parameters) -> str:
+    """Key of the prediction of `raw` by `model` with the given (JSON serializable) parameters."""
+    if isinstance(model, nn.DataParallel):
+        model = model.module
+    sha = hashlib.sha1()
+    sha.update(array_fingerprint(raw).encode())
+    sha.update(model_fingerprint(model).encode())
+    # the architecture, e.g. the final activation, is not part of the weights
+    sha.update(repr(model).encode())
+    sha.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+def _entry_n_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class PredictionCache:
+    """Directory of cached predictions with size-based least-recently used eviction.
+
+    Args:
+        cache_dir (Path | None): Directory of the cache. Defaults to None, i.e. `PATH_PREDICTION_CACHE`.
+        max_bytes (int): Maximum size of the cache on disk. Defaults to 20 GiB.
+    """
+
+    def __init__(
+        self, cache_dir: Path | None = None, max_bytes: int = DEFAULT_CACHE_MAX_BYTES
+    ):
+        self.cache_dir = (
+            Path(cache_dir) if cache_dir is not None else PATH_PREDICTION_CACHE
+        )
+        self.max_bytes = max_bytes
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.zarr"
+
+    def get(self, key: str) -> np.ndarray | None:
+        """Load the prediction stored under `key` and mark it as recently used, None if not cached."""
+        path = self.entry_path(key)
+        if not path.exists():
+            return None
+        try:
+            pmaps = zarr.open_array(str(path), mode="r")[...]
+        except Exception as e:
+            logger.warning(f"Removing unreadable prediction cache entry {path}: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        os.utime(path)
+        return pmaps
+
+    def put(self, key: str, pmaps: np.ndarray) -> None:
+        """Store `pmaps` under `key`, then evict the least-recently used entries exceeding `max_bytes`.
+
+        The entry is written to a temporary directory and renamed, so concurrent readers never see
+        a partially written prediction.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.entry_path(key)
+        tmp_path = self.cache_dir / f".{key}.{uuid.uuid4().hex}.tmp"
+        chunks = (1,) + tuple(min(s, CACHE_CHUNK_SIZE) for s in pmaps.shape[1:])
+        array = zarr.open_array(
+            str(tmp_path), mode="w", shape=pmaps.shape, chunks=chunks, dtype=pmaps.dtype
+        )
+        array[...] = pmaps
+        try:
+            tmp_path.rename(path)
+        except OSError:  # stored meanwhile by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least-recently used entries until the cache fits in `max_bytes`."""
+        entries = [
+            (path.stat().st_mtime, _entry_n_bytes(path), path)
+            for path in self.cache_dir.glob("*.zarr")
+        ]
+        n_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if n_bytes <= self.max_bytes:
+                break
+            logger.info(f"Evicting prediction cache entry {path.name}")
+            shutil.rmtree(path, ignore_errors=True)
+            n_bytes -= size
+
+    def clear(self) -> None:
+        """Remove all cached predictions."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
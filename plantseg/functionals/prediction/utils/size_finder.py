@@ -1,10 +1,11 @@
 import logging
+import os
 
 import numpy as np
 import torch
 from torch import nn
 
-from plantseg.training.model import UNet2D
+from plantseg.training.model import AbstractUNet, UNet2D
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +16,143 @@ def _is_2d_model(model: nn.Module) -> bool:
     return isinstance(model, UNet2D)
 
 
+def available_memory_bytes(device: str) -> int:
+    """Free memory on `device`: free GPU memory for CUDA, available RAM otherwise."""
+    if torch.device(device).type == "cuda":
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):  # not available on macOS/Windows
+        try:
+            return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+        except (ValueError, OSError, AttributeError):
+            return 8 * 1024**3
+
+
+def _single_conv_elements(single_conv: nn.Module) -> int:
+    """Elements per voxel alive while a `SingleConv` runs: its input, the output of a
+    normalization preceding the convolution, and the convolution output."""
+    names = [name for name, _ in single_conv.named_children()]
+    conv = single_conv.conv
+    has_pre_norm = any(
+        name in ("groupnorm", "batchnorm") for name in names[: names.index("conv")]
+    )
+    return conv.in_channels * (2 if has_pre_norm else 1) + conv.out_channels
+
+
+def estimate_activation_bytes(
+    model: nn.Module,
+    in_channels: int,
+    input_shape: tuple[int, int, int],
+    batch_size: int = 1,
+    bytes_per_element: int = 4,
+    overhead: float = 1.5,
+) -> int:
+    """Estimate the peak activation memory of an inference forward pass of an `AbstractUNet`.
+
+    The model is walked level by level: all encoder outputs are kept alive until the end of the
+    forward pass (they are the skip connections), on top of which each layer needs its input,
+    an optional normalization output and its convolution output. In the decoder, the upsampled
+    features and their concatenation with the skip connection are counted as well. Pooling
+    halves every spatial dimension per level (only YX for 2D models).
+
+    Args:
+        model (nn.Module): The U-Net, possibly wrapped in `nn.DataParallel`.
+        in_channels (int): Number of input channels.
+        input_shape (tuple[int, int, int]): Shape of the network input (patch plus halo), ZYX.
+        batch_size (int): Number of patches per forward pass.
+        bytes_per_element (int): 4 for float32, 2 for bfloat16/float16.
+        overhead (float): Factor for convolution workspaces (e.g. oneDNN layout reorders) and
+            allocator slack, calibrated against the measured peak RSS of `UNet3D` on CPU.
+
+    Returns:
+        int: Estimated peak memory in bytes, excluding the model parameters.
+    """
+    if isinstance(model, nn.DataParallel):
+        model = model.module
+    assert isinstance(model, AbstractUNet), "Only AbstractUNet models are supported"
+
+    spatial_shape = input_shape[1:] if _is_2d_model(model) else input_shape
+
+    def n_voxels(level: int) -> int:
+        return int(np.prod([max(s // 2**level, 1) for s in spatial_shape]))
+
+    skips, peak = 0, in_channels * n_voxels(0)
+    for level, encoder in enumerate(model.encoders):
+        voxels = n_voxels(level)
+        for single_conv in encoder.basic_module.children():
+            peak = max(peak, skips + _single_conv_elements(single_conv) * voxels)
+        skips += encoder.basic_module.SingleConv2.conv.out_channels * voxels
+
+    n_levels = len(model.encoders)
+    for decoder, level in zip(model.decoders, range(n_levels - 2, -1, -1)):
+        voxels = n_voxels(level)
+        conv1 = decoder.basic_module.SingleConv1.conv
+        # upsampled features plus their concatenation with the skip connection
+        joined = conv1.in_channels * voxels
+        upsampled = (
+            conv1.in_channels
+            - model.encoders[level].basic_module.SingleConv2.conv.out_channels
+        ) * voxels
+        peak = max(peak, skips + upsampled + joined)
+        for single_conv in decoder.basic_module.children():
+            peak = max(peak, skips + _single_conv_elements(single_conv) * voxels)
+
+    final_conv = model.final_conv
+    peak = max(
+        peak, skips + (final_conv.in_channels + final_conv.out_channels) * n_voxels(0)
+    )
+    return int(peak * batch_size * bytes_per_element * overhead)
+
+
+def find_max_shape_by_memory(
+    model: nn.Module,
+    in_channels: int,
+    memory_budget: int,
+    batch_size: int = 1,
+    bytes_per_element: int = 4,
+) -> tuple[int, int, int]:
+    """Largest isotropic input shape, in steps of 16 voxels, whose estimated activations fit
+    `memory_budget`. 2D models get (1, n, n) and 3D models (n, n, n), capped like the GPU search."""
+    is_2d = _is_2d_model(model)
+    max_n = 200 if is_2d else 50
+
+    def shape(n: int) -> tuple[int, int, int]:
+        return (1, 16 * n, 16 * n) if is_2d else (16 * n,) * 3
+
+    best_n = 2
+    for n in range(2, max_n + 1):
+        estimate = estimate_activation_bytes(
+            model, in_channels, shape(n), batch_size, bytes_per_element
+        )
+        if estimate > memory_budget:
+            break
+        best_n = n
+    return shape(best_n)
+
+
+def find_batch_size_by_memory(
+    model: nn.Module,
+    in_channels: int,
+    input_shape: tuple[int, int, int],
+    memory_budget: int,
+    max_batch_size: int = 32,
+    bytes_per_element: int = 4,
+) -> int:
+    """Largest power of two batch size, up to `max_batch_size`, whose estimated activations for
+    inputs of `input_shape` (patch plus halo, ZYX) fit `memory_budget`. At least 1."""
+    batch_size = 1
+    while batch_size * 2 <= max_batch_size and (
+        estimate_activation_bytes(
+            model, in_channels, input_shape, batch_size * 2, bytes_per_element
+        )
+        <= memory_budget
+    ):
+        batch_size *= 2
+    return batch_size
+
+
 def find_patch_and_halo_shapes(
     full_volume_shape: tuple[int, int, int],
     max_patch_shape: tuple[int, int, int],
@@ -81,10 +219,51 @@ def find_patch_and_halo_shapes(
         return tuple(adjusted_patch_shape - halo_shape * 2), tuple(halo_shape)
 
 
+def find_slice_patch_and_halo_shapes(
+    full_volume_shape: tuple[int, int, int],
+    max_patch_shape: tuple[int, int, int],
+    min_halo_shape: tuple[int, int, int],
+) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+    """
+    Recommend the patch shape and halo size of a 2D model applied to the z-slices of a volume.
+
+    Whole XY planes are used if they fit the area of `max_patch_shape`. Otherwise only the axes
+    longer than `max_patch_shape` are tiled, and only those get the halo. The z-dimension of the
+    patch is 1 and never has a halo; several slices are predicted at once by stacking them in z.
+
+    Args:
+        full_volume_shape (tuple[int, int, int]): The shape of the full volume (Z, Y, X).
+        max_patch_shape (tuple[int, int, int]): The maximum feasible patch shape (1, Y, X).
+        min_halo_shape (tuple[int, int, int]): The minimum required halo size per side (Z, Y, X).
+
+    Returns:
+        tuple[tuple[int, int, int], tuple[int, int, int]]:
+            - Recommended patch shape `(1, Y, X)`.
+            - Halo size on one side `(0, Y, X)`.
+    """
+    shape_plane = np.array(full_volume_shape[1:])
+    shape_plane_max = np.array(max_patch_shape[1:])
+    shape_halo_min = np.array(min_halo_shape[1:])
+
+    max_area = np.prod(shape_plane_max)
+    if np.prod(shape_plane) <= max_area:
+        return (1, *map(int, shape_plane)), (0, 0, 0)
+
+    fits = shape_plane <= shape_plane_max
+    halo_shape = np.where(fits, 0, shape_halo_min)
+    if fits.any():  # keep the short axis whole and tile the long one
+        patch_shape = np.where(fits, shape_plane, max_area // shape_plane[fits].prod())
+    else:
+        patch_shape = shape_plane_max
+    patch_shape = patch_shape - halo_shape * 2
+    return (1, *map(int, patch_shape)), (0, *map(int, halo_shape))
+
+
 def find_a_max_patch_shape(
     model: nn.Module,
     in_channels: int,
     device: str,
+    memory_based: bool = False,
     # ) -> tuple[int, int, int] | tuple[int, int]:
 ) -> tuple[int, int, int]:
     """Determine the maximum feasible patch shape for a given model based on
@@ -93,11 +272,17 @@ def find_a_max_patch_shape(
     1. This is merely a good quick guess. However, an exact maximum size causes problems.
     2. If isotropic shape, then the `best_n` is 128 for 2080 Ti, 186 for 3090,
        but for the sake of speed, cap it at 50 and let batch size handle the rest.
+    3. On CPU, a fixed shape is returned unless `memory_based` is True, in which case the
+       activation memory model sizes the patch to half the available memory.
     """
 
     nn_dim = 2 if _is_2d_model(model) else 3
 
     if device == "cpu":
+        if memory_based:  # no cheap OOM signal on CPU, use the memory model
+            return find_max_shape_by_memory(
+                model, in_channels, available_memory_bytes(device) // 2
+            )
         return (1, 1024, 1024) if nn_dim == 2 else (256, 256, 256)
 
     model = model.to(device)
@@ -1,4 +1,129 @@
+import logging
+from collections.abc import Sequence
+
 import numpy as np
+from scipy.ndimage import uniform_filter
+from skimage.filters import threshold_otsu
+
+logger = logging.getLogger(__name__)
+
+
+class PatchIndex(Sequence):
+    """
+    Compact, random-access sequence of patch slices.
+
+    A patch is stored as the int32 ZYX coordinates of its corner, all patches share `patch_shape`.
+    A regular grid only stores the corner coordinates along each axis and computes the corners of
+    patches on access, so the index of any volume takes a few kilobytes, is built instantly and is
+    cheap to pickle to `DataLoader` workers or prediction processes. Subsets, e.g. filtered or
+    sharded patches, store an (N, 3) int32 corner array. Items are the same tuples of slices as the
+    lists built by `SliceBuilder._build_slices`.
+
+    Args:
+        patch_shape (tuple[int, int, int]): the shape of the patches DxHxW
+        corners (np.ndarray | None): (N, 3) corners of the patches, None for the full `grid`
+        grid (tuple[np.ndarray, ...] | None): corner coordinates along each axis of a regular grid
+        n_channels (int | None): if given, items start with `slice(0, n_channels)` for CZYX volumes
+    """
+
+    def __init__(
+        self,
+        patch_shape: tuple[int, int, int],
+        corners: np.ndarray | None = None,
+        grid: tuple[np.ndarray, ...] | None = None,
+        n_channels: int | None = None,
+    ):
+        assert (corners is None) != (grid is None), "Give either corners or a grid"
+        self.patch_shape = tuple(int(p) for p in patch_shape)
+        self.corners = (
+            None
+            if corners is None
+            else np.asarray(corners, dtype="int32").reshape(-1, 3)
+        )
+        self.grid = (
+            None
+            if grid is None
+            else tuple(np.asarray(starts, dtype="int32") for starts in grid)
+        )
+        self.n_channels = n_channels
+
+    @classmethod
+    def from_grid(
+        cls,
+        volume_shape: tuple[int, ...],
+        patch_shape: tuple[int, int, int],
+        stride_shape: tuple[int, int, int],
+    ) -> "PatchIndex":
+        """Index of the regular grid of `SliceBuilder` over a ZYX or CZYX volume."""
+        grid = tuple(
+            np.fromiter(SliceBuilder._gen_indices(size, patch, stride), dtype="int32")
+            for size, patch, stride in zip(volume_shape[-3:], patch_shape, stride_shape)
+        )
+        n_channels = volume_shape[0] if len(volume_shape) == 4 else None
+        return cls(patch_shape, grid=grid, n_channels=n_channels)
+
+    def __len__(self) -> int:
+        if self.corners is not None:
+            return len(self.corners)
+        return int(np.prod([len(starts) for starts in self.grid]))
+
+    def corners_of(self, idx) -> np.ndarray:
+        """(N, 3) int32 corners of the patches at positions `idx`, an int array or a slice.
+
+        For a single int position, the (3,) corner of the patch.
+        """
+        if self.corners is not None:
+            return self.corners[idx]
+        if isinstance(idx, slice):
+            positions = np.arange(*idx.indices(len(self)))
+        elif isinstance(idx, (int, np.integer)):
+            positions = idx  # no position array, so single items are O(1)
+        else:
+            positions = np.arange(len(self))[idx]
+        grid_idx = np.unravel_index(positions, [len(starts) for starts in self.grid])
+        return np.stack(
+            [starts[i] for starts, i in zip(self.grid, grid_idx)], axis=-1
+        ).astype("int32")
+
+    def subset(self, idx) -> "PatchIndex":
+        """Patches at positions `idx`, an int array, a boolean mask or a slice."""
+        if isinstance(idx, np.ndarray) and idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        return PatchIndex(
+            self.patch_shape, corners=self.corners_of(idx), n_channels=self.n_channels
+        )
+
+    def shard(self, n_shards: int, rank: int) -> "PatchIndex":
+        """The `rank`-th of `n_shards` contiguous, hence spatially compact, parts of the index."""
+        bounds = np.linspace(0, len(self), n_shards + 1).astype(int)
+        return self.subset(slice(bounds[rank], bounds[rank + 1]))
+
+    def axis_intervals(self) -> list[list[tuple[int, int]]]:
+        """Unique (start, stop) intervals of the patches along each axis, sorted."""
+        if self.grid is not None:
+            axis_starts = [np.unique(starts) for starts in self.grid]
+        else:
+            axis_starts = [np.unique(self.corners[:, axis]) for axis in range(3)]
+        return [
+            [(int(start), int(start) + size) for start in starts]
+            for starts, size in zip(axis_starts, self.patch_shape)
+        ]
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, (int, np.integer)):
+            return self.subset(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Patch {idx} out of range for {len(self)} patches")
+        corner = self.corners_of(idx)
+        slice_idx = tuple(
+            slice(int(start), int(start) + size)
+            for start, size in zip(corner, self.patch_shape)
+        )
+        if self.n_channels is not None:
+            slice_idx = (slice(0, self.n_channels),) + slice_idx
+        return slice_idx
 
 
 class SliceBuilder:
@@ -17,13 +142,16 @@ class SliceBuilder:
         stride_shape = tuple(stride_shape)
         self._check_patch_shape(patch_shape)
 
-        self._raw_slices = self._build_slices(raw_dataset, patch_shape, stride_shape)
+        self._raw_slices = PatchIndex.from_grid(
+            raw_dataset.shape, patch_shape, stride_shape
+        )
+        self._grid_slices = self._raw_slices
         if label_dataset is None:
             self._label_slices = None
         else:
             # take the first element in the label_dataset to build slices
-            self._label_slices = self._build_slices(
-                label_dataset, patch_shape, stride_shape
+            self._label_slices = PatchIndex.from_grid(
+                label_dataset.shape, patch_shape, stride_shape
             )
             assert len(self._raw_slices) == len(self._label_slices)
 
@@ -35,6 +163,11 @@ class SliceBuilder:
     def label_slices(self):
         return self._label_slices
 
+    @property
+    def grid_slices(self):
+        """All patches of the regular grid, including the ones filtered out of `raw_slices`."""
+        return self._grid_slices
+
     @staticmethod
     def _build_slices(dataset, patch_shape, stride_shape):
         """Iterates over a given n-dim dataset patch-by-patch with a given stride
@@ -122,3 +255,141 @@ class FilterSliceBuilder(SliceBuilder):
         raw_slices, label_slices = zip(*filtered_slices)
         self._raw_slices = list(raw_slices)
         self._label_slices = list(label_slices)
+
+
+def foreground_mask(
+    raw, downsampling: tuple[int, int, int] = (2, 8, 8), threshold: float | None = None
+) -> np.ndarray:
+    """Cheap foreground mask of a ZYX or CZYX volume on a grid subsampled by `downsampling`.
+
+    Only every `downsampling`-th voxel is read, so `raw` may be an on-disk `h5py.Dataset` or
+    `zarr.Array`. The subsampled volume is smoothed to suppress isolated noise voxels and each
+    channel is thresholded; a voxel is foreground if it is above the threshold in any channel.
+
+    Args:
+        raw: The volume, ZYX or CZYX, any array-like object supporting strided slicing.
+        downsampling (tuple[int, int, int]): Subsampling step along ZYX.
+        threshold (float | None): Intensity threshold in raw units. Defaults to None, i.e. Otsu's
+            threshold of each channel. Channels without contrast are considered foreground.
+
+    Returns:
+        np.ndarray: Boolean mask of the subsampled ZYX grid.
+    """
+    step = tuple(slice(None, None, s) for s in downsampling)
+    if raw.ndim == 4:
+        small = np.asarray(raw[(slice(None),) + step], dtype="float32")
+    else:
+        small = np.asarray(raw[step], dtype="float32")[None]
+
+    mask = np.zeros(small.shape[1:], dtype=bool)
+    for channel in small:
+        channel = uniform_filter(channel, size=3)
+        if threshold is not None:
+            mask |= channel > threshold
+        elif channel.min() == channel.max():
+            mask[...] = True
+        else:
+            mask |= channel > threshold_otsu(channel)
+    return mask
+
+
+def _count_in_boxes(
+    mask: np.ndarray, lower: np.ndarray, upper: np.ndarray
+) -> np.ndarray:
+    """Number of True voxels of a ZYX `mask` in each box `[lower, upper)`, boxes given as (N, 3) arrays."""
+    table = np.zeros(tuple(s + 1 for s in mask.shape), dtype="int64")
+    table[1:, 1:, 1:] = mask.cumsum(0).cumsum(1).cumsum(2)
+    count = np.zeros(len(lower), dtype="int64")
+    for corner in np.ndindex(2, 2, 2):
+        bounds = tuple(
+            np.where(c, upper[:, axis], lower[:, axis]) for axis, c in enumerate(corner)
+        )
+        sign = -1 if (3 - sum(corner)) % 2 else 1
+        count += sign * table[bounds]
+    return count
+
+
+class MaskSliceBuilder(SliceBuilder):
+    """
+    Skip patches which, including their halo, do not overlap a mask given on a coarser grid.
+
+    The mask comes from a cheap pre-pass, e.g. thresholded raw data (`ForegroundSliceBuilder`) or a
+    prediction of a downsampled copy of the volume.
+
+    Args:
+        raw_dataset (ndarray): raw data, ZYX or CZYX
+        label_dataset (ndarray): ground truth labels
+        patch_shape (tuple): the shape of the patch DxHxW
+        stride_shape (tuple): the shape of the stride DxHxW
+        mask (ndarray): boolean ZYX mask of the patches to keep, voxel `i` of the mask covers
+            voxels `[i * downsampling, (i + 1) * downsampling)` of `raw_dataset`
+        downsampling (tuple): size of a mask voxel in voxels of `raw_dataset` DxHxW, may be fractional
+        halo_shape (tuple): the halo read around each patch DxHxW
+    """
+
+    def __init__(
+        self,
+        raw_dataset,
+        label_dataset,
+        patch_shape,
+        stride_shape,
+        mask,
+        downsampling,
+        halo_shape=(0, 0, 0),
+    ):
+        super().__init__(raw_dataset, label_dataset, patch_shape, stride_shape)
+
+        # window of each patch and its halo on the mask grid, counted with a summed-volume table
+        corners = self._raw_slices.corners_of(slice(None)).astype("int64")
+        halo, step = np.array(halo_shape), np.array(downsampling)
+        lower = np.floor_divide(np.maximum(corners - halo, 0), step).astype("int64")
+        upper = np.ceil((corners + np.array(patch_shape) + halo) / step).astype("int64")
+        lower = np.minimum(lower, mask.shape)
+        upper = np.minimum(upper, mask.shape)
+        keep = _count_in_boxes(mask, lower, upper) > 0
+        self._raw_slices = self._raw_slices.subset(keep)
+        if self._label_slices is not None:
+            self._label_slices = self._label_slices.subset(keep)
+
+        logger.info(
+            f"Skipping {len(keep) - len(self._raw_slices)} of {len(keep)} background patches"
+        )
+
+
+class ForegroundSliceBuilder(MaskSliceBuilder):
+    """
+    Skip patches which, including their halo, contain no foreground in a cheap pre-pass mask.
+
+    The full grid stays available as `grid_slices`, so predictors can blend the remaining patches
+    exactly and fill the skipped regions with a background value (see `PatchAccumulator`).
+
+    Args:
+        raw_dataset (ndarray): raw data, ZYX or CZYX
+        label_dataset (ndarray): ground truth labels
+        patch_shape (tuple): the shape of the patch DxHxW
+        stride_shape (tuple): the shape of the stride DxHxW
+        halo_shape (tuple): the halo read around each patch DxHxW
+        downsampling (tuple): subsampling step of the foreground mask DxHxW
+        threshold (float): intensity threshold of the foreground, Otsu's threshold if None
+    """
+
+    def __init__(
+        self,
+        raw_dataset,
+        label_dataset,
+        patch_shape,
+        stride_shape,
+        halo_shape=(0, 0, 0),
+        downsampling=(2, 8, 8),
+        threshold=None,
+    ):
+        mask = foreground_mask(raw_dataset, downsampling, threshold)
+        super().__init__(
+            raw_dataset,
+            label_dataset,
+            patch_shape,
+            stride_shape,
+            mask,
+            downsampling,
+            halo_shape=halo_shape,
+        )
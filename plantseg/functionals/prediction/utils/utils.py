@@ -1,4 +1,7 @@
 import logging
+from typing import Literal
+
+import numpy as np
 
 from plantseg import PATH_PREDICT_TEMPLATE
 from plantseg.core.zoo import model_zoo
@@ -66,3 +69,57 @@ def get_patch_halo(model_name):
 def get_stride_shape(patch_shape, stride_ratio=0.75):
     # striding MUST be >=1
     return [max(int(p * stride_ratio), 1) for p in patch_shape]
+
+
+TilingPolicy = Literal["overlap", "auto"]
+TILING_POLICIES = ("overlap", "auto")
+
+# smallest patch accepted by `SliceBuilder`
+MIN_PATCH_SHAPE = (1, 64, 64)
+
+
+def halo_covers_receptive_field(
+    volume_shape: tuple[int, int, int],
+    patch_shape: tuple[int, int, int],
+    halo_shape: tuple[int, int, int],
+    model_halo: tuple[int, int, int],
+) -> bool:
+    """Whether the halo of every tiled axis is at least the halo of the model's receptive field.
+
+    Axes covered by a single patch are not tiled and need no halo.
+    """
+    return all(
+        p >= v or h >= m
+        for v, p, h, m in zip(volume_shape, patch_shape, halo_shape, model_halo)
+    )
+
+
+def find_exact_tiling_patch_shape(
+    volume_shape: tuple[int, int, int], max_patch_shape: tuple[int, int, int]
+) -> tuple[int, int, int]:
+    """Smallest patch shape tiling the volume without overlap in as few patches as `max_patch_shape`.
+
+    Along each axis, the volume is split into `ceil(volume / max_patch)` patches of (almost) equal size,
+    so the last patch is not shifted back over its neighbour and no voxel is predicted twice.
+    """
+    patch_shape = []
+    for size, max_size, min_size in zip(volume_shape, max_patch_shape, MIN_PATCH_SHAPE):
+        n_patches = -(-size // max_size)
+        patch_shape.append(max(-(-size // n_patches), min(min_size, max_size)))
+    return tuple(patch_shape)
+
+
+def count_input_voxels(
+    volume_shape: tuple[int, int, int],
+    patch_shape: tuple[int, int, int],
+    halo_shape: tuple[int, int, int],
+    stride_shape: tuple[int, int, int],
+) -> int:
+    """Number of voxels fed to the network, halos included, to predict the volume patch by patch."""
+    n_patches = 1
+    for size, patch, stride in zip(volume_shape, patch_shape, stride_shape):
+        if size > patch:
+            n_patches *= len(list(SliceBuilder._gen_indices(size, patch, stride)))
+    return n_patches * int(
+        np.prod([p + 2 * h for p, h in zip(patch_shape, halo_shape)])
+    )
@@ -1,20 +1,26 @@
 from plantseg.functionals.segmentation.segmentation import (
+    average_linkage_agglomeration,
     dt_watershed,
     gasp,
+    gasp_from_affinities,
     lifted_multicut_from_nuclei_pmaps,
     lifted_multicut_from_nuclei_segmentation,
     multicut,
     mutex_ws,
     simple_itk_watershed,
 )
+from plantseg.functionals.segmentation.sweep import segmentation_sweep
 
 # Use __all__ to let type checkers know what is part of the public API.
 __all__ = [
     "gasp",
+    "gasp_from_affinities",
     "multicut",
     "mutex_ws",
     "dt_watershed",
     "simple_itk_watershed",
     "lifted_multicut_from_nuclei_segmentation",
     "lifted_multicut_from_nuclei_pmaps",
+    "segmentation_sweep",
+    "average_linkage_agglomeration",
 ]
@@ -0,0 +1,175 @@
+"""Average-linkage agglomeration tree of superpixels.
+
+Average linkage merges the two adjacent clusters with the highest average affinity, and biasing all affinities by
+`beta` does not change this order, only where the agglomeration stops. The merges are therefore computed once,
+down to a single cluster per connected component, and the segmentation for any `beta` is obtained by applying the
+merges above `beta` through a label lookup table.
+
+The affinities are the inverted mean boundary probabilities of the region adjacency graph, weighted by the face
+sizes. This is not GASP, which averages the affinities of the pixel pairs across the faces, so the segmentation
+can differ from `gasp` with the 'average' linkage criteria.
+"""
+
+import heapq
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from elf.segmentation.features import compute_boundary_mean_and_length, compute_rag
+from elf.segmentation.watershed import apply_size_filter
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from plantseg.functionals.prediction.utils.prediction_cache import array_fingerprint
+
+logger = logging.getLogger(__name__)
+
+TREE_CACHE_SIZE = 2
+_tree_cache: OrderedDict[tuple[str, str], "AgglomerationTree"] = OrderedDict()
+
+
+def average_linkage_merges(
+    uv_ids: np.ndarray, affinities: np.ndarray, edge_sizes: np.ndarray, n_nodes: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Merge order of the average-linkage agglomeration of a graph.
+
+    Args:
+        uv_ids (np.ndarray): (E, 2) array of the edges of the graph.
+        affinities (np.ndarray): Affinity of each edge, high for nodes that belong together.
+        edge_sizes (np.ndarray): Size of each edge, weighting its affinity in the averages.
+        n_nodes (int): Number of nodes of the graph.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The (M, 2) merged nodes, each cluster being represented by one of its
+            nodes, and the average affinity of each merge, non-increasing.
+    """
+    # adjacency[u][v] = (sum of the size-weighted affinities, sum of the sizes) of the edges between u and v
+    adjacency: list[dict[int, tuple[float, float]]] = [{} for _ in range(n_nodes)]
+    for (u, v), affinity, size in zip(
+        uv_ids.tolist(), affinities.tolist(), edge_sizes.tolist()
+    ):
+        weight, total = adjacency[u].get(v, (0.0, 0.0))
+        adjacency[u][v] = adjacency[v][u] = (weight + affinity * size, total + size)
+
+    heap = [
+        (-weight / total, u, v)
+        for u in range(n_nodes)
+        for v, (weight, total) in adjacency[u].items()
+        if u < v
+    ]
+    heapq.heapify(heap)
+
+    merges, heights = [], []
+    while heap:
+        neg_height, u, v = heapq.heappop(heap)
+        if v not in adjacency[u]:
+            continue  # one of the clusters was merged meanwhile
+        weight, total = adjacency[u][v]
+        if weight / total != -neg_height:
+            continue  # outdated average
+        if len(adjacency[u]) < len(adjacency[v]):
+            u, v = v, u
+        merges.append((u, v))
+        heights.append(-neg_height)
+
+        # merge the edges of v into those of u
+        del adjacency[u][v], adjacency[v][u]
+        for x, (weight_x, total_x) in adjacency[v].items():
+            del adjacency[x][v]
+            weight, total = adjacency[u].get(x, (0.0, 0.0))
+            adjacency[u][x] = adjacency[x][u] = (weight + weight_x, total + total_x)
+            heapq.heappush(
+                heap, (-(weight + weight_x) / (total + total_x), min(u, x), max(u, x))
+            )
+        adjacency[v] = {}
+
+    merges = np.array(merges, dtype="int64").reshape(-1, 2)
+    # averages of averages cannot exceed the merged one, up to rounding
+    heights = np.minimum.accumulate(np.array(heights, dtype="float64"))
+    return merges, heights
+
+
+class AgglomerationTree:
+    """Precomputed average-linkage agglomeration of superpixels, cut at any `beta` without re-running it.
+
+    Args:
+        superpixels (np.ndarray): Superpixel segmentation, its ids being the node ids.
+        merges (np.ndarray): (M, 2) merged nodes, in merge order.
+        heights (np.ndarray): Non-increasing average affinity of each merge.
+        boundary_pmaps (np.ndarray | None, optional): Boundary prediction used by the size filter of `cut`.
+            Defaults to None.
+
+    Attributes:
+        n_nodes (int): Number of nodes of the graph.
+    """
+
+    def __init__(
+        self,
+        superpixels: np.ndarray,
+        merges: np.ndarray,
+        heights: np.ndarray,
+        boundary_pmaps: np.ndarray | None = None,
+    ):
+        self.superpixels = superpixels
+        self.merges = merges
+        self.heights = heights
+        self.boundary_pmaps = boundary_pmaps
+        self.n_nodes = int(superpixels.max()) + 1
+
+    @classmethod
+    def from_boundaries(
+        cls, boundary_pmaps: np.ndarray, superpixels: np.ndarray
+    ) -> "AgglomerationTree":
+        """Agglomerate `superpixels` by the average inverted boundary probability along their faces."""
+        if boundary_pmaps.shape != superpixels.shape:
+            raise ValueError(
+                "The boundary probability map and the superpixels should have the same shape."
+            )
+        boundary_pmaps = boundary_pmaps.astype("float32", copy=False)
+        rag = compute_rag(superpixels)
+        features = compute_boundary_mean_and_length(rag, boundary_pmaps)
+        merges, heights = average_linkage_merges(
+            rag.uvIds(), 1.0 - features[:, 0], features[:, 1], rag.numberOfNodes
+        )
+        logger.info(
+            f"Agglomeration tree of {rag.numberOfNodes} superpixels with {len(merges)} merges."
+        )
+        return cls(superpixels, merges, heights, boundary_pmaps=boundary_pmaps)
+
+    def node_labels(self, beta: float) -> np.ndarray:
+        """Label of each node after the merges with an average affinity above `beta`, from 1."""
+        n_merges = np.searchsorted(-self.heights, -beta, side="left")
+        merged = self.merges[:n_merges]
+        adjacency = coo_matrix(
+            (np.ones(len(merged), dtype=bool), (merged[:, 0], merged[:, 1])),
+            shape=(self.n_nodes, self.n_nodes),
+        )
+        _, labels = connected_components(adjacency, directed=False)
+        return labels.astype("uint64") + 1
+
+    def cut(self, beta: float, post_minsize: int = 0) -> np.ndarray:
+        """Segmentation at `beta`, with the segments smaller than `post_minsize` merged into their neighbours."""
+        segmentation = self.node_labels(beta)[self.superpixels]
+        if post_minsize > 0:
+            if self.boundary_pmaps is None:
+                raise ValueError("The size filter requires the boundary prediction.")
+            segmentation, _ = apply_size_filter(
+                segmentation.astype("uint32"), self.boundary_pmaps, post_minsize
+            )
+        return segmentation
+
+
+def cached_agglomeration_tree(
+    boundary_pmaps: np.ndarray, superpixels: np.ndarray
+) -> AgglomerationTree:
+    """Agglomeration tree of `superpixels`, reused across calls with the same data."""
+    key = (array_fingerprint(boundary_pmaps), array_fingerprint(superpixels))
+    if key in _tree_cache:
+        _tree_cache.move_to_end(key)
+        return _tree_cache[key]
+
+    tree = AgglomerationTree.from_boundaries(boundary_pmaps, superpixels)
+    _tree_cache[key] = tree
+    while len(_tree_cache) > TREE_CACHE_SIZE:
+        _tree_cache.popitem(last=False)
+    return tree
@@ -0,0 +1,387 @@
+"""Blockwise segmentation of volumes larger than the available memory.
+
+The volume is split into blocks, each segmented together with a halo of context by a worker process.
+Only the inner region of each block is written to the output, with labels offset to be globally unique.
+Objects crossing a block face are then stitched by overlap matching: the labels a block assigned to its
+halo beyond the face are compared with the labels written there by the neighbouring block, and a label
+is merged with the neighbour label covering the largest part of it if that part exceeds a threshold. Blocks
+are written in grid order, so the neighbours below each face of a block are written before it and its seams
+are matched right away: only the label pairs to merge are kept in memory.
+
+Inputs and outputs are only sliced, so Zarr arrays and HDF5 datasets can be used directly.
+
+Multicut problems over many superpixels are reduced hierarchically instead: the sub-problem of each block of
+the superpixel volume is solved in parallel, edges no sub-problem cuts are contracted, and the reduced
+problem is handled the same way with blocks of twice the shape, up to a number of levels, before the
+remaining global problem is solved.
+"""
+
+import itertools
+import logging
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterator
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+logger = logging.getLogger(__name__)
+
+BlockSegmenter = Callable[[np.ndarray, np.ndarray | None], np.ndarray]
+MulticutSolver = Callable[[np.ndarray, int, np.ndarray, float | None], np.ndarray]
+
+
+def iter_blocks(
+    shape: tuple[int, ...], block_shape: tuple[int, ...], halo: tuple[int, ...]
+) -> Iterator[tuple[tuple[slice, ...], tuple[slice, ...]]]:
+    """Iterate over the (inner, outer) slices of the blocks tiling `shape`.
+
+    The inner slices tile the volume without overlap, the outer slices extend them by `halo`, clipped to the volume.
+    """
+    grid = [range(0, s, b) for s, b in zip(shape, block_shape)]
+    for corner in itertools.product(*grid):
+        inner = tuple(
+            slice(c, min(c + b, s)) for c, b, s in zip(corner, block_shape, shape)
+        )
+        outer = tuple(
+            slice(max(sl.start - h, 0), min(sl.stop + h, s))
+            for sl, h, s in zip(inner, halo, shape)
+        )
+        yield inner, outer
+
+
+def _lower_seams(
+    inner: tuple[slice, ...], outer: tuple[slice, ...]
+) -> list[tuple[slice, ...]]:
+    """Slabs of the halo of a block beyond each of its lower faces, in global coordinates."""
+    seams = []
+    for axis, (sl_in, sl_out) in enumerate(zip(inner, outer)):
+        if sl_out.start < sl_in.start:
+            seam = list(inner)
+            seam[axis] = slice(sl_out.start, sl_in.start)
+            seams.append(tuple(seam))
+    return seams
+
+
+def _local(region: tuple[slice, ...], outer: tuple[slice, ...]) -> tuple[slice, ...]:
+    return tuple(
+        slice(r.start - o.start, r.stop - o.start) for r, o in zip(region, outer)
+    )
+
+
+def _match_overlaps(
+    labels: np.ndarray, neighbour_labels: np.ndarray, overlap_threshold: float
+) -> np.ndarray:
+    """Pairs (label, neighbour label) where the neighbour label covers most of the label.
+
+    Returns:
+        np.ndarray: (N, 2) array of the labels to merge.
+    """
+    labels, neighbour_labels = labels.ravel(), neighbour_labels.ravel()
+    foreground = labels != 0
+    if not foreground.any():
+        return np.zeros((0, 2), dtype="uint64")
+
+    pairs, counts = np.unique(
+        np.stack([labels[foreground], neighbour_labels[foreground]], axis=1),
+        axis=0,
+        return_counts=True,
+    )
+    ids, first = np.unique(pairs[:, 0], return_index=True)
+    sizes = np.add.reduceat(counts, first)
+
+    # the neighbour label with the largest overlap of each label, ignoring background
+    overlaps = np.where(pairs[:, 1] != 0, counts, 0)
+    order = np.lexsort((overlaps, pairs[:, 0]))
+    last = np.r_[first[1:], len(pairs)] - 1
+    best = order[last]
+    matched = (pairs[best, 1] != 0) & (overlaps[best] >= overlap_threshold * sizes)
+    return np.stack([ids[matched], pairs[best[matched], 1]], axis=1)
+
+
+def _merge_labels(n_labels: int, merges: np.ndarray) -> np.ndarray:
+    """Union-find over the labels 0..n_labels, returning a consecutive relabeling keeping 0 as background."""
+    parents = np.arange(n_labels + 1, dtype="uint64")
+
+    def find(label):
+        root = label
+        while parents[root] != root:
+            root = parents[root]
+        while parents[label] != root:
+            parents[label], label = root, parents[label]
+        return root
+
+    for a, b in merges:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parents[max(root_a, root_b)] = min(root_a, root_b)
+
+    while True:
+        grand_parents = parents[parents]
+        if np.array_equal(grand_parents, parents):
+            break
+        parents = grand_parents
+    _, mapping = np.unique(parents, return_inverse=True)
+    return mapping.astype("uint64")
+
+
+def blockwise_segmentation(
+    data,
+    segment_block: BlockSegmenter,
+    block_shape: tuple[int, ...],
+    halo: tuple[int, ...],
+    mask=None,
+    n_workers: int = 1,
+    out=None,
+    overlap_threshold: float = 0.5,
+):
+    """Segment `data` block by block and stitch the block segmentations into consistent global labels.
+
+    Args:
+        data (array-like): Input volume, e.g. a boundary probability map. Any array supporting slicing, such as a
+            Zarr array or an HDF5 dataset.
+        segment_block (BlockSegmenter): Picklable function segmenting a halo-padded block, called with the block of
+            `data` and of `mask` (or None). Label 0 is background.
+        block_shape (tuple[int, ...]): Shape of the blocks, without halo.
+        halo (tuple[int, ...]): Context added on each side of the blocks. It also sets the depth of the seams where
+            labels are matched, so it should be a fair part of the object size.
+        mask (array-like, optional): Mask passed to `segment_block`, same shape as `data`. Defaults to None.
+        n_workers (int, optional): Number of processes segmenting blocks. With 1, blocks are segmented in the
+            calling process. Defaults to 1.
+        out (array-like, optional): Integer array the segmentation is written to, e.g. a Zarr array or an HDF5
+            dataset. If None, a uint64 numpy array is allocated. Defaults to None.
+        overlap_threshold (float, optional): Fraction of a label in the seam a neighbour label must cover for the
+            two to be merged. Defaults to 0.5.
+
+    Returns:
+        array-like: `out`, labelled consecutively from 1 with 0 as background.
+    """
+    shape = tuple(data.shape)
+    if len(block_shape) != len(shape) or len(halo) != len(shape):
+        raise ValueError(
+            f"Block shape {block_shape} and halo {halo} must have one entry per axis of the data {shape}."
+        )
+    if mask is not None and tuple(mask.shape) != shape:
+        raise ValueError(
+            f"Mask shape {mask.shape} does not match the data shape {shape}."
+        )
+    if out is None:
+        out = np.zeros(shape, dtype="uint64")
+    elif tuple(out.shape) != shape:
+        raise ValueError(
+            f"Output shape {out.shape} does not match the data shape {shape}."
+        )
+
+    blocks = list(iter_blocks(shape, block_shape, halo))
+    logger.info(
+        f"Segmenting {len(blocks)} blocks of shape {block_shape} with {n_workers} workers."
+    )
+
+    n_labels, n_seams = 0, 0
+    merges = []
+
+    def write_block(inner, outer, segmentation):
+        nonlocal n_labels, n_seams
+        local_ids = np.unique(segmentation[_local(inner, outer)])
+        local_ids = local_ids[local_ids != 0]
+        global_ids = np.zeros(len(local_ids) + 1, dtype="uint64")
+        global_ids[1:] = np.arange(n_labels + 1, n_labels + len(local_ids) + 1)
+        n_labels += len(local_ids)
+
+        def relabel(labels):
+            if len(local_ids) == 0:
+                return np.zeros(labels.shape, dtype="uint64")
+            index = np.minimum(np.searchsorted(local_ids, labels), len(local_ids) - 1)
+            return np.where(local_ids[index] == labels, global_ids[index + 1], 0)
+
+        out[inner] = relabel(segmentation[_local(inner, outer)])
+        # labels the block assigned beyond its lower faces, matched with the neighbours already written there
+        for seam in _lower_seams(inner, outer):
+            labels = relabel(segmentation[_local(seam, outer)])
+            merges.append(_match_overlaps(labels, out[seam], overlap_threshold))
+            n_seams += 1
+
+    def read_block(outer):
+        return data[outer], None if mask is None else mask[outer]
+
+    if n_workers <= 1:
+        for inner, outer in blocks:
+            write_block(inner, outer, segment_block(*read_block(outer)))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # bound the number of blocks held in memory
+            pending: list[tuple[tuple[slice, ...], tuple[slice, ...], Future]] = []
+            for inner, outer in blocks:
+                pending.append(
+                    (inner, outer, executor.submit(segment_block, *read_block(outer)))
+                )
+                if len(pending) >= 2 * n_workers:
+                    inner_done, outer_done, future = pending.pop(0)
+                    write_block(inner_done, outer_done, future.result())
+            for inner_done, outer_done, future in pending:
+                write_block(inner_done, outer_done, future.result())
+
+    merges = np.concatenate(merges) if merges else np.zeros((0, 2), dtype="uint64")
+    logger.info(f"Stitching {n_labels} block labels across {n_seams} seams.")
+    mapping = _merge_labels(n_labels, merges)
+
+    for inner, _ in blocks:
+        out[inner] = mapping[out[inner]]
+    return out
+
+
+def _contract_edges(
+    uv_ids: np.ndarray, costs: np.ndarray, n_nodes: int, merge_edges: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Merge the nodes connected by `merge_edges`, summing the costs of the edges between merged nodes.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The new label of each node, the edges of the reduced graph and
+            their costs.
+    """
+    merged = uv_ids[merge_edges]
+    adjacency = coo_matrix(
+        (np.ones(len(merged), dtype=bool), (merged[:, 0], merged[:, 1])),
+        shape=(n_nodes, n_nodes),
+    )
+    _, node_labels = connected_components(adjacency, directed=False)
+
+    new_uv_ids = np.sort(node_labels[uv_ids], axis=1)
+    keep = new_uv_ids[:, 0] != new_uv_ids[:, 1]
+    new_uv_ids, inverse = np.unique(new_uv_ids[keep], axis=0, return_inverse=True)
+    new_costs = np.bincount(
+        inverse.ravel(), weights=costs[keep], minlength=len(new_uv_ids)
+    )
+    return node_labels, new_uv_ids, new_costs
+
+
+def _solve_subproblem(
+    uv_ids: np.ndarray,
+    costs: np.ndarray,
+    solver: MulticutSolver,
+    remaining_time: Callable[[], float | None],
+    edge_ids: np.ndarray,
+) -> np.ndarray:
+    """Solve the multicut of the sub-graph spanned by the edges `edge_ids` of `uv_ids`.
+
+    Returns:
+        np.ndarray: Whether each of the edges `edge_ids` is cut.
+    """
+    nodes, local_uv_ids = np.unique(uv_ids[edge_ids], return_inverse=True)
+    local_uv_ids = local_uv_ids.reshape(-1, 2)
+    node_labels = solver(local_uv_ids, len(nodes), costs[edge_ids], remaining_time())
+    return node_labels[local_uv_ids[:, 0]] != node_labels[local_uv_ids[:, 1]]
+
+
+def _block_edges(uv_ids: np.ndarray, node_blocks: np.ndarray) -> list[np.ndarray]:
+    """Ids of the edges between nodes of the same block, grouped by block."""
+    edge_blocks = node_blocks[uv_ids]
+    edge_ids = np.flatnonzero(edge_blocks[:, 0] == edge_blocks[:, 1])
+    edge_ids = edge_ids[np.argsort(edge_blocks[edge_ids, 0], kind="stable")]
+    splits = np.flatnonzero(np.diff(edge_blocks[edge_ids, 0])) + 1
+    return np.split(edge_ids, splits) if len(edge_ids) else []
+
+
+def blockwise_multicut(
+    uv_ids: np.ndarray,
+    costs: np.ndarray,
+    superpixels: np.ndarray,
+    solver: MulticutSolver,
+    block_shape: tuple[int, ...],
+    n_levels: int = 1,
+    time_limit: float | None = None,
+    n_threads: int = 1,
+) -> np.ndarray:
+    """Hierarchical blockwise multicut.
+
+    Each superpixel is assigned to the first block of the grid it appears in. At each level, the sub-problem of
+    the edges between superpixels of the same block is solved in parallel for every block, the edges it does not
+    cut are contracted, and the next level works on the reduced graph with blocks of twice the shape. The last
+    reduced problem is solved globally. The graph is given for the whole volume, only its solve is split.
+
+    Args:
+        uv_ids (np.ndarray): (E, 2) array of the edges of the region adjacency graph, by superpixel id.
+        costs (np.ndarray): Multicut cost of each edge, positive for attractive edges.
+        superpixels (np.ndarray): Superpixel segmentation the graph was built from, its ids being the node ids.
+        solver (MulticutSolver): Function solving a multicut problem, called with the edges, the number of nodes,
+            the costs and a time limit in seconds (or None) and returning a label per node.
+        block_shape (tuple[int, ...]): Shape of the blocks of the first level.
+        n_levels (int, optional): Number of levels of block sub-problems before the global problem. 0 solves
+            the global problem directly. Defaults to 1.
+        time_limit (float | None, optional): Time budget in seconds. Levels not started within the budget are
+            skipped, and the solvers only get the remaining time. Defaults to None, i.e. no limit.
+        n_threads (int, optional): Number of threads solving sub-problems. Defaults to 1.
+
+    Returns:
+        np.ndarray: Label of each node.
+    """
+    if len(block_shape) != superpixels.ndim:
+        raise ValueError(
+            f"Block shape {block_shape} must have one entry per axis of the superpixels {superpixels.shape}."
+        )
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+
+    def remaining_time():
+        return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+    n_nodes = int(superpixels.max()) + 1
+    uv_ids = np.asarray(uv_ids, dtype="int64")
+    costs = np.asarray(costs, dtype="float64")
+    node_labels = np.arange(n_nodes)
+
+    # position in the grid of the blocks of the first level of each node
+    node_positions = np.full((n_nodes, superpixels.ndim), -1, dtype="int64")
+    for inner, _ in iter_blocks(
+        superpixels.shape, block_shape, (0,) * superpixels.ndim
+    ):
+        nodes = np.unique(superpixels[inner])
+        nodes = nodes[node_positions[nodes, 0] < 0]
+        node_positions[nodes] = [sl.start // b for sl, b in zip(inner, block_shape)]
+
+    for level in range(n_levels):
+        if remaining_time() == 0.0:
+            logger.warning(
+                f"Time limit reached, skipping multicut levels {level} to {n_levels - 1}."
+            )
+            break
+        # nodes contracted at the previous levels lie in the same block of this level
+        level_positions = np.zeros(
+            (int(node_labels.max()) + 1, superpixels.ndim), dtype="int64"
+        )
+        level_positions[node_labels] = node_positions // 2**level
+        _, node_blocks = np.unique(level_positions, axis=0, return_inverse=True)
+        block_edges = _block_edges(uv_ids, node_blocks.ravel())
+
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            cuts = list(
+                executor.map(
+                    partial(_solve_subproblem, uv_ids, costs, solver, remaining_time),
+                    block_edges,
+                )
+            )
+
+        merge_edges = np.zeros(len(uv_ids), dtype=bool)
+        for edge_ids, cut in zip(block_edges, cuts):
+            merge_edges[edge_ids[~cut]] = True
+        new_labels, uv_ids, costs = _contract_edges(
+            uv_ids, costs, int(node_labels.max()) + 1, merge_edges
+        )
+        node_labels = new_labels[node_labels]
+        logger.info(
+            f"Multicut level {level}: {len(block_edges)} blocks, reduced to {new_labels.max() + 1} nodes "
+            f"and {len(uv_ids)} edges."
+        )
+        if len(uv_ids) == 0:
+            return node_labels
+
+    if len(uv_ids) == 0:
+        return node_labels
+    if remaining_time() == 0.0:
+        logger.warning(
+            "Time limit reached, returning the contracted problem without solving it globally."
+        )
+        return node_labels
+    global_labels = solver(uv_ids, int(node_labels.max()) + 1, costs, remaining_time())
+    return np.asarray(global_labels)[node_labels]
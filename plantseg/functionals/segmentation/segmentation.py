@@ -1,3 +1,4 @@
+from functools import partial
 from typing import Optional
 
 import nifty
@@ -17,7 +18,17 @@ from elf.segmentation.multicut import multicut_kernighan_lin
 from elf.segmentation.watershed import apply_size_filter, distance_transform_watershed
 from vigra.filters import gaussianSmoothing
 
-from plantseg.functionals.segmentation.utils import compute_mc_costs, shift_affinities
+from plantseg.functionals.segmentation.agglomeration_tree import (
+    cached_agglomeration_tree,
+)
+from plantseg.functionals.segmentation.blockwise import (
+    blockwise_multicut,
+    blockwise_segmentation,
+)
+from plantseg.functionals.segmentation.utils import (
+    affinities_from_boundaries,
+    compute_mc_costs,
+)
 
 try:
     import SimpleITK as sitk  # type: ignore[import]
@@ -26,6 +37,8 @@ try:
 except ImportError:
     SIMPLE_ITK_INSTALLED = False
 
+GASP_OFFSETS = [[0, 0, 1], [0, 1, 0], [1, 0, 0]]
+
 
 def dt_watershed(
     boundary_pmaps: np.ndarray,
@@ -39,6 +52,10 @@ def dt_watershed(
     apply_nonmax_suppression: bool = False,
     n_threads: Optional[int] = None,
     mask: Optional[np.ndarray] = None,
+    block_shape: Optional[tuple[int, ...]] = None,
+    block_halo: Optional[tuple[int, ...]] = None,
+    n_workers: int = 1,
+    out=None,
 ) -> np.ndarray:
     """Performs watershed segmentation using distance transforms on boundary probability maps.
 
@@ -81,11 +98,47 @@ def dt_watershed(
         mask (Optional[np.ndarray], optional): A binary mask that excludes certain regions from
             segmentation. Only regions within the mask will be considered. If None, all regions
             are included. Must have the same shape as 'boundary_pmaps'. Defaults to None.
+        block_shape (Optional[tuple[int, ...]], optional): If given, segment the volume in blocks of this
+            shape, one per worker process, and stitch the labels across the block faces by overlap
+            matching. The inputs and `out` may then be Zarr arrays or HDF5 datasets larger than the
+            memory. Defaults to None, i.e. the whole volume at once.
+        block_halo (Optional[tuple[int, ...]], optional): Context added on each side of the blocks.
+            Defaults to None, i.e. 16 pixels along each axis (0 along z if 'stacked').
+        n_workers (int, optional): Number of processes segmenting blocks. Defaults to 1.
+        out (array-like, optional): Integer array the blockwise segmentation is written to, e.g. a Zarr
+            array. Defaults to None, i.e. a new uint64 array.
 
     Returns:
         np.ndarray: A labeled segmentation map where each region is assigned a unique label.
 
     """
+    if block_shape is not None:
+        if block_halo is None:
+            block_halo = (16,) * boundary_pmaps.ndim
+            if stacked and boundary_pmaps.ndim == 3:
+                block_halo = (0, 16, 16)
+        segment_block = partial(
+            _dt_watershed_block,
+            threshold=threshold,
+            sigma_seeds=sigma_seeds,
+            stacked=stacked,
+            sigma_weights=sigma_weights,
+            min_size=min_size,
+            alpha=alpha,
+            pixel_pitch=pixel_pitch,
+            apply_nonmax_suppression=apply_nonmax_suppression,
+            n_threads=n_threads,
+        )
+        return blockwise_segmentation(
+            boundary_pmaps,
+            segment_block,
+            block_shape=block_shape,
+            halo=block_halo,
+            mask=mask,
+            n_workers=n_workers,
+            out=out,
+        )
+
     # Prepare the keyword arguments for the watershed function
     boundary_pmaps = boundary_pmaps.astype("float32")
     ws_kwargs = {
@@ -113,6 +166,13 @@ def dt_watershed(
     return segmentation
 
 
+def _dt_watershed_block(
+    boundary_pmaps: np.ndarray, mask: Optional[np.ndarray], **kwargs
+) -> np.ndarray:
+    # module level, so blocks can be sent to worker processes
+    return dt_watershed(boundary_pmaps, mask=mask, **kwargs)
+
+
 def gasp(
     boundary_pmaps: np.ndarray,
     superpixels: Optional[np.ndarray] = None,
@@ -145,6 +205,78 @@ def gasp(
             boundary_pmaps = boundary_pmaps[None, ...]
             remove_singleton = True
 
+    # Interpret boundary_pmaps as affinities and prepare for GASP
+    boundary_pmaps = boundary_pmaps.astype("float32", copy=False)
+
+    # Shifted to correct aligned affinities and inverted, in a single allocation
+    affinities = affinities_from_boundaries(boundary_pmaps, offsets=GASP_OFFSETS)
+    segmentation = gasp_from_affinities(
+        affinities, superpixels, gasp_linkage_criteria, beta, n_threads
+    )
+
+    # Apply size filtering if specified
+    if post_minsize > 0:
+        segmentation, _ = apply_size_filter(
+            segmentation.astype("uint32"), boundary_pmaps, post_minsize
+        )
+
+    if remove_singleton:
+        segmentation = segmentation[0]
+
+    return segmentation
+
+
+def average_linkage_agglomeration(
+    boundary_pmaps: np.ndarray,
+    superpixels: np.ndarray,
+    beta: float = 0.5,
+    post_minsize: int = 100,
+) -> np.ndarray:
+    """
+    Average-linkage agglomeration of superpixels by their mean boundary probability, cut at `beta`.
+
+    This is not GASP: the superpixels are merged by the mean boundary probability along their faces in the region
+    adjacency graph, while GASP averages the affinities of the pixel pairs across the faces, so the result can differ
+    from `gasp` with the 'average' linkage criteria. In exchange, the full merge tree is computed once and cached,
+    and later calls with the same data and any `beta` only cut it.
+
+    Args:
+        boundary_pmaps (np.ndarray): cell boundary prediction, 3D array of shape (Z, Y, X) or 2D array of shape
+            (Y, X) with values between 0 and 1.
+        superpixels (np.ndarray): superpixel segmentation. Must have the same shape as boundary_pmaps.
+        beta (float): the superpixels are merged while the average inverted boundary probability between them is
+            above `beta`. A small value will steer the segmentation towards under-segmentation. (default: 0.5)
+        post_minsize (int): minimal size of the segments after the agglomeration. (default: 100)
+
+    Returns:
+        segmentation (np.ndarray): agglomeration output segmentation
+    """
+    tree = cached_agglomeration_tree(boundary_pmaps, superpixels)
+    return tree.cut(beta, post_minsize=post_minsize)
+
+
+def gasp_from_affinities(
+    affinities: np.ndarray,
+    superpixels: Optional[np.ndarray] = None,
+    gasp_linkage_criteria: str = "average",
+    beta: float = 0.5,
+    n_threads: int = 6,
+) -> np.ndarray:
+    """
+    GASP segmentation from affinities, without size filter.
+
+    Args:
+        affinities (np.ndarray): affinities of the `GASP_OFFSETS`, 4D array of shape (3, Z, Y, X), e.g. from
+            `affinities_from_boundaries`. Computing them once allows to run GASP with several parameters.
+        superpixels (Optional[np.ndarray]): superpixel segmentation. If None, GASP will be run from the pixels.
+            (default: None)
+        gasp_linkage_criteria (str): Linkage criteria for GASP. (default: 'average')
+        beta (float): beta parameter for GASP, see `gasp`. (default: 0.5)
+        n_threads (int): number of threads used for GASP. (default: 6)
+
+    Returns:
+        segmentation (np.ndarray): GASP output segmentation
+    """
     # Prepare the arguments for running GASP
     run_GASP_kwargs = {
         "linkage_criteria": gasp_linkage_criteria,
@@ -152,20 +284,9 @@ def gasp(
         "use_efficient_implementations": False,
     }
 
-    # Interpret boundary_pmaps as affinities and prepare for GASP
-    boundary_pmaps = boundary_pmaps.astype("float32")
-    affinities = np.stack([boundary_pmaps] * 3, axis=0)
-
-    offsets = [[0, 0, 1], [0, 1, 0], [1, 0, 0]]
-    # Shift is required to correct aligned affinities
-    affinities = shift_affinities(affinities, offsets=offsets)
-
-    # invert affinities
-    affinities = 1 - affinities
-
     # Initialize and run GASP
     gasp_instance = GaspFromAffinities(
-        offsets,
+        GASP_OFFSETS,
         superpixel_generator=None
         if superpixels is None
         else (lambda *args, **kwargs: superpixels),
@@ -174,16 +295,6 @@ def gasp(
         beta_bias=beta,
     )
     segmentation, _ = gasp_instance(affinities)
-
-    # Apply size filtering if specified
-    if post_minsize > 0:
-        segmentation, _ = apply_size_filter(
-            segmentation.astype("uint32"), boundary_pmaps, post_minsize
-        )
-
-    if remove_singleton:
-        segmentation = segmentation[0]
-
     return segmentation
 
 
@@ -225,6 +336,10 @@ def multicut(
     superpixels: np.ndarray,
     beta: float = 0.5,
     post_minsize: int = 50,
+    block_shape: Optional[tuple[int, ...]] = None,
+    n_levels: int = 1,
+    time_limit: Optional[float] = None,
+    n_threads: int = 6,
 ) -> np.ndarray:
     """
     Multicut segmentation from boundary prediction.
@@ -235,6 +350,14 @@ def multicut(
         beta (float): beta parameter for the Multicut. A small value will steer the segmentation towards
             under-segmentation. While a high-value bias the segmentation towards the over-segmentation. (default: 0.5)
         post_minsize (int): minimal size of the segments after Multicut. (default: 100)
+        block_shape (Optional[tuple[int, ...]]): if given, solve the sub-problems of blocks of this shape in
+            parallel and contract the edges they merge before solving the reduced problem, instead of solving
+            the global problem at once. The region adjacency graph and its costs are still computed for the whole
+            volume. (default: None)
+        n_levels (int): number of block levels of the hierarchical solver, the blocks doubling in shape at each
+            level. (default: 1)
+        time_limit (Optional[float]): time budget of the solver in seconds. (default: None)
+        n_threads (int): number of threads solving block sub-problems. (default: 6)
 
     Returns:
         segmentation (np.ndarray): Multicut output segmentation
@@ -246,12 +369,20 @@ def multicut(
     boundary_pmaps = boundary_pmaps.astype("float32")
     costs = compute_mc_costs(boundary_pmaps, rag, beta=beta)
 
-    # Creating graph
-    graph = nifty.graph.undirectedGraph(rag.numberOfNodes)
-    graph.insertEdges(rag.uvIds())
-
     # Solving Multicut
-    node_labels = multicut_kernighan_lin(graph, costs)
+    if block_shape is None:
+        node_labels = _kernighan_lin(rag.uvIds(), rag.numberOfNodes, costs, time_limit)
+    else:
+        node_labels = blockwise_multicut(
+            rag.uvIds(),
+            costs,
+            superpixels,
+            solver=_kernighan_lin,
+            block_shape=block_shape,
+            n_levels=n_levels,
+            time_limit=time_limit,
+            n_threads=n_threads,
+        )
     segmentation = nifty.tools.take(node_labels, superpixels)
 
     # run size threshold
@@ -262,6 +393,14 @@ def multicut(
     return segmentation
 
 
+def _kernighan_lin(
+    uv_ids: np.ndarray, n_nodes: int, costs: np.ndarray, time_limit: Optional[float]
+) -> np.ndarray:
+    graph = nifty.graph.undirectedGraph(n_nodes)
+    graph.insertEdges(uv_ids)
+    return multicut_kernighan_lin(graph, costs, time_limit=time_limit)
+
+
 def lifted_multicut_from_nuclei_pmaps(
     boundary_pmaps: np.ndarray,
     nuclei_pmaps: np.ndarray,
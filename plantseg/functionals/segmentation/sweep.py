@@ -0,0 +1,200 @@
+"""Parameter sweeps of the superpixel-based segmentations.
+
+The region adjacency graph of the superpixels and its boundary features are computed once, the GASP
+affinities as well, and each configuration of the sweep is solved from them. Multicut configurations are
+ordered by beta and split into chains solved in parallel, each solution warm-starting the solver of the
+next, nearest beta. `post_minsize` only filters a solution, so configurations differing only by it share
+their solve.
+"""
+
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Sequence
+
+import nifty
+import numpy as np
+from elf.segmentation.features import compute_boundary_mean_and_length, compute_rag
+from elf.segmentation.watershed import apply_size_filter
+
+from plantseg.functionals.segmentation.segmentation import (
+    GASP_OFFSETS,
+    gasp_from_affinities,
+)
+from plantseg.functionals.segmentation.utils import (
+    affinities_from_boundaries,
+    costs_from_features,
+)
+
+logger = logging.getLogger(__name__)
+
+SWEEP_MODES = ("multicut", "gasp", "mutex_ws")
+
+
+def warm_start_chains(betas: Sequence[float], n_chains: int) -> list[list[float]]:
+    """Split the sorted `betas` into at most `n_chains` contiguous chains of similar length."""
+    ordered = sorted(betas)
+    n_chains = max(1, min(n_chains, len(ordered)))
+    bounds = np.linspace(0, len(ordered), n_chains + 1).astype(int)
+    return [ordered[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _kernighan_lin_warm_start(
+    graph, costs: np.ndarray, node_labels: np.ndarray | None
+) -> np.ndarray:
+    objective = nifty.graph.opt.multicut.multicutObjective(graph, costs)
+    solver = objective.kernighanLinFactory(warmStartGreedy=node_labels is None).create(
+        objective
+    )
+    if node_labels is None:
+        return solver.optimize()
+    return solver.optimize(nodeLabels=node_labels)
+
+
+def _summary(segmentation: np.ndarray) -> dict[str, Any]:
+    ids, sizes = np.unique(segmentation, return_counts=True)
+    sizes = sizes[ids != 0]
+    return {
+        "n_segments": len(sizes),
+        "mean_segment_size": float(sizes.mean()) if len(sizes) else 0.0,
+    }
+
+
+def segmentation_sweep(
+    boundary_pmaps: np.ndarray,
+    superpixels: np.ndarray,
+    betas: Sequence[float] = (0.5,),
+    post_minsizes: Sequence[int] = (100,),
+    modes: Sequence[str] = ("multicut",),
+    gasp_linkage_criteria: Sequence[str] = ("average",),
+    n_workers: int = 1,
+    return_segmentations: bool = True,
+) -> list[dict[str, Any]]:
+    """Segment `superpixels` with every combination of the given parameters, sharing the common work.
+
+    Args:
+        boundary_pmaps (np.ndarray): cell boundary prediction, 3D array of shape (Z, Y, X) or 2D array of shape
+            (Y, X) with values between 0 and 1.
+        superpixels (np.ndarray): superpixel segmentation. Must have the same shape as boundary_pmaps.
+        betas (Sequence[float]): beta parameters to sweep. (default: (0.5,))
+        post_minsizes (Sequence[int]): minimal sizes of the segments to sweep. (default: (100,))
+        modes (Sequence[str]): segmentations to sweep, any of 'multicut', 'gasp' and 'mutex_ws'.
+            (default: ('multicut',))
+        gasp_linkage_criteria (Sequence[str]): linkage criteria to sweep in the 'gasp' mode. (default: ('average',))
+        n_workers (int): number of configurations solved in parallel. (default: 1)
+        return_segmentations (bool): whether to return the segmentations, or only their summary statistics.
+            (default: True)
+
+    Returns:
+        list[dict[str, Any]]: one record per configuration, with its 'mode', 'linkage_criteria' (None for the
+            multicut), 'beta' and 'post_minsize', the summary statistics 'n_segments' and 'mean_segment_size',
+            the multicut 'energy' (None for GASP), the 'runtime' of the solve in seconds, and the 'segmentation'
+            if `return_segmentations`. Records are sorted as the parameter grid.
+    """
+    unknown_modes = set(modes) - set(SWEEP_MODES)
+    if unknown_modes:
+        raise ValueError(f"Unknown modes {unknown_modes}, select any of {SWEEP_MODES}")
+    if boundary_pmaps.shape != superpixels.shape:
+        raise ValueError(
+            "The boundary probability map and the superpixels should have the same shape."
+        )
+
+    remove_singleton = superpixels.ndim == 2
+    if remove_singleton:
+        boundary_pmaps, superpixels = boundary_pmaps[None], superpixels[None]
+    boundary_pmaps = boundary_pmaps.astype("float32", copy=False)
+
+    if "multicut" in modes:
+        rag = compute_rag(superpixels)
+        features = compute_boundary_mean_and_length(rag, boundary_pmaps)
+        uv_ids = rag.uvIds()
+        graph = nifty.graph.undirectedGraph(rag.numberOfNodes)
+        graph.insertEdges(uv_ids)
+    if "gasp" in modes or "mutex_ws" in modes:
+        affinities = affinities_from_boundaries(boundary_pmaps, offsets=GASP_OFFSETS)
+
+    def filter_and_record(segmentation, record):
+        records = []
+        for post_minsize in post_minsizes:
+            filtered = segmentation
+            if post_minsize > 0:
+                filtered, _ = apply_size_filter(
+                    segmentation.astype("uint32"), boundary_pmaps, post_minsize
+                )
+            if remove_singleton:
+                filtered = filtered[0]
+            records.append(record | {"post_minsize": post_minsize} | _summary(filtered))
+            if return_segmentations:
+                records[-1]["segmentation"] = filtered
+        return records
+
+    def solve_multicut_chain(chain):
+        records, node_labels = [], None
+        for beta in chain:
+            start = time.perf_counter()
+            costs = costs_from_features(features, beta)
+            node_labels = _kernighan_lin_warm_start(graph, costs, node_labels)
+            energy = float(
+                costs[node_labels[uv_ids[:, 0]] != node_labels[uv_ids[:, 1]]].sum()
+            )
+            segmentation = nifty.tools.take(node_labels, superpixels)
+            record = {
+                "mode": "multicut",
+                "linkage_criteria": None,
+                "beta": beta,
+                "energy": energy,
+                "runtime": time.perf_counter() - start,
+            }
+            records.extend(filter_and_record(segmentation, record))
+        return records
+
+    def solve_gasp(mode, linkage_criteria, beta):
+        start = time.perf_counter()
+        segmentation = gasp_from_affinities(
+            affinities, superpixels, linkage_criteria, beta, n_threads=1
+        )
+        record = {
+            "mode": mode,
+            "linkage_criteria": linkage_criteria,
+            "beta": beta,
+            "energy": None,
+            "runtime": time.perf_counter() - start,
+        }
+        return filter_and_record(segmentation, record)
+
+    jobs = []
+    for mode in modes:
+        if mode == "multicut":
+            jobs += [
+                (solve_multicut_chain, (chain,))
+                for chain in warm_start_chains(betas, n_workers)
+            ]
+        else:
+            criteria = gasp_linkage_criteria if mode == "gasp" else ("mutex_watershed",)
+            jobs += [
+                (solve_gasp, (mode, linkage_criteria, beta))
+                for linkage_criteria, beta in itertools.product(criteria, betas)
+            ]
+
+    logger.info(
+        f"Sweeping {len(modes)} modes, {len(betas)} betas and {len(post_minsizes)} minimal sizes "
+        f"in {len(jobs)} jobs with {n_workers} workers."
+    )
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(job, *args) for job, args in jobs]
+        records = [record for future in futures for record in future.result()]
+
+    grid_order = {
+        key: i
+        for i, key in enumerate(
+            itertools.product(modes, sorted(set(betas)), post_minsizes)
+        )
+    }
+    return sorted(
+        records,
+        key=lambda r: (
+            grid_order[(r["mode"], r["beta"], r["post_minsize"])],
+            str(r["linkage_criteria"]),
+        ),
+    )
@@ -3,41 +3,46 @@ from elf.segmentation import compute_boundary_mean_and_length
 from elf.segmentation.multicut import transform_probabilities_to_costs
 
 
+def _shift_slices(
+    shifts: tuple[int, ...], shape: tuple[int, ...]
+) -> tuple[tuple[slice, ...], tuple[slice, ...]]:
+    """Destination and source slices moving the content of an array of `shape` by `shifts`."""
+    dst = tuple(slice(max(s, 0), n + min(s, 0)) for s, n in zip(shifts, shape))
+    src = tuple(slice(max(-s, 0), n - max(s, 0)) for s, n in zip(shifts, shape))
+    return dst, src
+
+
 def shift_affinities(affinities, offsets):
-    rolled_affs = []
-    for i, _ in enumerate(offsets):
-        offset = offsets[i]
-        shifts = tuple([int(off / 2) for off in offset])
-
-        padding = [[0, 0] for _ in range(len(shifts))]
-        for ax, shf in enumerate(shifts):
-            if shf < 0:
-                padding[ax][1] = -shf
-            elif shf > 0:
-                padding[ax][0] = shf
-
-        padded_inverted_affs = np.pad(
-            affinities, pad_width=((0, 0),) + tuple(padding), mode="constant"
-        )
-
-        crop_slices = tuple(
-            slice(padding[ax][0], padded_inverted_affs.shape[ax + 1] - padding[ax][1])
-            for ax in range(3)
-        )
-
-        padded_inverted_affs = np.roll(padded_inverted_affs[i], shifts, axis=(0, 1, 2))[
-            crop_slices
-        ]
-        rolled_affs.append(padded_inverted_affs)
-        del padded_inverted_affs
-
-    rolled_affs = np.stack(rolled_affs)
+    """Shift each channel of `affinities` by half of its offset, filling the uncovered border with 0."""
+    rolled_affs = np.zeros_like(affinities)
+    for i, offset in enumerate(offsets):
+        shifts = tuple(int(off / 2) for off in offset)
+        dst, src = _shift_slices(shifts, affinities.shape[1:])
+        rolled_affs[i][dst] = affinities[i][src]
     return rolled_affs
 
 
+def affinities_from_boundaries(boundary_pmaps: np.ndarray, offsets) -> np.ndarray:
+    """Affinities for GASP from a boundary probability map, one channel per offset.
+
+    Equivalent to `1 - shift_affinities(np.stack([boundary_pmaps] * len(offsets)), offsets)`, but written into a
+    single float32 allocation without temporaries, so the peak memory is the size of the returned affinities.
+    """
+    affinities = np.ones((len(offsets),) + boundary_pmaps.shape, dtype="float32")
+    for i, offset in enumerate(offsets):
+        shifts = tuple(int(off / 2) for off in offset)
+        dst, src = _shift_slices(shifts, boundary_pmaps.shape)
+        np.subtract(1, boundary_pmaps[src], out=affinities[i][dst], casting="unsafe")
+    return affinities
+
+
 def compute_mc_costs(boundary_pmaps, rag, beta):
     # compute the edge costs
     features = compute_boundary_mean_and_length(rag, boundary_pmaps)
+    return costs_from_features(features, beta)
+
+
+def costs_from_features(features, beta):
     costs, sizes = features[:, 0], features[:, 1]
 
     # transform the edge costs from [0, 1] to  [-inf, inf], which is
@@ -27,8 +27,7 @@ class SerialRunner:
     def find_next_task(self, dag: DAG, var_set: set[str]):
         """Return the next task to run based on the current var_set"""
         for task in dag.list_tasks:
-            required_inputs = set(task.images_inputs.values())
-            if required_inputs.issubset(var_set):
+            if task.required_inputs.issubset(var_set):
                 dag.list_tasks.remove(task)
                 return task
         return None
@@ -38,7 +37,10 @@ class SerialRunner:
         # Get inputs from var_space
         inputs = {}
         for name, image_name in task.images_inputs.items():
-            inputs[name] = var_space[image_name]
+            if isinstance(image_name, list):
+                inputs[name] = [var_space[n] for n in image_name]
+            else:
+                inputs[name] = var_space[image_name]
 
         # run the task
         func = self.func_registry.get_func(task.func)
@@ -65,9 +67,8 @@ class SerialRunner:
     def clean_var_space(self, dag: DAG, var_space: dict):
         all_remaining_required_inputs = set()
         for task in dag.list_tasks:
-            required_inputs = set(task.images_inputs.values())
             all_remaining_required_inputs = all_remaining_required_inputs.union(
-                required_inputs
+                task.required_inputs
             )
 
         list_key_to_delete = []
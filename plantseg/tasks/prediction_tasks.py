@@ -3,7 +3,11 @@ from typing import Optional
 
 from plantseg.core.image import ImageLayout, PlantSegImage, SemanticType
 from plantseg.functionals.dataprocessing import fix_layout
-from plantseg.functionals.prediction import biio_prediction, unet_prediction
+from plantseg.functionals.prediction import (
+    biio_prediction,
+    unet_prediction,
+    unet_prediction_batch,
+)
 from plantseg.tasks import task_tracker
 
 
@@ -21,6 +25,25 @@ def unet_prediction_task(
     disable_tqdm: bool = False,
     config_path: Path | None = None,
     model_weights_path: Path | None = None,
+    stride_ratio: float = 0.75,
+    blending: str = "uniform",
+    num_workers: int = 0,
+    precision: str = "fp32",
+    backend: str = "eager",
+    autotune: bool = False,
+    skip_background: bool = False,
+    background_value: float = 0.0,
+    stats_subsampling: int = 1,
+    num_processes: int = 1,
+    use_cache: bool = False,
+    cache_dir: Path | None = None,
+    cache_max_gb: float = 20.0,
+    pyramid: bool = False,
+    pyramid_downsampling: tuple[int, int, int] = (2, 4, 4),
+    pyramid_threshold: float = 0.3,
+    output_channels: list[int] | None = None,
+    output_dtype: str = "float32",
+    tiling: str = "overlap",
     _tracker: Optional["PBar_Tracker"] = None,
 ) -> list[PlantSegImage]:
     """
@@ -35,6 +58,27 @@ def unet_prediction_task(
         single_batch_mode (bool): whether to use a single batch for prediction
         device (str): the computation device ('cpu', 'cuda', etc.)
         model_update (bool): whether to update the model to the latest version
+        stride_ratio (float): stride between patches as a fraction of the patch size
+        blending (str): weighting of overlapping patches, 'uniform', 'gaussian' or 'cosine'
+        num_workers (int): number of worker processes preparing patches during prediction
+        precision (str): precision of the forward pass, 'fp32', 'bf16' or 'fp16-accumulate'
+        backend (str): inference backend, 'eager', 'torchscript', 'compile' or 'onnx'
+        autotune (bool): pick the fastest patch shape, batch size and thread count if `patch` is None
+        skip_background (bool): skip patches without foreground in a cheap thresholding pre-pass
+        background_value (float): prediction of the skipped patches
+        stats_subsampling (int): stride used to estimate the global normalization statistics
+        num_processes (int): number of CPU processes, each predicting a shard of the patches
+        use_cache (bool): load the prediction from, or store it in, the on-disk prediction cache
+        cache_dir (Path | None): directory of the prediction cache, `~/.plantseg_models/prediction_cache` if None
+        cache_max_gb (float): size of the prediction cache, least-recently used predictions are evicted beyond it
+        pyramid (bool): predict a downsampled copy first and only its boundary regions at full resolution
+        pyramid_downsampling (tuple[int, int, int]): downsampling factors of the coarse copy
+        pyramid_threshold (float): coarse probability above which a region is predicted at full resolution
+        output_channels (list[int] | None): indices of the output channels to keep, e.g. `[0]` for the boundary
+            channel, all channels if None
+        output_dtype (str): dtype of the predictions, 'float32', 'float16' or 'uint8' (probabilities times 255)
+        tiling (str): 'overlap' tiles with `stride_ratio`, 'auto' tiles without overlap if the halo covers the
+            receptive field of the model
     """
     data = image.get_data()
     input_layout = image.image_layout
@@ -53,12 +97,44 @@ def unet_prediction_task(
         config_path=config_path,
         model_weights_path=model_weights_path,
         tracker=_tracker,
+        stride_ratio=stride_ratio,
+        blending=blending,
+        num_workers=num_workers,
+        precision=precision,
+        backend=backend,
+        autotune=autotune,
+        skip_background=skip_background,
+        background_value=background_value,
+        stats_subsampling=stats_subsampling,
+        num_processes=num_processes,
+        use_cache=use_cache,
+        cache_dir=cache_dir,
+        cache_max_gb=cache_max_gb,
+        pyramid=pyramid,
+        pyramid_downsampling=pyramid_downsampling,
+        pyramid_threshold=pyramid_threshold,
+        output_channels=output_channels,
+        output_dtype=output_dtype,
+        tiling=tiling,
     )
+    return _derive_predictions(image, pmaps, suffix, channels=output_channels)
+
+
+def _derive_predictions(
+    image: PlantSegImage, pmaps, suffix: str, channels: list[int] | None = None
+) -> list[PlantSegImage]:
+    """One prediction image per channel of the CZYX `pmaps`, in the layout of `image`.
+
+    Images are named after `channels`, the model output channels of `pmaps`, if only some were predicted.
+    """
     assert pmaps.ndim == 4, f"Expected 4D CZXY prediction, got {pmaps.ndim}D"
+    input_layout = image.image_layout
 
     new_images = []
 
-    for i, pmap in enumerate(pmaps):
+    if channels is None:
+        channels = range(len(pmaps))
+    for i, pmap in zip(channels, pmaps):
         # Input layout is always ZYX this loop
         pmap = fix_layout(
             pmap, input_layout=ImageLayout.ZYX.value, output_layout=input_layout.value
@@ -75,6 +151,75 @@ def unet_prediction_task(
     return new_images
 
 
+@task_tracker
+def unet_prediction_batch_task(
+    images: list[PlantSegImage],
+    model_name: str | None,
+    model_id: str | None,
+    suffix: str = "_prediction",
+    patch: tuple[int, int, int] | None = None,
+    patch_halo: tuple[int, int, int] | None = None,
+    batch_size: int | None = None,
+    device: str = "cuda",
+    model_update: bool = False,
+    disable_tqdm: bool = False,
+    config_path: Path | None = None,
+    model_weights_path: Path | None = None,
+    stride_ratio: float = 0.75,
+    blending: str = "uniform",
+    num_workers: int = 0,
+    precision: str = "fp32",
+    backend: str = "eager",
+    _tracker: Optional["PBar_Tracker"] = None,
+) -> list[PlantSegImage]:
+    """
+    Apply a trained U-Net model to many PlantSegImage objects, predicting same-shaped images in shared batches.
+
+    Args:
+        images (list[PlantSegImage]): input image objects
+        model_name (str): the name of the model to use
+        model_id (str): the ID of the model to use
+        suffix (str): suffix to append to the new image names
+        patch (tuple[int, int, int]): patch size for prediction
+        batch_size (int): number of patches per forward pass, the largest fitting in memory if None
+        device (str): the computation device ('cpu', 'cuda', etc.)
+        model_update (bool): whether to update the model to the latest version
+        stride_ratio (float): stride between patches as a fraction of the patch size
+        blending (str): weighting of overlapping patches, 'uniform', 'gaussian' or 'cosine'
+        num_workers (int): number of worker processes preparing patches during prediction
+        precision (str): precision of the forward pass, 'fp32', 'bf16' or 'fp16-accumulate'
+        backend (str): inference backend, 'eager', 'torchscript', 'compile' or 'onnx'
+
+    Returns:
+        list[PlantSegImage]: the predictions of all channels of the first image, then of the second, etc.
+    """
+    pmaps = unet_prediction_batch(
+        raws=[image.get_data() for image in images],
+        input_layout=[image.image_layout.value for image in images],
+        model_name=model_name,
+        model_id=model_id,
+        patch=patch,
+        patch_halo=patch_halo,
+        batch_size=batch_size,
+        device=device,
+        model_update=model_update,
+        disable_tqdm=disable_tqdm,
+        config_path=config_path,
+        model_weights_path=model_weights_path,
+        tracker=_tracker,
+        stride_ratio=stride_ratio,
+        blending=blending,
+        num_workers=num_workers,
+        precision=precision,
+        backend=backend,
+    )
+
+    new_images = []
+    for image, image_pmaps in zip(images, pmaps):
+        new_images.extend(_derive_predictions(image, image_pmaps, suffix))
+    return new_images
+
+
 @task_tracker
 def biio_prediction_task(
     image: PlantSegImage,
@@ -3,12 +3,14 @@ import logging
 from plantseg.core.image import ImageLayout, PlantSegImage, SemanticType
 from plantseg.functionals.dataprocessing.dataprocessing import normalize_01
 from plantseg.functionals.segmentation import (
+    average_linkage_agglomeration,
     dt_watershed,
     gasp,
     lifted_multicut_from_nuclei_pmaps,
     lifted_multicut_from_nuclei_segmentation,
     multicut,
     mutex_ws,
+    segmentation_sweep,
 )
 from plantseg.tasks import task_tracker
 
@@ -28,6 +30,8 @@ def dt_watershed_task(
     apply_nonmax_suppression: bool = False,
     n_threads: int | None = None,
     is_nuclei_image: bool = False,
+    block_shape: tuple[int, ...] | None = None,
+    n_workers: int = 1,
 ) -> PlantSegImage:
     """Distance transform watershed segmentation task.
 
@@ -57,6 +61,9 @@ def dt_watershed_task(
             in 2D mode. Defaults to None.
         is_nuclei_image (bool, optional): If True, indicates that the input image is a nuclei
             image, and preprocessing is applied accordingly. Defaults to False.
+        block_shape (tuple[int, ...] | None, optional): If given, segment in blocks of this shape
+            and stitch them. Defaults to None.
+        n_workers (int, optional): Number of processes segmenting blocks. Defaults to 1.
 
     Returns:
         PlantSegImage: The segmented image as a new `PlantSegImage` object.
@@ -95,6 +102,8 @@ def dt_watershed_task(
         apply_nonmax_suppression=apply_nonmax_suppression,
         n_threads=n_threads,
         mask=mask,
+        block_shape=block_shape,
+        n_workers=n_workers,
     )
 
     dt_seg_image = image.derive_new(
@@ -112,6 +121,9 @@ def clustering_segmentation_task(
     mode="gasp",
     beta: float = 0.5,
     post_min_size: int = 100,
+    block_shape: tuple[int, ...] | None = None,
+    n_levels: int = 1,
+    time_limit: float | None = None,
 ) -> PlantSegImage:
     """Agglomerative segmentation task.
 
@@ -121,6 +133,9 @@ def clustering_segmentation_task(
         mode (str): mode for the agglomerative segmentation
         beta (float): beta parameter
         post_min_size (int): minimum size for the segments
+        block_shape (tuple[int, ...] | None): multicut mode only, solve block sub-problems of this shape first
+        n_levels (int): multicut mode only, number of levels of block sub-problems
+        time_limit (float | None): multicut mode only, time budget of the solver in seconds
     """
     if image.is_multichannel:
         raise ValueError("Multichannel images are not supported for this task.")
@@ -159,6 +174,20 @@ def clustering_segmentation_task(
             superpixels=superpixels,
             beta=beta,
             post_minsize=post_min_size,
+            block_shape=block_shape,
+            n_levels=n_levels,
+            time_limit=time_limit,
+        )
+    elif mode == "average_linkage":
+        if superpixels is None:
+            raise ValueError(
+                "The superpixels are required for the average_linkage mode."
+            )
+        seg = average_linkage_agglomeration(
+            boundary_pmaps,
+            superpixels=superpixels,
+            beta=beta,
+            post_minsize=post_min_size,
         )
     elif mode == "mutex_ws":
         seg = mutex_ws(
@@ -169,7 +198,7 @@ def clustering_segmentation_task(
         )
     else:
         raise ValueError(
-            f"Unknown mode: {mode}, select one of ['gasp', 'multicut', 'mutex_ws']"
+            f"Unknown mode: {mode}, select one of ['gasp', 'multicut', 'mutex_ws', 'average_linkage']"
         )
 
     seg_image = image.derive_new(
@@ -178,6 +207,61 @@ def clustering_segmentation_task(
     return seg_image
 
 
+@task_tracker
+def segmentation_sweep_task(
+    image: PlantSegImage,
+    over_segmentation: PlantSegImage,
+    betas: tuple[float, ...] = (0.5,),
+    post_min_sizes: tuple[int, ...] = (100,),
+    modes: tuple[str, ...] = ("multicut",),
+    gasp_linkage_criteria: tuple[str, ...] = ("average",),
+    n_workers: int = 1,
+) -> list[PlantSegImage]:
+    """Parameter sweep of the agglomerative segmentations, reusing the graph and features of the superpixels.
+
+    Args:
+        image (PlantSegImage): boundary probability map
+        over_segmentation (PlantSegImage): over-segmentation image object
+        betas (tuple[float, ...]): beta parameters to sweep
+        post_min_sizes (tuple[int, ...]): minimum sizes for the segments to sweep
+        modes (tuple[str, ...]): segmentations to sweep, any of 'multicut', 'gasp' and 'mutex_ws'
+        gasp_linkage_criteria (tuple[str, ...]): linkage criteria to sweep in the 'gasp' mode
+        n_workers (int): number of configurations solved in parallel
+
+    Returns:
+        list[PlantSegImage]: one segmentation per configuration, named after its parameters
+    """
+    if image.is_multichannel:
+        raise ValueError("Multichannel images are not supported for this task.")
+    if over_segmentation.semantic_type != SemanticType.SEGMENTATION:
+        raise ValueError("The input over_segmentation is not a segmentation map.")
+
+    records = segmentation_sweep(
+        image.get_data(),
+        over_segmentation.get_data(),
+        betas=betas,
+        post_minsizes=post_min_sizes,
+        modes=modes,
+        gasp_linkage_criteria=gasp_linkage_criteria,
+        n_workers=n_workers,
+    )
+
+    segmentations = []
+    for record in records:
+        name = f"{image.name}_{record['mode']}"
+        if record["mode"] == "gasp":
+            name += f"_{record['linkage_criteria']}"
+        name += f"_beta{record['beta']}_minsize{record['post_minsize']}"
+        segmentations.append(
+            image.derive_new(
+                record["segmentation"],
+                name=name,
+                semantic_type=SemanticType.SEGMENTATION,
+            )
+        )
+    return segmentations
+
+
 @task_tracker
 def lmc_segmentation_task(
     boundary_pmap: PlantSegImage,
@@ -67,7 +67,8 @@ class Task(BaseModel):
     Attributes:
         func (str): The name of the function to be executed
         images_inputs (dict): A image input represent a Image object.
-            The key is the name of the parameter in the function, and the value is the name of the image.
+            The key is the name of the parameter in the function, and the value is the name of the image,
+            or a list of names for parameters taking a list of images.
         parameters (dict): The kwargs parameters of the workflow function.
         outputs (list[str]): A list of the names of the output images.
         node_type (NodeType): The type of the node in the workflow (ROOT, LEAF, NODE)
@@ -77,6 +78,17 @@ class Task(BaseModel):
 
     """
 
+    @property
+    def required_inputs(self) -> set[str]:
+        """Names of all the images and runtime inputs read by the task."""
+        names = set()
+        for value in self.images_inputs.values():
+            if isinstance(value, list):
+                names.update(value)
+            else:
+                names.add(value)
+        return names
+
 
 class DAG(BaseModel):
     infos: Infos = Field(default_factory=Infos)
@@ -108,9 +120,8 @@ def prune_dag(dag: DAG) -> DAG:
     reachable_inputs = set()
     for task in dag.list_tasks:
         if task.node_type == NodeType.LEAF:
-            for inp_key in task.images_inputs.values():
-                reachable.add(task.id)
-                reachable_inputs.add(inp_key)
+            reachable.add(task.id)
+            reachable_inputs.update(task.required_inputs)
 
     safety_counter = 0
     size_reachable = len(reachable)
@@ -121,8 +132,7 @@ def prune_dag(dag: DAG) -> DAG:
             for out_key in task.outputs:
                 if out_key in reachable_inputs:
                     reachable.add(task.id)
-                    for inp_key in task.images_inputs.values():
-                        reachable_inputs.add(inp_key)
+                    reachable_inputs.update(task.required_inputs)
 
         safety_counter += 1
         if safety_counter > 1_000_000:
@@ -335,6 +345,14 @@ def task_tracker(
                     images_inputs[name] = arg.unique_name
                     parameters.pop(name)
 
+                elif (
+                    isinstance(arg, (list, tuple))
+                    and arg
+                    and all(isinstance(img, PlantSegImage) for img in arg)
+                ):
+                    images_inputs[name] = [img.unique_name for img in arg]
+                    parameters.pop(name)
+
                 elif name in list_inputs.keys():
                     value = list_inputs[name]
                     input_name = workflow_handler.add_input(
@@ -370,8 +388,11 @@ def task_tracker(
                     f"Output of a workflow function should be one of None, Image or tuple of Images. Got {type(out_image)}"
                 )
 
+            input_names = set()
+            for value in images_inputs.values():
+                input_names.update(value if isinstance(value, list) else [value])
             for name in list_outputs:
-                if name in images_inputs.values():
+                if name in input_names:
                     raise ValueError(
                         f"Function {func.__name__} has an output image with the same name as an input image: {name}"
                     )
@@ -674,21 +674,63 @@ class Augmenter:
         )
 
 
-def get_test_augmentations(raw: np.ndarray | None, expand_dims: bool = True) -> Compose:
+def compute_global_stats(
+    raw, subsampling: int = 1, slab_size: int = 16
+) -> tuple[float, float]:
+    """
+    Computes the mean and standard deviation of a volume one z-slab at a time.
+
+    Slabs are read in their original dtype and reduced in float64, and their statistics are merged
+    with Chan's parallel update, so no float copy of the volume is made and `raw` may be any
+    array-like object supporting slicing, e.g. a `h5py.Dataset` or a `zarr.Array`.
+
+    Args:
+        raw: The volume, ZYX or CZYX. The slabs are taken along the third to last axis.
+        subsampling (int): Only every `subsampling`-th voxel along each spatial axis is used.
+        slab_size (int): Number of z-slices read at once.
+
+    Returns:
+        tuple[float, float]: The mean and the (population) standard deviation.
+    """
+    z_axis = max(raw.ndim - 3, 0)
+    n_z = raw.shape[z_axis]
+    spatial_step = (slice(None, None, subsampling),) * (raw.ndim - z_axis - 1)
+    count, mean, m2 = 0, 0.0, 0.0
+    for z in range(0, n_z, slab_size * subsampling):
+        z_slice = slice(z, min(z + slab_size * subsampling, n_z), subsampling)
+        index = (slice(None),) * z_axis + (z_slice,) + spatial_step
+        slab = np.asarray(raw[index], dtype="float64")
+        slab_mean = slab.mean()
+        slab_m2 = np.square(slab - slab_mean).sum()
+
+        delta = slab_mean - mean
+        total = count + slab.size
+        mean += delta * slab.size / total
+        m2 += slab_m2 + delta**2 * count * slab.size / total
+        count = total
+    return float(mean), float(np.sqrt(m2 / count))
+
+
+def get_test_augmentations(
+    raw: np.ndarray | None, expand_dims: bool = True, subsampling: int = 1
+) -> Compose:
     """
     Constructs a set of data transformations for inference.
     Uses global mean and standard deviation of the provided raw data if available;
     otherwise, it calculatesthese statistics on-the-fly per patch.
 
     Args:
-        raw (Optional[ndarray]): The raw data to compute global statistics.
+        raw (Optional[ndarray]): The raw data to compute global statistics, in any dtype.
                                  If None, statistics are computedduring transformation per patch.
         expand_dims (bool): if True, adds a channel dimension to the input data.
+        subsampling (int): stride along each spatial axis used to estimate the global statistics.
 
     Returns:
         Compose: A composed transformation of standardization and tensor conversion.
     """
-    mean = np.mean(raw) if raw is not None else None
-    std = np.std(raw) if raw is not None else None
+    if raw is not None:
+        mean, std = compute_global_stats(raw, subsampling=subsampling)
+    else:
+        mean, std = None, None
 
     return Compose([Standardize(mean=mean, std=std), ToTensor(expand_dims=expand_dims)])
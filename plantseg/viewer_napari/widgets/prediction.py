@@ -30,6 +30,11 @@ ALL_DEVICES = ALL_CUDA_DEVICES + MPS + ["cpu"]
 BIOIMAGEIO_FILTER = [("PlantSeg Only", True), ("All", False)]
 SINGLE_PATCH_MODE = [("Auto", False), ("One (lower VRAM usage)", True)]
 ADVANCED_SETTINGS = [("Enable", True), ("Disable", False)]
+PRECISION_MODES = [
+    ("Full (fp32)", "fp32"),
+    ("bfloat16 (fast on CPU)", "bf16"),
+    ("float16", "fp16-accumulate"),
+]
 
 # Using Enum causes more complexity, stay constant
 ALL_DIMENSIONS = "All dimensions"
@@ -138,7 +143,19 @@ model_filters = Container(
         "orientation": "horizontal",
         "choices": SINGLE_PATCH_MODE,
     },
+    precision={
+        "label": "Precision",
+        "tooltip": "Numerical precision of the network. Reduced precision is faster, "
+        "especially bfloat16 on recent CPUs, and changes probabilities by about 1e-2.",
+        "widget_type": "ComboBox",
+        "choices": PRECISION_MODES,
+    },
     device={"label": "Device", "choices": ALL_DEVICES},
+    use_cache={
+        "label": "Cache prediction",
+        "tooltip": "Reuse the prediction of the same image, model and parameters from the on-disk "
+        "prediction cache, or store it there.",
+    },
     pbar={"label": "Progress", "max": 0, "min": 0, "visible": False},
     update_other_widgets={
         "visible": False,
@@ -152,10 +169,12 @@ def widget_unet_prediction(
     model_name: Optional[str] = None,
     model_id: Optional[str] = model_zoo.get_bioimageio_zoo_plantseg_model_names()[0][1],
     device: str = ALL_DEVICES[0],
+    use_cache: bool = False,
     advanced: bool = False,
     patch_size: tuple[int, int, int] = (128, 128, 128),
     patch_halo: tuple[int, int, int] = (0, 0, 0),
     single_patch: bool = False,
+    precision: str = "fp32",
     pbar: Optional[ProgressBar] = None,
     update_other_widgets: bool = True,
 ) -> None:
@@ -179,7 +198,9 @@ def widget_unet_prediction(
                 "patch": patch_size if advanced else None,
                 "patch_halo": patch_halo if advanced else None,
                 "single_batch_mode": single_patch if advanced else False,
+                "precision": precision if advanced else "fp32",
                 "device": device,
+                "use_cache": use_cache,
                 "_pbar": pbar,
                 "_to_hide": [widget_unet_prediction.call_button],
             },
@@ -213,6 +234,7 @@ advanced_unet_prediction_widgets = [
     widget_unet_prediction.patch_size,
     widget_unet_prediction.patch_halo,
     widget_unet_prediction.single_patch,
+    widget_unet_prediction.precision,
 ]
 [widget.hide() for widget in advanced_unet_prediction_widgets]
 
@@ -1,7 +1,11 @@
+import napari
 from magicgui import magicgui
 from napari.layers import Image, Labels, Layer
+from napari.qt.threading import create_worker
+from qtpy.QtCore import QTimer
 
-from plantseg.core.image import ImageLayout, PlantSegImage
+from plantseg.core.image import ImageLayout, PlantSegImage, SemanticType
+from plantseg.functionals.segmentation.agglomeration_tree import AgglomerationTree
 from plantseg.tasks.segmentation_tasks import (
     clustering_segmentation_task,
     dt_watershed_task,
@@ -14,7 +18,7 @@ from plantseg.viewer_napari.widgets.dataprocessing import (
 from plantseg.viewer_napari.widgets.proofreading import (
     widget_proofreading_initialisation,
 )
-from plantseg.viewer_napari.widgets.utils import schedule_task
+from plantseg.viewer_napari.widgets.utils import add_ps_image_to_viewer, schedule_task
 
 ########################################################################################################################
 #                                                                                                                      #
@@ -31,6 +35,7 @@ AGGLOMERATION_MODES = [
     ("MutexWS", "mutex_ws"),
     ("MultiCut", "multicut"),
     ("LiftedMultiCut", "lmc"),
+    ("AverageLinkage", "average_linkage"),
 ]
 
 
@@ -66,6 +71,11 @@ AGGLOMERATION_MODES = [
         "label": "Minimum segment size",
         "tooltip": "Minimum segment size allowed in voxels.",
     },
+    live_beta={
+        "label": "Live beta slider",
+        "tooltip": "AverageLinkage only: compute the merge tree of the superpixels once, "
+        "then update the segmentation, without the size filter, when the factor stops changing.",
+    },
 )
 def widget_agglomeration(
     image: Image,
@@ -74,6 +84,7 @@ def widget_agglomeration(
     mode: str = AGGLOMERATION_MODES[0][1],
     beta: float = 0.6,
     minsize: int = 100,
+    live_beta: bool = False,
 ) -> None:
     ps_image = PlantSegImage.from_napari_layer(image)
     ps_labels = PlantSegImage.from_napari_layer(superpixels)
@@ -120,6 +131,80 @@ def _on_mode_changed(mode: str):
     else:
         widget_agglomeration.nuclei.hide()
 
+    if mode == "average_linkage":
+        widget_agglomeration.live_beta.show()
+    else:
+        widget_agglomeration.live_beta.hide()
+
+
+LIVE_BETA_DELAY_MS = 150
+
+# merge tree of the layers last used by the live beta slider, kept to cut it without recomputing anything
+_live_tree: dict = {"key": None, "image": None, "tree": None}
+
+_live_beta_timer = QTimer()
+_live_beta_timer.setSingleShot(True)
+_live_beta_timer.setInterval(LIVE_BETA_DELAY_MS)
+
+
+@widget_agglomeration.beta.changed.connect
+def _on_beta_changed(beta: float):
+    if (
+        widget_agglomeration.live_beta.value
+        and widget_agglomeration.mode.value == "average_linkage"
+    ):
+        # restarted at every tick, so only the value the slider rests on is cut
+        _live_beta_timer.start()
+
+
+def _build_live_tree(
+    ps_image: PlantSegImage, ps_labels: PlantSegImage
+) -> AgglomerationTree:
+    return AgglomerationTree.from_boundaries(ps_image.get_data(), ps_labels.get_data())
+
+
+def _set_live_tree(key: tuple[int, int], tree: AgglomerationTree) -> None:
+    if _live_tree["key"] != key:
+        return  # the layers changed while the tree was computed
+    _live_tree["tree"] = tree
+    _cut_live_tree()
+
+
+@_live_beta_timer.timeout.connect
+def _cut_live_tree() -> None:
+    image = widget_agglomeration.image.value
+    superpixels = widget_agglomeration.superpixels.value
+    if image is None or superpixels is None:
+        return
+
+    key = (id(image.data), id(superpixels.data))
+    if _live_tree["key"] != key:
+        ps_image = PlantSegImage.from_napari_layer(image)
+        ps_labels = PlantSegImage.from_napari_layer(superpixels)
+        _live_tree.update(key=key, image=ps_image, tree=None)
+        log("Computing the merge tree of the superpixels", thread="Agglomeration")
+        worker = create_worker(_build_live_tree, ps_image, ps_labels)
+        worker.returned.connect(lambda tree: _set_live_tree(key, tree))
+        worker.start()
+        return
+    if _live_tree["tree"] is None:
+        return  # cut once the tree is computed
+
+    # the size filter is skipped while dragging, run the widget to apply it
+    segmentation = _live_tree["tree"].cut(widget_agglomeration.beta.value)
+    ps_image = _live_tree["image"]
+    ps_segmentation = ps_image.derive_new(
+        segmentation,
+        name=f"{ps_image.name}_average_linkage",
+        semantic_type=SemanticType.SEGMENTATION,
+    )
+    viewer = napari.current_viewer()
+    if viewer is not None and ps_segmentation.name in viewer.layers:
+        data, _, _ = ps_segmentation.to_napari_layer_tuple()
+        viewer.layers[ps_segmentation.name].data = data
+    else:
+        add_ps_image_to_viewer(ps_segmentation)
+
 
 ########################################################################################################################
 #                                                                                                                      #
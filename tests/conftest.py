@@ -10,7 +10,9 @@ import skimage.transform as skt
 import torch
 import yaml
 
+from plantseg import FILE_BEST_MODEL_PYTORCH, FILE_CONFIG_TRAIN_YAML
 from plantseg.io.io import smart_load
+from plantseg.training.model import UNet2D, UNet3D
 
 TEST_FILES = Path(__file__).resolve().parent / "resources"
 VOXEL_SIZE = (0.235, 0.15, 0.15)
@@ -143,3 +145,35 @@ def complex_test_data():
     boundary_pmap[1:4, 1:4, 6:9] = 0.2
 
     return cell_seg, nuclei_seg, boundary_pmap
+
+
+def _save_tiny_unet(base: Path, model_class, name: str) -> Path:
+    """Save a randomly initialised, small U-Net in the layout expected by the model zoo."""
+    model_config = {
+        "name": name,
+        "in_channels": 1,
+        "out_channels": 1,
+        "f_maps": [4, 8],
+        "layer_order": "gcr",
+        "num_groups": 2,
+        "final_sigmoid": True,
+    }
+    torch.manual_seed(0)
+    model = model_class(**model_config)
+    base.mkdir(parents=True, exist_ok=True)
+    torch.save(model.state_dict(), base / FILE_BEST_MODEL_PYTORCH)
+    config_path = base / FILE_CONFIG_TRAIN_YAML
+    config_path.write_text(yaml.dump({"model": model_config}))
+    return config_path
+
+
+@pytest.fixture
+def tiny_unet3d_config_path(tmpdir) -> Path:
+    """Config path of a randomly initialised, small `UNet3D` usable offline in safari mode."""
+    return _save_tiny_unet(Path(tmpdir) / "tiny_unet3d", UNet3D, "UNet3D")
+
+
+@pytest.fixture
+def tiny_unet2d_config_path(tmpdir) -> Path:
+    """Config path of a randomly initialised, small `UNet2D` usable offline in safari mode."""
+    return _save_tiny_unet(Path(tmpdir) / "tiny_unet2d", UNet2D, "UNet2D")
@@ -0,0 +1,698 @@
+import os
+import pickle
+import tracemalloc
+
+import h5py
+import numpy as np
+import pytest
+import torch
+import zarr
+
+from plantseg import FILE_BEST_MODEL_PYTORCH
+from plantseg.core.zoo import model_zoo
+from plantseg.functionals.prediction.prediction import (
+    unet_prediction,
+    unet_prediction_batch,
+    unet_prediction_ensemble,
+)
+from plantseg.functionals.prediction.utils import backends, model_cache
+from plantseg.functionals.prediction.utils.array_dataset import (
+    ArrayDataset,
+    mirror_pad,
+    read_mirror_padded_patch,
+)
+from plantseg.functionals.prediction.utils.array_predictor import ArrayPredictor
+from plantseg.functionals.prediction.utils.biio_tiling import (
+    find_block_shape,
+    predict_tiled,
+)
+from plantseg.functionals.prediction.utils.blending import (
+    PatchAccumulator,
+    dequantize,
+    get_blending_window,
+)
+from plantseg.functionals.prediction.utils.prediction_cache import PredictionCache
+from plantseg.functionals.prediction.utils.slice_builder import (
+    ForegroundSliceBuilder,
+    MaskSliceBuilder,
+    PatchIndex,
+    SliceBuilder,
+)
+from plantseg.functionals.prediction.utils.utils import (
+    count_input_voxels,
+    find_exact_tiling_patch_shape,
+)
+from plantseg.training.augs import compute_global_stats
+
+
+@pytest.mark.parametrize(
+    "raw_idx",
+    [
+        (slice(0, 8), slice(0, 16), slice(0, 16)),
+        (slice(4, 12), slice(8, 24), slice(16, 32)),
+        (slice(8, 16), slice(16, 32), slice(16, 32)),
+    ],
+)
+def test_read_mirror_padded_patch(raw_idx):
+    raw = np.random.rand(16, 32, 32)
+    halo = (2, 4, 4)
+    padded = mirror_pad(raw, halo, multichannel=False)
+    expected = padded[
+        tuple(slice(s.start, s.stop + 2 * h) for s, h in zip(raw_idx, halo))
+    ]
+    np.testing.assert_array_equal(
+        read_mirror_padded_patch(raw, raw_idx, halo), expected
+    )
+
+
+@pytest.mark.parametrize("mode", ["uniform", "gaussian", "cosine"])
+@pytest.mark.parametrize("stride", [(4, 48, 48), (1, 8, 8)])
+def test_patch_accumulator_partition_of_unity(mode, stride):
+    raw = np.zeros((12, 100, 90), dtype="float32")
+    slice_builder = SliceBuilder(
+        raw, label_dataset=None, patch_shape=(8, 64, 64), stride_shape=stride
+    )
+    output = np.zeros((2,) + raw.shape, dtype="float32")
+    accumulator = PatchAccumulator(output, slice_builder.raw_slices, mode=mode)
+    for index in slice_builder.raw_slices:
+        accumulator.add(np.ones((2, 8, 64, 64), dtype="float32"), index)
+    np.testing.assert_allclose(output, 1.0, rtol=1e-5)
+
+
+def test_patch_accumulator_uniform_is_average():
+    raw = np.zeros((4, 96, 64), dtype="float32")
+    slice_builder = SliceBuilder(
+        raw, label_dataset=None, patch_shape=(4, 64, 64), stride_shape=(4, 32, 32)
+    )
+    output = np.zeros((1,) + raw.shape, dtype="float32")
+    accumulator = PatchAccumulator(output, slice_builder.raw_slices)
+    for value, index in enumerate(slice_builder.raw_slices):
+        accumulator.add(np.full((1, 4, 64, 64), value, dtype="float32"), index)
+    np.testing.assert_allclose(output[0, :, :32], 0.0)
+    np.testing.assert_allclose(output[0, :, 32:64], 0.5)
+    np.testing.assert_allclose(output[0, :, 64:], 1.0)
+
+
+def test_get_blending_window():
+    window = get_blending_window(64, "gaussian")
+    assert window.max() == 1.0 and window.min() > 0
+    np.testing.assert_allclose(window, window[::-1])
+    with pytest.raises(ValueError):
+        get_blending_window(64, "triangle")
+
+
+@pytest.mark.parametrize("suffix", [".zarr", ".h5"])
+@pytest.mark.parametrize("blending", ["uniform", "gaussian"])
+def test_unet_prediction_lazy(tmp_path, tiny_unet3d_config_path, suffix, blending):
+    raw = np.random.rand(24, 64, 64).astype("float32")
+    kwargs = {
+        "blending": blending,
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (16, 64, 64),
+        "patch_halo": (4, 8, 8),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+    }
+    expected = unet_prediction(raw, **kwargs)
+
+    raw_path = tmp_path / "raw.h5"
+    with h5py.File(raw_path, "w") as f:
+        f.create_dataset("raw", data=raw, chunks=(8, 32, 32))
+    with h5py.File(raw_path, "r") as f:
+        result = unet_prediction(
+            f["raw"], **kwargs, output_path=tmp_path / f"pred{suffix}"
+        )
+
+    if suffix == ".zarr":
+        assert isinstance(result, zarr.Array)
+    else:
+        assert isinstance(result, h5py.Dataset)
+    assert result.shape == expected.shape
+    np.testing.assert_allclose(result[...], expected, rtol=1e-5, atol=1e-6)
+
+    if suffix == ".h5":
+        # the caller owns the file of the returned dataset
+        result.file.close()
+        with h5py.File(tmp_path / f"pred{suffix}", "a") as f:
+            f["predictions"][0, 0, 0, 0] = 0
+        (tmp_path / f"pred{suffix}").unlink()
+
+
+def test_unet_prediction_num_workers(tiny_unet3d_config_path):
+    raw = np.random.rand(16, 64, 64).astype("float32")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "patch_halo": (4, 8, 8),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+    }
+    expected = unet_prediction(raw, **kwargs)
+    result = unet_prediction(raw, **kwargs, num_workers=1, prefetch_factor=1)
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("precision", ["bf16", "fp16-accumulate"])
+def test_unet_prediction_precision(tiny_unet3d_config_path, precision):
+    raw = np.random.rand(16, 64, 64).astype("float32")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "patch_halo": (4, 8, 8),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+    }
+    expected = unet_prediction(raw, **kwargs)
+    result = unet_prediction(raw, **kwargs, precision=precision)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, expected, atol=5e-2)
+
+    with pytest.raises(ValueError):
+        unet_prediction(raw, **kwargs, precision="fp8")
+
+
+@pytest.mark.parametrize("backend", ["torchscript", "onnx"])
+def test_unet_prediction_backend(
+    tmp_path, monkeypatch, tiny_unet3d_config_path, backend
+):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+    monkeypatch.setattr(backends, "PATH_COMPILED_MODELS", tmp_path)
+    raw = np.random.rand(16, 64, 64).astype("float32")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "patch_halo": (4, 8, 8),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+    }
+    expected = unet_prediction(raw, **kwargs)
+    result = unet_prediction(raw, **kwargs, backend=backend)
+    np.testing.assert_allclose(result, expected, atol=1e-3)
+
+    (artifact,) = (tmp_path / backend).iterdir()
+    mtime = artifact.stat().st_mtime_ns
+    result = unet_prediction(raw, **kwargs, backend=backend)  # reuses the artifact
+    assert artifact.stat().st_mtime_ns == mtime
+    np.testing.assert_allclose(result, expected, atol=1e-3)
+
+
+def test_load_backend_falls_back_to_eager(monkeypatch):
+    def _failing_export(*args):
+        raise RuntimeError("export failed")
+
+    monkeypatch.setitem(backends._EXPORTERS, "torchscript", _failing_export)
+    model = torch.nn.Conv3d(1, 1, 3)
+    example = torch.rand(1, 1, 8, 8, 8)
+    assert backends.load_backend(model, "torchscript", example, "cpu") is model
+    with pytest.raises(ValueError):
+        backends.load_backend(model, "tensorrt", example, "cpu")
+
+
+def test_model_cache(tmp_path, tiny_unet3d_config_path, tiny_unet2d_config_path):
+    cache = model_cache.model_cache
+    cache.clear()
+    cached = model_cache.load_model(config_path=tiny_unet3d_config_path)
+    assert not cached.model.training
+    assert cached.halo == model_zoo.compute_3D_halo_for_pytorch3dunet(cached.model)
+    assert model_cache.load_model(config_path=tiny_unet3d_config_path) is cached
+    assert (
+        model_cache.load_model(config_path=tiny_unet3d_config_path, precision="bf16")
+        is not cached
+    )
+    assert len(cache) == 2
+
+    # re-saved weights are reloaded
+    weights_path = tiny_unet3d_config_path.parent / FILE_BEST_MODEL_PYTORCH
+    state = {k: torch.zeros_like(v) for k, v in cached.model.state_dict().items()}
+    torch.save(state, weights_path)
+    os.utime(weights_path, ns=(0, 0))
+    reloaded = model_cache.load_model(config_path=tiny_unet3d_config_path)
+    assert reloaded is not cached
+    assert all(not p.any() for p in reloaded.model.parameters())
+
+    # least recently used models are evicted beyond the memory budget
+    cache.max_bytes = reloaded.n_bytes
+    model_cache.load_model(config_path=tiny_unet2d_config_path)
+    assert len(cache) == 1
+    cache.max_bytes = model_cache.DEFAULT_MAX_BYTES
+    cache.clear()
+
+
+def test_foreground_slice_builder():
+    raw = np.zeros((16, 64, 256), dtype="float32")
+    raw[:, :, :48] = np.random.rand(16, 64, 48) + 1
+    builder = ForegroundSliceBuilder(
+        raw, None, (8, 64, 64), (6, 48, 48), halo_shape=(4, 8, 8)
+    )
+    assert len(builder.grid_slices) == 3 * 5
+    # only the patches at x = 0 and x = 48 (whose halo starts at 40) touch the tissue
+    assert {s[2].start for s in builder.raw_slices} == {0, 48}
+    assert len(builder.raw_slices) == 3 * 2
+
+
+@pytest.mark.parametrize("background_value", [0.0, 0.5])
+def test_unet_prediction_skip_background(
+    tmp_path, tiny_unet3d_config_path, background_value
+):
+    raw = np.zeros((16, 64, 256), dtype="float32")
+    raw[:, :, :48] = np.random.rand(16, 64, 48) + 1
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "patch_halo": (4, 8, 8),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+        "blending": "gaussian",
+    }
+    expected = unet_prediction(raw, **kwargs)
+    skip_kwargs = {"skip_background": True, "background_value": background_value}
+    result = unet_prediction(raw, **kwargs, **skip_kwargs)
+    lazy = unet_prediction(
+        raw, **kwargs, **skip_kwargs, output_path=tmp_path / "pred.zarr"
+    )
+    np.testing.assert_allclose(lazy[...], result, rtol=1e-5, atol=1e-6)
+
+    # voxels covered by predicted patches only are unchanged, skipped ones are background
+    np.testing.assert_allclose(
+        result[..., :96], expected[..., :96], rtol=1e-5, atol=1e-6
+    )
+    np.testing.assert_array_equal(result[..., 112:], background_value)
+
+
+@pytest.mark.parametrize("shape", [(20, 32, 32), (2, 20, 32, 32)])
+def test_compute_global_stats(shape):
+    raw = np.random.randint(0, 60000, size=shape, dtype="uint16")
+    mean, std = compute_global_stats(raw, slab_size=3)
+    assert mean == pytest.approx(raw.astype("float64").mean())
+    assert std == pytest.approx(raw.astype("float64").std())
+
+    mean, std = compute_global_stats(raw, subsampling=2, slab_size=3)
+    subsampled = raw[..., ::2, ::2, ::2].astype("float64")
+    assert mean == pytest.approx(subsampled.mean())
+    assert std == pytest.approx(subsampled.std())
+
+
+def test_unet_prediction_keeps_raw_dtype(tiny_unet3d_config_path):
+    raw = np.random.randint(0, 4096, size=(16, 64, 64), dtype="uint16")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "patch_halo": (4, 8, 8),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+    }
+    expected = unet_prediction(raw.astype("float32"), **kwargs)
+    result = unet_prediction(raw, **kwargs)
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_array_dataset_pads_patches_virtually():
+    raw = np.random.rand(24, 128, 128).astype("float32")
+    halo = (4, 8, 8)
+    slice_builder = SliceBuilder(raw, None, (8, 64, 64), (8, 32, 32))
+    dataset = ArrayDataset(raw, slice_builder, lambda patch: patch, halo_shape=halo)
+    padded = mirror_pad(raw, halo, multichannel=False)
+
+    for patch, raw_idx in dataset:
+        expected = padded[
+            tuple(slice(s.start, s.stop + 2 * h) for s, h in zip(raw_idx, halo))
+        ]
+        np.testing.assert_array_equal(patch, expected)
+        is_interior = all(
+            s.start >= h and s.stop + h <= size
+            for s, h, size in zip(raw_idx, halo, raw.shape)
+        )
+        assert np.shares_memory(patch, raw) == is_interior
+
+
+def test_unet_prediction_num_processes(tiny_unet3d_config_path):
+    raw = np.random.randint(0, 4096, size=(16, 96, 96), dtype="uint16")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "patch_halo": (4, 8, 8),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+        "blending": "gaussian",
+    }
+    expected = unet_prediction(raw, **kwargs)
+    result = unet_prediction(raw, **kwargs, num_processes=3)
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_unet_prediction_batch(tiny_unet2d_config_path):
+    raws = [np.random.rand(96, 96).astype("float32") for _ in range(3)]
+    raws.insert(1, np.random.rand(64, 128).astype("float32"))
+    kwargs = {
+        "input_layout": "YX",
+        "model_name": None,
+        "model_id": None,
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet2d_config_path,
+    }
+    results = unet_prediction_batch(raws, **kwargs, batch_size=2)
+
+    assert len(results) == len(raws)
+    for raw, result in zip(raws, results):
+        expected = unet_prediction(raw, **kwargs)
+        assert result.shape == expected.shape
+        np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_unet_prediction_2d_model_on_stack(tiny_unet2d_config_path):
+    raw = np.random.rand(10, 64, 96).astype("float32")
+    kwargs = {
+        "model_name": None,
+        "model_id": None,
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet2d_config_path,
+    }
+    pmaps = unet_prediction(raw, "ZYX", **kwargs)
+    assert pmaps.shape[1:] == raw.shape
+
+    # slabs of z-slices give the same prediction as the slices predicted one at a time
+    expected = unet_prediction(
+        raw, "ZYX", patch=(1, 64, 96), patch_halo=(0, 0, 0), **kwargs
+    )
+    np.testing.assert_allclose(pmaps, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_unet_prediction_cache(tmp_path, monkeypatch, tiny_unet3d_config_path):
+    raw = np.random.rand(32, 64, 64).astype("float32")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+        "use_cache": True,
+        "cache_dir": tmp_path,
+    }
+    pmaps = unet_prediction(raw, **kwargs)
+    assert len(list(tmp_path.glob("*.zarr"))) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The cached prediction should be reused")
+
+    monkeypatch.setattr(ArrayPredictor, "__call__", fail)
+    np.testing.assert_array_equal(unet_prediction(raw, **kwargs), pmaps)
+    monkeypatch.undo()
+
+    # other data or parameters are predicted again
+    unet_prediction(raw, **kwargs, blending="gaussian")
+    unet_prediction(raw[::-1].copy(), **kwargs)
+    assert len(list(tmp_path.glob("*.zarr"))) == 3
+
+
+def test_prediction_cache_evicts_least_recently_used(tmp_path):
+    cache = PredictionCache(tmp_path)
+    pmaps = np.random.rand(1, 8, 64, 64).astype("float32")
+    for key in ("a", "b", "c"):
+        cache.put(key, pmaps)
+        os.utime(cache.entry_path(key), (0, {"a": 1, "b": 2, "c": 3}[key]))
+    assert cache.get("a") is not None  # "a" becomes the most recently used
+
+    entry_size = sum(
+        f.stat().st_size for f in cache.entry_path("a").rglob("*") if f.is_file()
+    )
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+    assert cache.get("b") is None
+    np.testing.assert_array_equal(cache.get("a"), pmaps)
+    np.testing.assert_array_equal(cache.get("c"), pmaps)
+
+
+def test_find_block_shape():
+    # grows the smallest axis first and stays within the memory budget
+    block = find_block_shape(
+        (100, 500, 500), ((1, 1), (16, 16), (16, 16)), (0, 8, 8), 32 * 64 * 64
+    )
+    assert block == (56, 48, 48)
+    assert np.prod(block) <= 32 * 64 * 64
+    # fixed-size axes are not grown, axes covering the volume stop growing
+    block = find_block_shape(
+        (1, 40, 500), ((1, 0), (16, 16), (16, 16)), (0, 4, 4), 10**6
+    )
+    assert block == (1, 48, 512)
+    # the minimal shape is returned even if it exceeds the budget
+    assert find_block_shape(
+        (64, 64, 64), ((8, 8), (32, 32), (32, 32)), (0, 0, 0), 1
+    ) == (8, 32, 32)
+
+
+@pytest.mark.parametrize("blending", ["uniform", "gaussian"])
+@pytest.mark.parametrize("crop", [0, 2])
+def test_predict_tiled(blending, crop):
+    raw = np.random.rand(2, 10, 37, 45).astype("float32")
+    halo = (1, 4, 4)
+
+    def predict_block(block):
+        assert block.shape[1:] == (8, 24, 24)
+        prediction = block[
+            :, :, crop : block.shape[2] - crop, crop : block.shape[3] - crop
+        ]
+        return {"identity": prediction, "mean": prediction.mean(axis=0, keepdims=True)}
+
+    outputs = predict_tiled(
+        raw, predict_block, (8, 24, 24), halo, blending=blending, disable_tqdm=True
+    )
+    assert np.allclose(outputs["identity"], raw, atol=1e-5)
+    assert np.allclose(outputs["mean"], raw.mean(axis=0, keepdims=True), atol=1e-5)
+
+
+def test_predict_tiled_volume_smaller_than_block():
+    raw = np.random.rand(1, 1, 10, 12).astype("float32")
+    outputs = predict_tiled(
+        raw, lambda block: {"out": block * 2}, (1, 32, 32), (0, 2, 2), disable_tqdm=True
+    )
+    assert outputs["out"].shape == raw.shape
+    assert np.allclose(outputs["out"], raw * 2)
+
+
+def test_unet_prediction_pyramid(tiny_unet3d_config_path):
+    raw = np.random.rand(16, 256, 256).astype("float32")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "patch_halo": (2, 4, 4),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+    }
+    expected = unet_prediction(raw, **kwargs)
+
+    # boundary signal everywhere: every patch is predicted at full resolution
+    result = unet_prediction(raw, **kwargs, pyramid=True, pyramid_threshold=-1.0)
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+
+    # no boundary signal: the upsampled coarse prediction is returned
+    result = unet_prediction(raw, **kwargs, pyramid=True, pyramid_threshold=2.0)
+    assert result.shape == expected.shape
+    assert not np.allclose(result, expected)
+
+
+def test_mask_slice_builder():
+    raw = np.zeros((16, 64, 256), dtype="float32")
+    mask = np.zeros((8, 16, 64), dtype=bool)
+    mask[:, :, 2] = True  # x in [8, 12)
+    builder = MaskSliceBuilder(raw, None, (8, 64, 64), (6, 48, 48), mask, (2, 4, 4))
+    assert len(builder.grid_slices) == 3 * 5
+    assert {s[2].start for s in builder.raw_slices} == {0}
+    # a fractional downsampling maps mask voxel 2 to x in [10, 15)
+    builder = MaskSliceBuilder(
+        raw, None, (8, 64, 64), (6, 48, 48), mask, (2, 4, 5), halo_shape=(0, 0, 40)
+    )
+    assert {s[2].start for s in builder.raw_slices} == {0, 48}
+
+
+def test_unet_prediction_ensemble(tiny_unet3d_config_path, tiny_unet2d_config_path):
+    raw = np.random.rand(16, 64, 128).astype("float32")
+    kwargs = {
+        "input_layout": "ZYX",
+        "patch": (8, 64, 64),
+        "patch_halo": (2, 4, 4),
+        "device": "cpu",
+        "disable_tqdm": True,
+    }
+    expected = unet_prediction(
+        raw,
+        model_name=None,
+        model_id=None,
+        config_path=tiny_unet3d_config_path,
+        **kwargs,
+    )
+
+    config_paths = [tiny_unet3d_config_path, tiny_unet3d_config_path]
+    pmaps = unet_prediction_ensemble(raw, config_paths=config_paths, **kwargs)
+    assert len(pmaps) == 2
+    for pmap in pmaps:
+        np.testing.assert_allclose(pmap, expected, rtol=1e-5, atol=1e-6)
+
+    average = unet_prediction_ensemble(
+        raw, config_paths=config_paths, average=True, **kwargs
+    )
+    np.testing.assert_allclose(average, expected, rtol=1e-5, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        unet_prediction_ensemble(
+            raw,
+            config_paths=[tiny_unet3d_config_path, tiny_unet2d_config_path],
+            **kwargs,
+        )
+
+
+# every voxel is rounded once, by at most half a quantization level
+@pytest.mark.parametrize(
+    "output_dtype, atol", [("float16", 5e-4), ("uint8", 0.51 / 255)]
+)
+def test_unet_prediction_output_dtype(tiny_unet3d_config_path, output_dtype, atol):
+    raw = np.random.rand(16, 96, 96).astype("float32")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "patch_halo": (2, 4, 4),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+        "blending": "gaussian",
+    }
+    expected = unet_prediction(raw, **kwargs)
+    result = unet_prediction(raw, **kwargs, output_dtype=output_dtype)
+    assert result.dtype == output_dtype
+    np.testing.assert_allclose(dequantize(result), expected, atol=atol)
+
+
+def test_array_predictor_output_channels():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Conv3d(1, 3, 1), torch.nn.Sigmoid())
+    raw = np.random.rand(16, 64, 96).astype("float32")
+    slice_builder = SliceBuilder(raw, None, (8, 64, 64), (6, 48, 48))
+    dataset = ArrayDataset(
+        raw, slice_builder, lambda patch: torch.from_numpy(patch.copy())[None]
+    )
+
+    kwargs = {
+        "model": model,
+        "in_channels": 1,
+        "out_channels": 3,
+        "device": "cpu",
+        "patch": (8, 64, 64),
+        "patch_halo": (0, 0, 0),
+        "single_batch_mode": True,
+        "headless": False,
+        "disable_tqdm": True,
+    }
+    expected = ArrayPredictor(**kwargs)(dataset)
+    result = ArrayPredictor(**kwargs, output_channels=[2, 0])(dataset)
+    assert result.shape == (2,) + raw.shape
+    np.testing.assert_allclose(result, expected[[2, 0]], rtol=1e-6)
+
+
+def test_find_exact_tiling_patch_shape():
+    assert find_exact_tiling_patch_shape((100, 500, 300), (80, 160, 160)) == (
+        50,
+        125,
+        150,
+    )
+    # patches stay within the minimal shape of `SliceBuilder`
+    assert find_exact_tiling_patch_shape((10, 65, 64), (8, 64, 64)) == (5, 64, 64)
+
+
+def test_count_input_voxels():
+    # 3 x 3 overlapping patches of 64 in 160 with stride 48 vs 2 x 2 exact patches of 80
+    assert count_input_voxels((1, 160, 160), (1, 64, 64), (0, 8, 8), (1, 48, 48)) == (
+        9 * 80 * 80
+    )
+    assert count_input_voxels((1, 160, 160), (1, 80, 80), (0, 8, 8), (1, 80, 80)) == (
+        4 * 96 * 96
+    )
+
+
+def test_unet_prediction_overlap_free_tiling(tiny_unet3d_config_path):
+    raw = np.random.rand(16, 128, 128).astype("float32")
+    kwargs = {
+        "input_layout": "ZYX",
+        "model_name": None,
+        "model_id": None,
+        "patch": (8, 64, 64),
+        "device": "cpu",
+        "disable_tqdm": True,
+        "config_path": tiny_unet3d_config_path,
+    }
+    # the model halo covers the receptive field: the stride is the patch shape
+    np.testing.assert_array_equal(
+        unet_prediction(raw, **kwargs, tiling="auto"),
+        unet_prediction(raw, **kwargs, stride_ratio=1.0),
+    )
+    # a smaller halo keeps the overlap
+    np.testing.assert_array_equal(
+        unet_prediction(raw, **kwargs, patch_halo=(0, 0, 0), tiling="auto"),
+        unet_prediction(raw, **kwargs, patch_halo=(0, 0, 0)),
+    )
+
+
+@pytest.mark.parametrize("shape", [(20, 150, 130), (2, 20, 150, 130)])
+def test_patch_index(shape):
+    raw = np.zeros(shape, dtype="uint8")
+    patch, stride = (8, 64, 64), (6, 48, 48)
+    expected = SliceBuilder._build_slices(raw, patch, stride)
+    index = PatchIndex.from_grid(raw.shape, patch, stride)
+
+    assert len(index) == len(expected)
+    assert list(index) == expected
+    assert index[-1] == expected[-1]
+    with pytest.raises(IndexError):
+        index[len(index)]
+
+    shards = [index.shard(3, rank) for rank in range(3)]
+    assert [s for shard in shards for s in shard] == expected
+    subset = index[np.arange(len(index)) % 2 == 0]
+    assert list(subset) == expected[::2]
+    assert pickle.loads(pickle.dumps(subset))[1] == expected[2]
+    assert index.axis_intervals() == [
+        sorted({(s.start, s.stop) for s in axis})
+        for axis in zip(*(idx[-3:] for idx in expected))
+    ]
+
+
+def test_patch_index_item_access():
+    index = PatchIndex.from_grid((101, 201, 201), (2, 4, 4), (1, 2, 2))
+    assert len(index) == 100**3
+
+    # single items are computed from the grid, without an array over all the patches
+    tracemalloc.start()
+    items = [index[i] for i in range(len(index) - 1000, len(index))]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < len(index)
+    assert items[-1] == (slice(99, 101), slice(197, 201), slice(197, 201))
+    assert list(index[-3:]) == items[-3:]
@@ -4,11 +4,17 @@ import pytest
 import torch
 
 from plantseg.core.zoo import model_zoo
+from plantseg.functionals.prediction.utils import autotune
 from plantseg.functionals.prediction.utils.size_finder import (
+    available_memory_bytes,
+    estimate_activation_bytes,
     find_a_max_patch_shape,
     find_batch_size,
+    find_max_shape_by_memory,
     find_patch_and_halo_shapes,
+    find_slice_patch_and_halo_shapes,
 )
+from plantseg.training.model import UNet2D, UNet3D
 
 IN_GITHUB_ACTIONS = (
     os.getenv("GITHUB_ACTIONS") == "true"
@@ -101,6 +107,22 @@ def test_find_patch_and_halo_shapes(
     assert result == expected
 
 
+@pytest.mark.parametrize(
+    "full_volume_shape, expected",
+    [
+        ((500, 512, 512), ((1, 512, 512), (0, 0, 0))),
+        ((500, 512, 5000), ((1, 512, 1960), (0, 0, 44))),
+        ((500, 5000, 512), ((1, 1960, 512), (0, 44, 0))),
+        ((10, 3000, 3000), ((1, 936, 936), (0, 44, 44))),
+    ],
+)
+def test_find_slice_patch_and_halo_shapes(full_volume_shape, expected):
+    result = find_slice_patch_and_halo_shapes(
+        full_volume_shape, (1, 1024, 1024), (0, 44, 44)
+    )
+    assert result == expected
+
+
 @pytest.mark.skipif(
     GPU_DEVICE_NAME not in ALL_TESTED_GPUS,
     reason="Measured devices are not available.",
@@ -140,3 +162,59 @@ def test_find_patch_shape_error_handling():
     if "NVIDIA A40" == GPU_DEVICE_NAME:
         print("NVIDIA A40 tested")
         assert found_patch_shape == (352, 352, 352)
+
+
+@pytest.mark.parametrize("model_class", [UNet2D, UNet3D])
+def test_estimate_activation_bytes(model_class):
+    model = model_class(1, 1, f_maps=[8, 16, 32], num_groups=4)
+    small = estimate_activation_bytes(model, 1, (32, 64, 64))
+    large = estimate_activation_bytes(model, 1, (32, 128, 128))
+    assert 0 < small < large
+    assert estimate_activation_bytes(
+        model, 1, (32, 64, 64), batch_size=4
+    ) == pytest.approx(4 * small, rel=1e-6)
+    # the skip connections of the first level alone have to fit
+    n_voxels = 64 * 64 if model_class is UNet2D else 32 * 64 * 64
+    assert small >= 8 * n_voxels * 4
+
+
+def test_find_max_shape_by_memory():
+    model = UNet3D(1, 1, f_maps=[8, 16, 32], num_groups=4)
+    budget = 256 * 2**20
+    shape = find_max_shape_by_memory(model, 1, budget)
+    assert estimate_activation_bytes(model, 1, shape) <= budget
+    larger = tuple(s + 16 for s in shape)
+    assert estimate_activation_bytes(model, 1, larger) > budget
+
+
+def test_find_a_max_patch_shape_cpu():
+    model = UNet3D(1, 1, f_maps=[8, 16, 32], num_groups=4)
+    assert find_a_max_patch_shape(model, 1, "cpu") == (256, 256, 256)
+    assert find_a_max_patch_shape(
+        UNet2D(1, 1, f_maps=[4, 8], num_groups=2), 1, "cpu"
+    ) == (1, 1024, 1024)
+
+    shape = find_a_max_patch_shape(model, 1, "cpu", memory_based=True)
+    assert shape == find_max_shape_by_memory(
+        model, 1, available_memory_bytes("cpu") // 2
+    )
+
+
+def test_autotune_prediction(tmp_path, monkeypatch):
+    monkeypatch.setattr(autotune, "PATH_AUTOTUNE", tmp_path / "autotune.json")
+    model = UNet2D(1, 1, f_maps=[4, 8], num_groups=2).eval()
+    tuned = autotune.autotune_prediction(
+        model, 1, (0, 8, 8), "cpu", memory_budget=32 * 2**20, time_budget=2.0
+    )
+    assert tuned.input_shape[0] == 1
+    assert tuned.batch_size >= 1 and tuned.voxels_per_second > 0
+    assert (
+        estimate_activation_bytes(model, 1, tuned.input_shape, tuned.batch_size)
+        <= 32 * 2**20
+    )
+
+    def _no_timing(*args):
+        raise AssertionError("persisted results must be reused")
+
+    monkeypatch.setattr(autotune, "_time_forward", _no_timing)
+    assert autotune.autotune_prediction(model, 1, (0, 8, 8), "cpu") == tuned
@@ -1,7 +1,26 @@
+import tracemalloc
+
 import numpy as np
 import pytest
+import zarr
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
-from plantseg.functionals.segmentation import dt_watershed
+from plantseg.functionals.segmentation import dt_watershed, segmentation_sweep
+from plantseg.functionals.segmentation.agglomeration_tree import (
+    AgglomerationTree,
+    average_linkage_merges,
+)
+from plantseg.functionals.segmentation.blockwise import (
+    blockwise_multicut,
+    blockwise_segmentation,
+)
+from plantseg.functionals.segmentation.sweep import warm_start_chains
+from plantseg.functionals.segmentation.utils import (
+    affinities_from_boundaries,
+    shift_affinities,
+)
 
 shapes = [(32, 64, 64), (64, 64)]
 stacked_options = [True, False]
@@ -21,3 +40,182 @@ def test_dt_watershed(shape, stacked):
         assert result.shape == mock_data.shape
         assert result.dtype == np.uint64
         assert result.max() > result.min() >= 0
+
+
+def _label_block(block, mask):
+    return ndimage.label(block < 0.5)[0]
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_blockwise_segmentation(tmp_path, n_workers):
+    rng = np.random.default_rng(0)
+    shape = (40, 96, 96)
+    grid = np.indices(shape)
+    data = np.ones(shape, dtype="float32")
+    for center in rng.integers(0, shape, size=(30, 3)):
+        radius = rng.integers(4, 9)
+        distance = sum((g - c) ** 2 for g, c in zip(grid, center))
+        data[distance < radius**2] = 0.0
+
+    out = zarr.open_array(
+        str(tmp_path / "seg.zarr"),
+        mode="w",
+        shape=shape,
+        chunks=(16, 32, 32),
+        dtype="uint32",
+    )
+    result = blockwise_segmentation(
+        data,
+        _label_block,
+        block_shape=(16, 32, 32),
+        halo=(4, 8, 8),
+        n_workers=n_workers,
+        out=out,
+    )
+    assert result is out
+
+    # objects crossing block faces are stitched: labels match the whole-volume labels one to one
+    expected = _label_block(data, None)
+    pairs = np.unique(np.stack([expected.ravel(), out[...].ravel()], axis=1), axis=0)
+    assert len(pairs) == len(np.unique(pairs[:, 0])) == len(np.unique(pairs[:, 1]))
+    assert out[...].max() == expected.max()
+
+
+def _merge_attractive_edges(uv_ids, n_nodes, costs, time_limit):
+    attractive = uv_ids[costs > 0]
+    adjacency = coo_matrix(
+        (np.ones(len(attractive)), (attractive[:, 0], attractive[:, 1])),
+        shape=(n_nodes, n_nodes),
+    )
+    return connected_components(adjacency, directed=False)[1]
+
+
+def _superpixel_problem():
+    # 4x4x4 superpixels grouped into 2x2x2 cells, attractive edges inside cells and repulsive between them
+    superpixels = np.arange(64).reshape(4, 4, 4).repeat(4, 0).repeat(4, 1).repeat(4, 2)
+    cells = np.arange(8).reshape(2, 2, 2).repeat(2, 0).repeat(2, 1).repeat(2, 2).ravel()
+    uv_ids = []
+    for axis in range(3):
+        lower = np.take(superpixels, range(15), axis=axis).ravel()
+        upper = np.take(superpixels, range(1, 16), axis=axis).ravel()
+        uv_ids.append(np.stack([lower, upper], axis=1)[lower != upper])
+    uv_ids = np.unique(np.sort(np.concatenate(uv_ids), axis=1), axis=0)
+    costs = np.where(cells[uv_ids[:, 0]] == cells[uv_ids[:, 1]], 1.0, -1.0)
+    return superpixels, uv_ids, costs, cells
+
+
+@pytest.mark.parametrize("n_levels", [0, 1, 2])
+def test_blockwise_multicut(n_levels):
+    superpixels, uv_ids, costs, cells = _superpixel_problem()
+    node_labels = blockwise_multicut(
+        uv_ids,
+        costs,
+        superpixels,
+        solver=_merge_attractive_edges,
+        block_shape=(8, 8, 8),
+        n_levels=n_levels,
+        n_threads=2,
+    )
+    assert node_labels.shape == (64,)
+    pairs = np.unique(np.stack([cells, node_labels], axis=1), axis=0)
+    assert len(pairs) == len(np.unique(cells)) == len(np.unique(node_labels))
+
+
+def test_blockwise_multicut_time_limit():
+    superpixels, uv_ids, costs, _ = _superpixel_problem()
+    node_labels = blockwise_multicut(
+        uv_ids,
+        costs,
+        superpixels,
+        solver=_merge_attractive_edges,
+        block_shape=(8, 8, 8),
+        time_limit=0.0,
+    )
+    np.testing.assert_array_equal(node_labels, np.arange(64))
+
+
+@pytest.mark.parametrize(
+    "offsets", [[[0, 0, 1], [0, 1, 0], [1, 0, 0]], [[0, 0, 4], [0, -3, 0], [-5, 2, 7]]]
+)
+def test_affinities_from_boundaries(offsets):
+    boundary_pmaps = np.random.default_rng(0).random((16, 128, 128)).astype("float32")
+    expected = 1 - shift_affinities(np.stack([boundary_pmaps] * 3), offsets)
+
+    tracemalloc.start()
+    affinities = affinities_from_boundaries(boundary_pmaps, offsets)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    np.testing.assert_allclose(affinities, expected)
+    assert affinities.dtype == np.float32
+    assert peak < 3.1 * boundary_pmaps.nbytes
+
+
+def test_warm_start_chains():
+    assert warm_start_chains([0.6, 0.2, 0.4, 0.8, 0.3], 2) == [
+        [0.2, 0.3],
+        [0.4, 0.6, 0.8],
+    ]
+    assert warm_start_chains([0.5, 0.1], 4) == [[0.1], [0.5]]
+    assert warm_start_chains([0.5], 1) == [[0.5]]
+
+
+@pytest.mark.parametrize("return_segmentations", [True, False])
+def test_segmentation_sweep(return_segmentations):
+    boundary_pmaps = np.random.default_rng(0).random((32, 64, 64)).astype("float32")
+    superpixels = dt_watershed(boundary_pmaps, min_size=10)
+
+    records = segmentation_sweep(
+        boundary_pmaps,
+        superpixels,
+        betas=(0.6, 0.4),
+        post_minsizes=(0, 50),
+        modes=("multicut", "gasp"),
+        n_workers=2,
+        return_segmentations=return_segmentations,
+    )
+
+    assert len(records) == 8
+    assert [(r["mode"], r["beta"], r["post_minsize"]) for r in records[:4]] == [
+        ("multicut", 0.4, 0),
+        ("multicut", 0.4, 50),
+        ("multicut", 0.6, 0),
+        ("multicut", 0.6, 50),
+    ]
+    for record in records:
+        assert record["n_segments"] > 0
+        assert (record["energy"] is None) == (record["mode"] == "gasp")
+        if return_segmentations:
+            assert record["segmentation"].shape == superpixels.shape
+        else:
+            assert "segmentation" not in record
+
+
+def test_average_linkage_merges():
+    # 0 - 1 - 2 - 3 chain, plus an edge 0 - 2 lowering the average between {0, 1} and {2, 3}
+    uv_ids = np.array([[0, 1], [1, 2], [2, 3], [0, 2]])
+    affinities = np.array([0.9, 0.6, 0.8, 0.1])
+    edge_sizes = np.array([1.0, 1.0, 1.0, 3.0])
+    merges, heights = average_linkage_merges(uv_ids, affinities, edge_sizes, n_nodes=4)
+
+    assert [set(m) for m in merges[:2].tolist()] == [{0, 1}, {2, 3}]
+    np.testing.assert_allclose(heights, [0.9, 0.8, (0.6 + 0.3) / 4])
+
+
+def test_agglomeration_tree_cut():
+    superpixels = np.arange(4).repeat(8).reshape(1, 4, 8)
+    merges, heights = average_linkage_merges(
+        np.array([[0, 1], [1, 2], [2, 3]]),
+        np.array([0.9, 0.2, 0.8]),
+        np.ones(3),
+        n_nodes=4,
+    )
+    tree = AgglomerationTree(superpixels, merges, heights)
+
+    for beta, n_segments in [(0.95, 4), (0.85, 3), (0.5, 2), (0.1, 1)]:
+        segmentation = tree.cut(beta)
+        assert segmentation.shape == superpixels.shape
+        assert len(np.unique(segmentation)) == n_segments
+        assert segmentation.min() >= 1
+    # the average-linkage tree cut merges clusters whose average affinity is strictly above beta
+    assert len(np.unique(tree.cut(0.8))) == 3
@@ -8,7 +8,12 @@ from plantseg.core.image import (
     SemanticType,
 )
 from plantseg.io.voxelsize import VoxelSize
-from plantseg.tasks.prediction_tasks import biio_prediction_task, unet_prediction_task
+from plantseg.tasks.prediction_tasks import (
+    biio_prediction_task,
+    unet_prediction_batch_task,
+    unet_prediction_task,
+)
+from plantseg.tasks.workflow_handler import workflow_handler
 
 
 @pytest.mark.parametrize(
@@ -46,6 +51,40 @@ def test_unet_prediction_task(shape, layout, model_name):
     assert result.shape == mock_data.shape
 
 
+def test_unet_prediction_batch_task(tiny_unet2d_config_path):
+    images = []
+    for i, shape in enumerate([(64, 64), (64, 64), (64, 96)]):
+        property = ImageProperties(
+            name=f"test_{i}",
+            voxel_size=VoxelSize(voxels_size=(1.0, 1.0, 1.0), unit="um"),
+            semantic_type=SemanticType.RAW,
+            image_layout=ImageLayout.YX,
+            original_voxel_size=VoxelSize(voxels_size=(1.0, 1.0, 1.0), unit="um"),
+        )
+        data = np.random.rand(*shape).astype("float32")
+        images.append(PlantSegImage(data=data, properties=property))
+
+    workflow_handler.clean_dag()
+    result = unet_prediction_batch_task(
+        images=images,
+        model_name=None,
+        model_id=None,
+        config_path=tiny_unet2d_config_path,
+        device="cpu",
+    )
+
+    assert len(result) == len(images)
+    for image, prediction in zip(images, result):
+        assert prediction.semantic_type == SemanticType.PREDICTION
+        assert prediction.image_layout == image.image_layout
+        assert prediction.shape == image.shape
+
+    (task,) = workflow_handler.dag.list_tasks
+    assert task.images_inputs == {"images": [image.unique_name for image in images]}
+    assert task.required_inputs == {image.unique_name for image in images}
+    workflow_handler.clean_dag()
+
+
 @pytest.mark.parametrize(
     "raw_fixture_name, input_layout, model_id",
     (